@@ -0,0 +1,223 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+"""
+Crash-safe writing of the pickled objects that make up a checkpoint.
+
+Files are never modified in place. Each write goes to a temporary file that
+is synced to disk and then renamed over the old file, so readers see either
+the old or the new contents, never a partial file. Because of this, backups
+can be hard links to the current files rather than copies.
+
+Objects that change every stage, like the data store and the runner, are
+written in full each time they change; only objects that are unchanged since
+the last write are skipped. Large parts of them that never change, like the
+PDB writer held by the data store, can be stored once by their content hash
+and referenced from the file, so the file written every stage stays small.
+Such files must be read with :func:`load_object`. The rename of the files
+written every stage is not synced to disk, so a crash of the machine (not
+just of the process) can lose the latest write and leave the previous
+checkpoint in place. Immutable objects and backups are always synced.
+
+"""
+
+import hashlib
+import io
+import os
+import pickle
+import shutil
+import tempfile
+from typing import Any, Dict, Iterable, Set, Tuple
+
+
+def atomic_write(path: str, data: bytes, sync_directory: bool = True) -> None:
+    """
+    Atomically replace the contents of a file.
+
+    :param path: path of the file to write
+    :param data: the new contents
+    :param sync_directory: sync the directory so that the rename survives a
+        crash of the machine
+
+    The contents are always synced before the rename, so the file is never
+    partially written. Without ``sync_directory``, a crash of the machine can
+    leave the old contents in place.
+
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        # mkstemp creates the file with mode 0600
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if sync_directory:
+        _fsync_directory(directory)
+
+
+def load_object(path: str, objects_dir: str) -> Any:
+    """
+    Load a pickled object written by :meth:`CheckpointWriter.write_object`.
+
+    :param path: path of the file to read
+    :param objects_dir: directory holding the shared objects it refers to
+    :return: the unpickled object
+
+    """
+    with open(path, "rb") as obj_file:
+        return _SharedUnpickler(obj_file, objects_dir).load()
+
+
+def link_or_copy(src: str, dest: str) -> None:
+    """
+    Atomically make dest refer to the contents of src.
+
+    :param src: path of the existing file
+    :param dest: path to create or replace
+
+    A hard link is used if possible, otherwise the file is copied. This is
+    only safe for files that are written with :func:`atomic_write`, as
+    modifying src in place would also modify dest.
+
+    """
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        return
+    directory = os.path.dirname(dest) or "."
+    tmp_path = os.path.join(directory, f".tmp_link_{os.path.basename(dest)}")
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        # e.g. a filesystem without hard links
+        shutil.copy(src, tmp_path)
+    os.replace(tmp_path, dest)
+    _fsync_directory(directory)
+
+
+class CheckpointWriter:
+    """
+    Write pickled objects atomically, skipping unchanged ones.
+
+    :param objects_dir: directory for content-addressed immutable objects
+
+    The digest of the last contents written to each path is remembered, so
+    writing an object that has not changed since it was last written does
+    nothing. Changed objects are written in full without syncing the
+    directory, as they are rewritten every stage and losing the latest one
+    only falls back to the previous checkpoint. Immutable objects, like the
+    system, are stored once in ``objects_dir`` under their content hash and
+    the requested path is linked to them.
+
+    """
+
+    def __init__(self, objects_dir: str) -> None:
+        self.objects_dir = objects_dir
+        self._digests: Dict[str, str] = {}
+        # id -> (object, content hash) of the shared objects already stored
+        self._shared: Dict[int, Tuple[Any, str]] = {}
+
+    def write_object(self, obj: Any, path: str, shared: Iterable[Any] = ()) -> bool:
+        """
+        Pickle an object and write it to path.
+
+        :param obj: the object to pickle
+        :param path: path of the file to write
+        :param shared: objects referenced by obj that never change, which are
+            stored once in ``objects_dir`` and referenced by their content
+            hash, the file must then be read with :func:`load_object`
+        :return: True if the file was written, False if it was unchanged
+
+        """
+        shared_ids = set(id(o) for o in shared)
+        if shared_ids:
+            buffer = io.BytesIO()
+            _SharedPickler(buffer, self, shared_ids).dump(obj)
+            data = buffer.getvalue()
+        else:
+            data = pickle.dumps(obj)
+        digest = hashlib.sha256(data).hexdigest()
+        if self._digests.get(path) == digest and os.path.exists(path):
+            return False
+        atomic_write(path, data, sync_directory=False)
+        self._digests[path] = digest
+        return True
+
+    def write_immutable(self, obj: Any, path: str) -> str:
+        """
+        Store an object by its content hash and link path to it.
+
+        :param obj: the object to pickle
+        :param path: path that should refer to the object
+        :return: the content hash of the object
+
+        """
+        data = pickle.dumps(obj)
+        digest = hashlib.sha256(data).hexdigest()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        object_path = os.path.join(self.objects_dir, f"{digest}.dat")
+        if not os.path.exists(object_path):
+            atomic_write(object_path, data)
+        link_or_copy(object_path, path)
+        self._digests[path] = digest
+        return digest
+
+    def _store_shared(self, obj: Any) -> str:
+        # each shared object is only pickled the first time it is written
+        if id(obj) not in self._shared:
+            data = pickle.dumps(obj)
+            digest = hashlib.sha256(data).hexdigest()
+            os.makedirs(self.objects_dir, exist_ok=True)
+            object_path = os.path.join(self.objects_dir, f"{digest}.dat")
+            if not os.path.exists(object_path):
+                atomic_write(object_path, data)
+            self._shared[id(obj)] = (obj, digest)
+        return self._shared[id(obj)][1]
+
+
+class _SharedPickler(pickle.Pickler):
+    def __init__(
+        self, file: io.BytesIO, writer: CheckpointWriter, shared_ids: Set[int]
+    ) -> None:
+        super(_SharedPickler, self).__init__(file)
+        self._writer = writer
+        self._shared_ids = shared_ids
+
+    def persistent_id(self, obj: Any) -> Any:
+        if id(obj) in self._shared_ids:
+            return self._writer._store_shared(obj)
+        return None
+
+
+class _SharedUnpickler(pickle.Unpickler):
+    def __init__(self, file: Any, objects_dir: str) -> None:
+        super(_SharedUnpickler, self).__init__(file)
+        self._objects_dir = objects_dir
+
+    def persistent_load(self, pid: Any) -> Any:
+        path = os.path.join(self._objects_dir, f"{pid}.dat")
+        with open(path, "rb") as obj_file:
+            return pickle.load(obj_file)
+
+
+def _fsync_directory(directory: str) -> None:
+    # make the rename itself durable
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -13,10 +13,12 @@ import platform
 from collections import defaultdict, namedtuple
 import contextlib
 import logging
+import multiprocessing as mp
+from multiprocessing import shared_memory
 import sys
 from meld.util import log_timing
 from meld.system.state import SystemState
-from typing import Dict, List, Tuple, Any, Optional
+from typing import Callable, Dict, Iterator, List, Tuple, Any, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -39,12 +41,47 @@ def mpi_excepthook(type, value, traceback):
 sys.excepthook = mpi_excepthook
 
 
+# namedtuple to hold a segment of simulation sent to a worker
+# in asynchronous replica exchange
+Segment = namedtuple("Segment", "index alpha state minimize step")
+
+# tag for the messages of asynchronous replica exchange
+SEGMENT_TAG = 17
+
+
 class MPICommunicator:
     """
     Class to handle communications between master and slaves using MPI.
 
     :param n_atoms: number of atoms
     :param n_replicas: number of replicas
+    :param timeout: number of seconds to wait for a communication to complete
+    :param transport: how states are sent between nodes, either ``"pickle"``
+        or ``"buffer"``
+    :param replicas_per_rank: number of replicas run by each rank
+    :param pipeline: overlap the exchange of states with the computation of
+        energies
+
+    With ``transport="pickle"``, each :class:`SystemState` is pickled and sent
+    with the lowercase mpi4py routines. With ``transport="buffer"``, states are
+    packed into preallocated contiguous float64 arrays and sent with the
+    buffer-based routines, which avoids pickling and most copies. In buffer
+    mode, there must be exactly ``n_replicas // replicas_per_rank`` MPI
+    processes.
+
+    By default, each rank runs a single replica. With ``replicas_per_rank=K``,
+    there are ``n_replicas / K`` ranks and rank ``r`` runs the contiguous
+    slice of replicas ``r * K`` to ``(r + 1) * K - 1``. The ranks then
+    communicate with the batch methods, e.g.
+    :meth:`broadcast_state_batches_to_slaves`, which move the alphas, states,
+    and energies of a whole slice at once.
+
+    With ``pipeline=True``, which requires ``transport="buffer"`` and one
+    replica per rank, :meth:`iter_states_for_energy_calc` posts a nonblocking
+    broadcast of the state from each rank and yields the states in the order
+    they arrive, so that the energy of each can be computed while the rest
+    are still in flight. The energies are then gathered with a nonblocking
+    gather, so the slaves do not wait for the master to receive them.
 
     .. note::
         creating an MPI communicator will not actually initialize MPI.
@@ -53,21 +90,57 @@ class MPICommunicator:
 
     _mpi_comm: MPI.Comm
 
-    def __init__(self, n_atoms: int, n_replicas: int, timeout: int = 600) -> None:
-        # We're not using n_atoms and n_replicas, but if we switch
-        # to more efficient buffer-based MPI routines, we'll need them.
+    def __init__(
+        self,
+        n_atoms: int,
+        n_replicas: int,
+        timeout: int = 600,
+        transport: str = "pickle",
+        replicas_per_rank: int = 1,
+        pipeline: bool = False,
+    ) -> None:
+        if transport not in ["pickle", "buffer"]:
+            raise ValueError(f"Unknown value for transport={transport}")
+        if pipeline and (transport != "buffer" or replicas_per_rank != 1):
+            raise ValueError(
+                "pipeline requires transport='buffer' and one replica per rank"
+            )
+        if replicas_per_rank < 1 or n_replicas % replicas_per_rank:
+            raise ValueError(
+                f"n_replicas={n_replicas} is not a multiple of "
+                f"replicas_per_rank={replicas_per_rank}"
+            )
         self._n_atoms = n_atoms
         self._n_replicas = n_replicas
         self._timeout = timeout
         self._timeout_message = f"Call to {{:s}} did not complete in {timeout} seconds"
+        self._transport = transport
+        self._replicas_per_rank = replicas_per_rank
+        self._pipeline = pipeline
 
     def __getstate__(self) -> Dict[str, Any]:
-        # don't pickle _mpi_comm
-        return dict((k, v) for (k, v) in self.__dict__.items() if not k == "_mpi_comm")
+        # don't pickle _mpi_comm or the communication buffers
+        excluded = [
+            "_mpi_comm",
+            "_send_buffer",
+            "_recv_buffer",
+            "_states_buffer",
+            "_left_buffer",
+            "_right_buffer",
+            "_partner_buffer",
+            "_batch_buffer",
+            "_energy_buffer",
+            "_energy_matrix_buffer",
+            "_energy_request",
+        ]
+        return dict((k, v) for (k, v) in self.__dict__.items() if k not in excluded)
 
     def __setstate__(self, state: Dict[str, Any]) -> None:
         # set _mpi_comm to None
         self.__dict__ = state
+        # communicators pickled before replicas_per_rank and pipeline were added
+        self.__dict__.setdefault("_replicas_per_rank", 1)
+        self.__dict__.setdefault("_pipeline", False)
 
     def initialize(self) -> None:
         """
@@ -76,6 +149,9 @@ class MPICommunicator:
         """
         self._mpi_comm = get_mpi_comm_world()
         self._my_rank = self._mpi_comm.Get_rank()
+        self._energy_request: Optional[MPI.Request] = None
+        if self._transport == "buffer":
+            self._allocate_buffers()
 
     def is_master(self) -> bool:
         """
@@ -176,6 +252,11 @@ class MPICommunicator:
             self._timeout,
             RuntimeError(self._timeout_message.format("broadcast_states_to_slaves")),
         ):
+            if self._transport == "buffer":
+                for state, record in zip(states, self._states_buffer):
+                    self._pack_state(state, record)
+                self._mpi_comm.Scatter(self._states_buffer, self._send_buffer, root=0)
+                return self._unpack_state(self._send_buffer)
             return self._mpi_comm.scatter(states, root=0)
 
     @log_timing(logger)
@@ -191,6 +272,9 @@ class MPICommunicator:
             self._timeout,
             RuntimeError(self._timeout_message.format("receive_state_from_master")),
         ):
+            if self._transport == "buffer":
+                self._mpi_comm.Scatter(None, self._send_buffer, root=0)
+                return self._unpack_state(self._send_buffer)
             return self._mpi_comm.scatter(None, root=0)
 
     @log_timing(logger)
@@ -210,6 +294,10 @@ class MPICommunicator:
             self._timeout,
             RuntimeError(self._timeout_message.format("gather_states_from_slaves")),
         ):
+            if self._transport == "buffer":
+                self._pack_state(state_on_master, self._send_buffer)
+                self._mpi_comm.Gather(self._send_buffer, self._recv_buffer, root=0)
+                return [self._unpack_state(record) for record in self._recv_buffer]
             return self._mpi_comm.gather(state_on_master, root=0)
 
     @log_timing(logger)
@@ -227,7 +315,11 @@ class MPICommunicator:
             self._timeout,
             RuntimeError(self._timeout_message.format("send_state_to_master")),
         ):
-            self._mpi_comm.gather(state, root=0)
+            if self._transport == "buffer":
+                self._pack_state(state, self._send_buffer)
+                self._mpi_comm.Gather(self._send_buffer, None, root=0)
+            else:
+                self._mpi_comm.gather(state, root=0)
 
     @log_timing(logger)
     def broadcast_states_for_energy_calc_to_slaves(
@@ -251,7 +343,12 @@ class MPICommunicator:
                 )
             ),
         ):
-            self._mpi_comm.bcast(states, root=0)
+            if self._transport == "buffer":
+                for state, record in zip(states, self._states_buffer):
+                    self._pack_state(state, record)
+                self._mpi_comm.Bcast(self._states_buffer, root=0)
+            else:
+                self._mpi_comm.bcast(states, root=0)
 
     @log_timing(logger)
     def exchange_states_for_energy_calc(self, state: SystemState) -> List[SystemState]:
@@ -269,6 +366,16 @@ class MPICommunicator:
                 self._timeout_message.format("exchange_states_for_energy_calc")
             ),
         ):
+            if self._transport == "buffer":
+                self._pack_state(state, self._send_buffer)
+                record_size = self._send_buffer.shape[0]
+                counts = [record_size] * self._n_replicas
+                displacements = [i * record_size for i in range(self._n_replicas)]
+                self._mpi_comm.Allgatherv(
+                    self._send_buffer,
+                    [self._recv_buffer, counts, displacements, MPI.DOUBLE],
+                )
+                return [self._unpack_state(record) for record in self._recv_buffer]
             return self._mpi_comm.allgather(state)
 
     @log_timing(logger)
@@ -288,6 +395,9 @@ class MPICommunicator:
                 )
             ),
         ):
+            if self._transport == "buffer":
+                self._mpi_comm.Bcast(self._recv_buffer, root=0)
+                return [self._unpack_state(record) for record in self._recv_buffer]
             return self._mpi_comm.bcast(None, root=0)
 
     @log_timing(logger)
@@ -307,6 +417,12 @@ class MPICommunicator:
             self._timeout,
             RuntimeError(self._timeout_message.format("gather_energies_from_slaves")),
         ):
+            if self._pipeline:
+                self._energy_buffer[:] = energies_on_master
+                self._mpi_comm.Igather(
+                    self._energy_buffer, self._energy_matrix_buffer, root=0
+                ).Wait()
+                return self._energy_matrix_buffer.copy()
             energies = self._mpi_comm.gather(energies_on_master, root=0)
             return np.array(energies)
 
@@ -319,125 +435,1420 @@ class MPICommunicator:
         :param energies: a list of energies to send to the master
         :returns: :const:`None`
 
+        With ``pipeline=True``, this returns before the master has received
+        the energies. See :meth:`wait_for_sends`.
+
         """
         with timeout(
             self._timeout,
             RuntimeError(self._timeout_message.format("send_energies_to_master")),
         ):
+            if self._pipeline:
+                # the buffer can't be reused until the last send is done
+                self._wait_for_energy_request()
+                self._energy_buffer[:] = energies
+                self._energy_request = self._mpi_comm.Igather(
+                    self._energy_buffer, None, root=0
+                )
+                return None
             return self._mpi_comm.gather(energies, root=0)
 
+    def iter_states_for_energy_calc(
+        self, state: SystemState
+    ) -> Iterator[Tuple[int, SystemState]]:
+        """
+        iter_states_for_energy_calc(state)
+        Exchange states between all processes, yielding them as they arrive.
+
+        :param state: the state for this node
+        :returns: an iterator of ``(rank, state)`` for the state from every
+                  node. This node's own state comes first, and the rest are
+                  in the order they arrive. The states are only valid until
+                  the next exchange.
+
+        This requires ``pipeline=True``.
+
+        """
+        if not self._pipeline:
+            raise RuntimeError("iter_states_for_energy_calc requires pipeline=True")
+        self._pack_state(state, self._recv_buffer[self._my_rank])
+        # every node posts a broadcast from every rank, in the same order
+        requests = [
+            self._mpi_comm.Ibcast(self._recv_buffer[rank], root=rank)
+            for rank in range(self._n_replicas)
+        ]
+        yield self._my_rank, self._unpack_state(self._recv_buffer[self._my_rank])
+        for _ in range(self._n_replicas):
+            with timeout(
+                self._timeout,
+                RuntimeError(
+                    self._timeout_message.format("iter_states_for_energy_calc")
+                ),
+            ):
+                rank = MPI.Request.Waitany(requests)
+            if rank != self._my_rank:
+                yield rank, self._unpack_state(self._recv_buffer[rank])
+
     @log_timing(logger)
-    def negotiate_device_id(self) -> int:
+    def wait_for_sends(self) -> None:
+        """
+        Wait for the nonblocking sends from this node to finish.
+
+        This must be called on the slaves before MPI is finalized.
+
+        """
         with timeout(
             self._timeout,
-            RuntimeError(self._timeout_message.format("negotiate_device_id")),
+            RuntimeError(self._timeout_message.format("wait_for_sends")),
         ):
-            hostname = platform.node()
-            try:
-                env_visible_devices = os.environ["CUDA_VISIBLE_DEVICES"]
-                logger.info("%s found cuda devices: %s", hostname, env_visible_devices)
-                visible_devices: Optional[List[int]] = [
-                    int(dev) for dev in env_visible_devices.split(",")
-                ]
-                if not visible_devices:
-                    raise RuntimeError("No cuda devices available")
-            except KeyError:
-                logger.info("%s CUDA_VISIBLE_DEVICES is not set.", hostname)
-                visible_devices = None
+            self._wait_for_energy_request()
 
-            hosts = self._mpi_comm.gather(HostInfo(hostname, visible_devices), root=0)
+    def _wait_for_energy_request(self) -> None:
+        if self._energy_request is not None:
+            self._energy_request.Wait()
+            self._energy_request = None
 
-            # the master computes the device ids
-            if self._my_rank == 0:
-                if hosts[0].devices is None:
-                    # if CUDA_VISIBLE_DEVICES isn't set on the master, we assume it
-                    # isn't set for any node
-                    logger.info("CUDA_VISIBLE_DEVICES is not set.")
-                    logger.info("Assuming each mpi process has access")
-                    logger.info("to a CUDA device, where the device")
-                    logger.info("numbering starts from 0.")
+    @log_timing(logger)
+    def exchange_states_with_neighbors(
+        self, state: SystemState
+    ) -> Tuple[Optional[SystemState], Optional[SystemState]]:
+        """
+        exchange_states_with_neighbors(state)
+        Exchange states with the neighboring replicas only.
 
-                    # create an empty default dict to count hosts
-                    host_counts: Dict[str, int] = defaultdict(int)
+        :param state: the state for this node
+        :returns: a tuple ``(left, right)`` of the states from the nodes with
+                  rank one lower and one higher than this node. The first
+                  and last nodes get :const:`None` for their missing neighbor.
 
-                    # list of device ids
-                    # this assumes that available devices for each node
-                    # are numbered starting from 0
-                    device_ids = []
-                    for host in hosts:
-                        assert host.devices is None
-                        device_ids.append(host_counts[host.host_name])
-                        host_counts[host.host_name] += 1
-                else:
-                    # CUDA_VISIBLE_DEVICES is set on the master, so we
-                    # assume it is set for all nodes
-                    logger.info("CUDA_VISIBLE_DEVICES is set.")
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(
+                self._timeout_message.format("exchange_states_with_neighbors")
+            ),
+        ):
+            left_rank = self._my_rank - 1 if self._my_rank > 0 else MPI.PROC_NULL
+            right_rank = (
+                self._my_rank + 1
+                if self._my_rank < self._n_replicas - 1
+                else MPI.PROC_NULL
+            )
 
-                    # create a dict to hold the device ids available on each host
-                    available_devices: Dict[str, List[int]] = {}
-                    # store the available devices on each node
-                    for host in hosts:
-                        if host.host_name in available_devices:
-                            if host.devices != available_devices[host.host_name]:
-                                raise RuntimeError("GPU devices for host do not match")
-                        else:
-                            available_devices[host.host_name] = host.devices
+            if self._transport == "buffer":
+                self._pack_state(state, self._send_buffer)
+                # send to the right and receive from the left, then vice versa
+                self._mpi_comm.Sendrecv(
+                    self._send_buffer,
+                    dest=right_rank,
+                    recvbuf=self._left_buffer,
+                    source=left_rank,
+                )
+                self._mpi_comm.Sendrecv(
+                    self._send_buffer,
+                    dest=left_rank,
+                    recvbuf=self._right_buffer,
+                    source=right_rank,
+                )
+                left = (
+                    self._unpack_state(self._left_buffer)
+                    if left_rank != MPI.PROC_NULL
+                    else None
+                )
+                right = (
+                    self._unpack_state(self._right_buffer)
+                    if right_rank != MPI.PROC_NULL
+                    else None
+                )
+            else:
+                left = self._mpi_comm.sendrecv(state, dest=right_rank, source=left_rank)
+                right = self._mpi_comm.sendrecv(
+                    state, dest=left_rank, source=right_rank
+                )
+            return left, right
 
-                    # CUDA numbers the devices from 0 always,
-                    # e.g. if CUDA_VISIBLE_DEVICES=2,3 we still need to ask for
-                    # devices 0 and 1 to get physical devices 2 and 3.
-                    # So, we subtract the minimum value from each each to make
-                    # it zero
-                    # but we don't do this if the device ids are set to -1, which
-                    # allows openmm to choose the gpu
-                    for host in hosts:
-                        min_device_id = min(available_devices[host.host_name])
-                        if min_device_id != -1:
-                            available_devices[host.host_name] = [
-                                device_id - min_device_id
-                                for device_id in available_devices[host.host_name]
-                            ]
+    @log_timing(logger)
+    def gather_neighbor_energies_from_slaves(
+        self, energies_on_master: List[float]
+    ) -> np.ndarray:
+        """
+        gather_neighbor_energies_from_slaves(energies_on_master)
+        Receive the neighbor energies from each slave.
 
-                    # device ids for each node
-                    device_ids = []
-                    for host in hosts:
-                        try:
-                            # pop off the first device_id for this host name
-                            device_ids.append(available_devices[host.host_name].pop(0))
-                        except IndexError:
-                            logger.error("More mpi processes than GPUs")
-                            raise RuntimeError("More mpi process than GPUs")
+        :param energies_on_master: the energies of the left, own, and right
+            states computed on the master. Missing neighbors should be NaN.
+        :returns: a square matrix of energies, where only the diagonal and
+                  the first off-diagonals are filled. All other entries
+                  are NaN.
 
-            # receive device id from master
-            else:
-                device_ids = []
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(
+                self._timeout_message.format("gather_neighbor_energies_from_slaves")
+            ),
+        ):
+            energies = np.array(self._mpi_comm.gather(energies_on_master, root=0))
+            return banded_to_dense(energies)
 
-            # do the communication
-            device_id = self._mpi_comm.scatter(
-                device_ids if device_ids else None, root=0
-            )
-            logger.info("hostname: %s, device_id: %d", hostname, device_id)
-            return device_id
+    @log_timing(logger)
+    def send_neighbor_energies_to_master(self, energies: List[float]) -> None:
+        """
+        send_neighbor_energies_to_master(energies)
+        Send the energies of the left, own, and right states to the master.
 
-    @property
-    def n_replicas(self) -> int:
-        return self._n_replicas
+        :param energies: a list of three energies. Missing neighbors
+            should be NaN.
+        :returns: :const:`None`
 
-    @property
-    def n_atoms(self) -> int:
-        return self._n_atoms
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(
+                self._timeout_message.format("send_neighbor_energies_to_master")
+            ),
+        ):
+            self._mpi_comm.gather(energies, root=0)
+
+    @log_timing(logger)
+    def exchange_state_with_partner(
+        self, state: SystemState, partner: Optional[int]
+    ) -> Optional[SystemState]:
+        """
+        exchange_state_with_partner(state, partner)
+        Swap states with the partner for peer-to-peer exchange.
+
+        :param state: the state for this node
+        :param partner: the rank of the partner, or :const:`None` if this
+            node has no partner this step
+        :returns: the state of the partner, or :const:`None` if there is
+                  no partner
+
+        Every node must call this, even if it has no partner.
+
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(self._timeout_message.format("exchange_state_with_partner")),
+        ):
+            if partner is None:
+                return None
+            if self._transport == "buffer":
+                self._pack_state(state, self._send_buffer)
+                self._mpi_comm.Sendrecv(
+                    self._send_buffer,
+                    dest=partner,
+                    recvbuf=self._partner_buffer,
+                    source=partner,
+                )
+                return self._unpack_state(self._partner_buffer)
+            return self._mpi_comm.sendrecv(state, dest=partner, source=partner)
+
+    @log_timing(logger)
+    def exchange_energies_with_partner(
+        self, energies: List[float], partner: Optional[int]
+    ) -> Optional[List[float]]:
+        """
+        exchange_energies_with_partner(energies, partner)
+        Swap energies with the partner for peer-to-peer exchange.
+
+        :param energies: the energies of this node's state and of the
+            partner's state under this node's hamiltonian
+        :param partner: the rank of the partner, or :const:`None` if this
+            node has no partner this step
+        :returns: the same energies from the partner, or :const:`None` if
+                  there is no partner
+
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(
+                self._timeout_message.format("exchange_energies_with_partner")
+            ),
+        ):
+            if partner is None:
+                return None
+            return self._mpi_comm.sendrecv(energies, dest=partner, source=partner)
+
+    @log_timing(logger)
+    def gather_exchange_records_from_slaves(
+        self, record_on_master: List[float]
+    ) -> np.ndarray:
+        """
+        gather_exchange_records_from_slaves(record_on_master)
+        Receive the record of the last peer-to-peer exchange from each slave.
+
+        :param record_on_master: the record from the master, see
+            :func:`meld.remd.slave_runner.exchange_with_partner`
+        :returns: an ``n_replicas x 4`` array with the record from each node
+
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(
+                self._timeout_message.format("gather_exchange_records_from_slaves")
+            ),
+        ):
+            return np.array(self._mpi_comm.gather(record_on_master, root=0))
+
+    @log_timing(logger)
+    def send_exchange_record_to_master(self, record: List[float]) -> None:
+        """
+        send_exchange_record_to_master(record)
+        Send the record of the last peer-to-peer exchange to the master.
+
+        :param record: the record, see
+            :func:`meld.remd.slave_runner.exchange_with_partner`
+        :returns: :const:`None`
+
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(
+                self._timeout_message.format("send_exchange_record_to_master")
+            ),
+        ):
+            self._mpi_comm.gather(record, root=0)
+
+    #
+    # asynchronous communication
+    #
+    # These are used by asynchronous replica exchange, where the master
+    # hands out segments of simulation to the other ranks, the workers, one
+    # at a time and as each worker finishes. There may be any number of
+    # workers, and they do not need to wait for each other.
+    #
 
     @property
-    def rank(self) -> int:
-        return self._my_rank
+    def n_workers(self) -> int:
+        """Number of ranks other than the master."""
+        return self._mpi_comm.Get_size() - 1
 
+    @log_timing(logger)
+    def send_segment_to_worker(self, worker: int, segment: Segment) -> None:
+        """
+        send_segment_to_worker(worker, segment)
+        Send a segment of simulation to a worker.
 
-def get_mpi_comm_world() -> MPI.Comm:
-    """
-    Helper function to return the comm_world.
+        :param worker: the rank of the worker, which must be idle
+        :param segment: the :class:`Segment` to run
+        :returns: :const:`None`
 
-    """
-    return MPI.COMM_WORLD
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(self._timeout_message.format("send_segment_to_worker")),
+        ):
+            self._mpi_comm.send(segment, dest=worker, tag=SEGMENT_TAG)
+
+    @log_timing(logger)
+    def receive_segment_state_from_worker(self) -> Tuple[int, int, SystemState]:
+        """
+        receive_segment_state_from_worker()
+        Receive the result of a segment from whichever worker finishes first.
+
+        :returns: a tuple ``(worker, index, state)`` of the rank of the
+                  worker, the ladder index of the segment, and the state
+                  after simulating
+
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(
+                self._timeout_message.format("receive_segment_state_from_worker")
+            ),
+        ):
+            status = MPI.Status()
+            index, state = self._mpi_comm.recv(
+                source=MPI.ANY_SOURCE, tag=SEGMENT_TAG, status=status
+            )
+            return status.Get_source(), index, state
+
+    @log_timing(logger)
+    def stop_workers(self) -> None:
+        """
+        stop_workers()
+        Tell each worker that there are no more segments.
+
+        Every worker must be idle.
+
+        """
+        with timeout(
+            self._timeout, RuntimeError(self._timeout_message.format("stop_workers"))
+        ):
+            for worker in range(1, self.n_workers + 1):
+                self._mpi_comm.send(None, dest=worker, tag=SEGMENT_TAG)
+
+    @log_timing(logger)
+    def receive_segment_from_master(self) -> Optional[Segment]:
+        """
+        receive_segment_from_master()
+        Receive the next segment of simulation from the master.
+
+        :returns: the :class:`Segment` to run, or :const:`None` if there are
+                  no more segments
+
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(self._timeout_message.format("receive_segment_from_master")),
+        ):
+            return self._mpi_comm.recv(source=0, tag=SEGMENT_TAG)
+
+    @log_timing(logger)
+    def send_segment_state_to_master(self, index: int, state: SystemState) -> None:
+        """
+        send_segment_state_to_master(index, state)
+        Send the result of a segment to the master.
+
+        :param index: the ladder index of the segment
+        :param state: the state after simulating
+        :returns: :const:`None`
+
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(self._timeout_message.format("send_segment_state_to_master")),
+        ):
+            self._mpi_comm.send((index, state), dest=0, tag=SEGMENT_TAG)
+
+    #
+    # batch communication
+    #
+    # These are used when each rank runs more than one replica. They move
+    # the alphas, states, and energies of each rank's slice of replicas.
+    #
+
+    @log_timing(logger)
+    def broadcast_alpha_batches_to_slaves(self, alphas: List[float]) -> List[float]:
+        """
+        broadcast_alpha_batches_to_slaves(alphas)
+        Send each slave the alpha values for its replicas.
+
+        :param alphas: a list of alpha values, one for each replica
+        :returns: the alpha values for the replicas on the master
+
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(
+                self._timeout_message.format("broadcast_alpha_batches_to_slaves")
+            ),
+        ):
+            return self._mpi_comm.scatter(self._split(list(alphas)), root=0)
+
+    @log_timing(logger)
+    def receive_alpha_batch_from_master(self) -> List[float]:
+        """
+        receive_alpha_batch_from_master()
+        Receive the alpha values for this node's replicas from the master.
+
+        :returns: a list of alpha values, one for each replica on this node
+
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(
+                self._timeout_message.format("receive_alpha_batch_from_master")
+            ),
+        ):
+            return self._mpi_comm.scatter(None, root=0)
+
+    @log_timing(logger)
+    def broadcast_state_batches_to_slaves(
+        self, states: List[SystemState]
+    ) -> List[SystemState]:
+        """
+        broadcast_state_batches_to_slaves(states)
+        Send each slave the states for its replicas.
+
+        :param states: a list of states, one for each replica
+        :returns: the states to run on the master node
+
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(
+                self._timeout_message.format("broadcast_state_batches_to_slaves")
+            ),
+        ):
+            if self._transport == "buffer":
+                for state, record in zip(states, self._states_buffer):
+                    self._pack_state(state, record)
+                self._mpi_comm.Scatter(self._states_buffer, self._batch_buffer, root=0)
+                return [self._copy_state(record) for record in self._batch_buffer]
+            return self._mpi_comm.scatter(self._split(list(states)), root=0)
+
+    @log_timing(logger)
+    def receive_state_batch_from_master(self) -> List[SystemState]:
+        """
+        receive_state_batch_from_master()
+        Get the states to run on this node's replicas for this step.
+
+        :returns: a list of states, one for each replica on this node
+
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(
+                self._timeout_message.format("receive_state_batch_from_master")
+            ),
+        ):
+            if self._transport == "buffer":
+                self._mpi_comm.Scatter(None, self._batch_buffer, root=0)
+                return [self._copy_state(record) for record in self._batch_buffer]
+            return self._mpi_comm.scatter(None, root=0)
+
+    @log_timing(logger)
+    def exchange_state_batches_for_energy_calc(
+        self, states: List[SystemState]
+    ) -> List[SystemState]:
+        """
+        exchange_state_batches_for_energy_calc(states)
+        Exchange the states of every replica between all processes.
+
+        :param states: the states of this node's replicas
+        :returns: a list of states, one for each replica
+
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(
+                self._timeout_message.format("exchange_state_batches_for_energy_calc")
+            ),
+        ):
+            if self._transport == "buffer":
+                for state, record in zip(states, self._batch_buffer):
+                    self._pack_state(state, record)
+                self._mpi_comm.Allgather(self._batch_buffer, self._recv_buffer)
+                return [self._unpack_state(record) for record in self._recv_buffer]
+            batches = self._mpi_comm.allgather(states)
+            return [state for batch in batches for state in batch]
+
+    @log_timing(logger)
+    def gather_energy_batches_from_slaves(
+        self, energies_on_master: List[List[float]]
+    ) -> np.ndarray:
+        """
+        gather_energy_batches_from_slaves(energies_on_master)
+        Receive the energies computed for the replicas on each slave.
+
+        :param energies_on_master: a list with one row of energies for each
+            replica on the master
+        :returns: a square matrix of every state on every replica to be used
+                  for replica exchange
+
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(
+                self._timeout_message.format("gather_energy_batches_from_slaves")
+            ),
+        ):
+            batches = self._mpi_comm.gather(energies_on_master, root=0)
+            # the gather only returns None on the slaves
+            assert batches is not None
+            return np.array([row for batch in batches for row in batch])
+
+    @log_timing(logger)
+    def send_energy_batches_to_master(self, energies: List[List[float]]) -> None:
+        """
+        send_energy_batches_to_master(energies)
+        Send the energies computed for this node's replicas to the master.
+
+        :param energies: a list with one row of energies for each replica
+            on this node
+        :returns: :const:`None`
+
+        """
+        with timeout(
+            self._timeout,
+            RuntimeError(self._timeout_message.format("send_energy_batches_to_master")),
+        ):
+            self._mpi_comm.gather(energies, root=0)
+
+    def _split(self, values: List) -> List[List]:
+        # split per-replica values into per-rank batches
+        k = self._replicas_per_rank
+        return [values[i : i + k] for i in range(0, self._n_replicas, k)]
+
+    @log_timing(logger)
+    def negotiate_device_id(self) -> int:
+        with timeout(
+            self._timeout,
+            RuntimeError(self._timeout_message.format("negotiate_device_id")),
+        ):
+            hostname = platform.node()
+            try:
+                env_visible_devices = os.environ["CUDA_VISIBLE_DEVICES"]
+                logger.info("%s found cuda devices: %s", hostname, env_visible_devices)
+                visible_devices: Optional[List[int]] = [
+                    int(dev) for dev in env_visible_devices.split(",")
+                ]
+                if not visible_devices:
+                    raise RuntimeError("No cuda devices available")
+            except KeyError:
+                logger.info("%s CUDA_VISIBLE_DEVICES is not set.", hostname)
+                visible_devices = None
+
+            hosts = self._mpi_comm.gather(HostInfo(hostname, visible_devices), root=0)
+
+            # the master computes the device ids
+            if self._my_rank == 0:
+                if hosts[0].devices is None:
+                    # if CUDA_VISIBLE_DEVICES isn't set on the master, we assume it
+                    # isn't set for any node
+                    logger.info("CUDA_VISIBLE_DEVICES is not set.")
+                    logger.info("Assuming each mpi process has access")
+                    logger.info("to a CUDA device, where the device")
+                    logger.info("numbering starts from 0.")
+
+                    # create an empty default dict to count hosts
+                    host_counts: Dict[str, int] = defaultdict(int)
+
+                    # list of device ids
+                    # this assumes that available devices for each node
+                    # are numbered starting from 0
+                    device_ids = []
+                    for host in hosts:
+                        assert host.devices is None
+                        device_ids.append(host_counts[host.host_name])
+                        host_counts[host.host_name] += 1
+                else:
+                    # CUDA_VISIBLE_DEVICES is set on the master, so we
+                    # assume it is set for all nodes
+                    logger.info("CUDA_VISIBLE_DEVICES is set.")
+
+                    # create a dict to hold the device ids available on each host
+                    available_devices: Dict[str, List[int]] = {}
+                    # store the available devices on each node
+                    for host in hosts:
+                        if host.host_name in available_devices:
+                            if host.devices != available_devices[host.host_name]:
+                                raise RuntimeError("GPU devices for host do not match")
+                        else:
+                            available_devices[host.host_name] = host.devices
+
+                    # CUDA numbers the devices from 0 always,
+                    # e.g. if CUDA_VISIBLE_DEVICES=2,3 we still need to ask for
+                    # devices 0 and 1 to get physical devices 2 and 3.
+                    # So, we subtract the minimum value from each each to make
+                    # it zero
+                    # but we don't do this if the device ids are set to -1, which
+                    # allows openmm to choose the gpu
+                    for host in hosts:
+                        min_device_id = min(available_devices[host.host_name])
+                        if min_device_id != -1:
+                            available_devices[host.host_name] = [
+                                device_id - min_device_id
+                                for device_id in available_devices[host.host_name]
+                            ]
+
+                    # device ids for each node
+                    device_ids = []
+                    for host in hosts:
+                        try:
+                            # pop off the first device_id for this host name
+                            device_ids.append(available_devices[host.host_name].pop(0))
+                        except IndexError:
+                            logger.error("More mpi processes than GPUs")
+                            raise RuntimeError("More mpi process than GPUs")
+
+            # receive device id from master
+            else:
+                device_ids = []
+
+            # do the communication
+            device_id = self._mpi_comm.scatter(
+                device_ids if device_ids else None, root=0
+            )
+            logger.info("hostname: %s, device_id: %d", hostname, device_id)
+            return device_id
+
+    @property
+    def n_replicas(self) -> int:
+        return self._n_replicas
+
+    @property
+    def replicas_per_rank(self) -> int:
+        return self._replicas_per_rank
+
+    @property
+    def pipeline(self) -> bool:
+        return self._pipeline
+
+    @property
+    def transport(self) -> str:
+        return self._transport
+
+    @property
+    def n_atoms(self) -> int:
+        return self._n_atoms
+
+    @property
+    def rank(self) -> int:
+        return self._my_rank
+
+    #
+    # buffer-based transport
+    #
+    # Each state is packed into a single float64 record laid out as
+    # [positions | velocities | box_vector | alpha | energy]. A box_vector
+    # of None is stored as NaN.
+    #
+
+    def _allocate_buffers(self) -> None:
+        n_ranks = self._n_replicas // self._replicas_per_rank
+        if self._mpi_comm.Get_size() != n_ranks:
+            raise RuntimeError(
+                "Buffer transport requires n_replicas // replicas_per_rank = "
+                f"{n_ranks} MPI processes, but there are "
+                f"{self._mpi_comm.Get_size()}."
+            )
+        record_size = 6 * self._n_atoms + 5
+        # record for this node's state
+        self._send_buffer = np.zeros(record_size)
+        # records for the states of this node's replicas
+        self._batch_buffer = np.zeros((self._replicas_per_rank, record_size))
+        # energies for the nonblocking gather
+        self._energy_buffer = np.zeros(self._n_replicas)
+        self._energy_matrix_buffer = np.zeros((self._n_replicas, self._n_replicas))
+        # records for all states received from other nodes
+        self._recv_buffer = np.zeros((self._n_replicas, record_size))
+        # records for all states sent from the master
+        self._states_buffer = np.zeros((self._n_replicas, record_size))
+        # records for the states of neighboring replicas
+        self._left_buffer = np.zeros(record_size)
+        self._right_buffer = np.zeros(record_size)
+        # record for the state of the partner in peer-to-peer exchange
+        self._partner_buffer = np.zeros(record_size)
+
+    def _pack_state(self, state: SystemState, record: np.ndarray) -> None:
+        n = 3 * self._n_atoms
+        record[:n] = np.ravel(state.positions)
+        record[n : 2 * n] = np.ravel(state.velocities)
+        if state.box_vector is None:
+            record[2 * n : 2 * n + 3] = np.nan
+        else:
+            record[2 * n : 2 * n + 3] = state.box_vector
+        record[2 * n + 3] = state.alpha
+        record[2 * n + 4] = state.energy
+
+    def _unpack_state(self, record: np.ndarray) -> SystemState:
+        # the returned arrays are views into the record, so the state
+        # is only valid until the buffer is next written to
+        n = 3 * self._n_atoms
+        positions = record[:n].reshape(self._n_atoms, 3)
+        velocities = record[n : 2 * n].reshape(self._n_atoms, 3)
+        # NaN marks a state without a box
+        box = record[2 * n : 2 * n + 3]
+        box_vector = None if np.isnan(box).any() else box
+        alpha = float(record[2 * n + 3])
+        energy = float(record[2 * n + 4])
+        return SystemState(positions, velocities, alpha, energy, box_vector)
+
+    def _copy_state(self, record: np.ndarray) -> SystemState:
+        # the batch buffer is reused, so states that are kept must be copied
+        return self._unpack_state(record.copy())
+
+
+class SharedMemoryCommunicator:
+    """
+    Class to handle communications between master and slaves on a single
+    node using shared memory.
+
+    :param n_atoms: number of atoms
+    :param n_replicas: number of replicas
+    :param timeout: number of seconds to wait for a communication to complete
+
+    This has the same interface as :class:`MPICommunicator`, but each slave
+    runs in a worker process started with :mod:`multiprocessing` rather than
+    under ``mpirun``. The positions and velocities of all replicas are held in
+    shared ``n_replicas x n_atoms x 3`` arrays, along with shared arrays for
+    the box vectors, alphas, and energies. Each rank writes its results in
+    place and the ranks synchronize with a barrier, so states are never
+    pickled or sent. There is one process per replica.
+
+    The states returned by the gathers are views into the shared arrays, so
+    they are only valid until the next communication. The states returned to
+    a rank to simulate are copies.
+
+    :meth:`initialize` allocates the shared memory on the master, which must
+    then start the slaves with :meth:`start_workers` and, once finished,
+    release everything with :meth:`close`.
+    """
+
+    def __init__(self, n_atoms: int, n_replicas: int, timeout: int = 600) -> None:
+        self._n_atoms = n_atoms
+        self._n_replicas = n_replicas
+        self._timeout = timeout
+        self._timeout_message = (
+            f"Call to {{:s}} did not complete in {timeout} seconds "
+            "or another rank failed"
+        )
+        self._my_rank = 0
+        self._memory: Optional[shared_memory.SharedMemory] = None
+        self._context: Any = None
+        self._sync: Any = None
+        self._connections: List[Any] = []
+        self._worker_connections: List[Any] = []
+        self._workers: List[Any] = []
+
+        # views into the shared memory, see _layout
+        self._positions: np.ndarray
+        self._velocities: np.ndarray
+        self._box_vectors: np.ndarray
+        self._state_alphas: np.ndarray
+        self._state_energies: np.ndarray
+        self._alphas: np.ndarray
+        self._energies: np.ndarray
+        self._neighbor_energies: np.ndarray
+        self._partner_energies: np.ndarray
+        self._exchange_records: np.ndarray
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # don't pickle the shared memory, synchronization, or processes
+        excluded = [
+            "_memory",
+            "_context",
+            "_sync",
+            "_connections",
+            "_worker_connections",
+            "_workers",
+        ] + [f"_{name}" for name, _ in self._layout()]
+        return dict((k, v) for (k, v) in self.__dict__.items() if k not in excluded)
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__ = state
+        self._memory = None
+        self._workers = []
+
+    def initialize(self) -> None:
+        """
+        Allocate the shared memory on the master.
+
+        The workers are attached to the shared memory when they are started,
+        so this does nothing on the slaves.
+
+        """
+        if self._memory is not None:
+            return
+        self._my_rank = 0
+        self._context = mp.get_context("spawn")
+        size = sum(8 * int(np.prod(shape)) for _, shape in self._layout())
+        self._memory = shared_memory.SharedMemory(create=True, size=size)
+        self._sync = self._context.Barrier(self._n_replicas)
+        pipes = [self._context.Pipe() for _ in range(1, self._n_replicas)]
+        self._connections = [master_end for master_end, _ in pipes]
+        self._worker_connections = [worker_end for _, worker_end in pipes]
+        self._map_arrays()
+
+    def start_workers(self, target: Callable[..., None], *args: Any) -> None:
+        """
+        Start a worker process for each slave.
+
+        :param target: function to run in each worker, called as
+            ``target(communicator, *args)``, where ``communicator`` is
+            attached for that worker's rank. The target and arguments must
+            be picklable.
+        :returns: :const:`None`
+
+        """
+        if self._memory is None:
+            raise RuntimeError("initialize must be called before start_workers")
+        for rank in range(1, self._n_replicas):
+            process = self._context.Process(
+                target=_run_shared_memory_worker,
+                args=(
+                    self,
+                    rank,
+                    self._memory.name,
+                    self._sync,
+                    self._worker_connections[rank - 1],
+                    target,
+                    args,
+                ),
+            )
+            process.start()
+            self._workers.append(process)
+
+    def close(self) -> None:
+        """
+        Wait for the workers to finish and release the shared memory.
+
+        :raises RuntimeError: if a worker did not exit cleanly
+
+        """
+        failed = []
+        for rank, process in enumerate(self._workers, 1):
+            process.join(self._timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            if process.exitcode != 0:
+                failed.append(rank)
+        self._workers = []
+        self._release()
+        if failed:
+            raise RuntimeError(f"Shared memory workers for ranks {failed} failed.")
+
+    def abort(self) -> None:
+        """
+        Stop after a failure on the master.
+
+        This breaks the barrier, so that no worker waits for the master until
+        it times out, then stops the workers and releases the shared memory.
+
+        """
+        if self._memory is None:
+            return
+        self._sync.abort()
+        for process in self._workers:
+            process.terminate()
+            process.join()
+        self._workers = []
+        self._release()
+
+    def is_master(self) -> bool:
+        """
+        Is this the master node?
+
+        :returns: :const:`True` if we are the master, otherwise :const:`False`
+
+        """
+        return self._my_rank == 0
+
+    @log_timing(logger)
+    def barrier(self) -> None:
+        self._wait("barrier")
+
+    @log_timing(logger)
+    def broadcast_alphas_to_slaves(self, alphas: List[float]) -> None:
+        """
+        broadcast_alphas_to_slaves(alphas)
+        Send the alpha values to the slaves.
+
+        :param alphas: a list of alpha values, one for each replica.
+            The master node's alpha value should be included in this list.
+        :returns: :const:`None`
+
+        """
+        self._wait("broadcast_alphas_to_slaves")
+        self._alphas[:] = alphas
+        self._wait("broadcast_alphas_to_slaves")
+
+    @log_timing(logger)
+    def broadcast_logger_address_to_slaves(self, address: Tuple[str, int]) -> None:
+        """
+        Broadcast the hostname and port of the logger to slaves.
+
+        :param address: a tuple (hostname, port)
+        :return: :const: `None`
+        """
+        for connection in self._connections:
+            connection.send(address)
+
+    @log_timing(logger)
+    def receive_logger_address_from_master(self) -> Tuple[str, int]:
+        """
+        Receive the hostname and port of the logger from the master
+
+        :return: a (hostname, port) tuple
+        """
+        connection = self._connections[0]
+        if not connection.poll(self._timeout):
+            raise RuntimeError(
+                self._timeout_message.format("receive_logger_address_from_master")
+            )
+        return connection.recv()
+
+    @log_timing(logger)
+    def receive_alpha_from_master(self) -> float:
+        """
+        receive_alpha_from_master()
+        Receive alpha value from master node.
+
+        :returns: a floating point value for alpha in ``[0,1]``
+
+        """
+        self._wait("receive_alpha_from_master")
+        self._wait("receive_alpha_from_master")
+        return float(self._alphas[self._my_rank])
+
+    @log_timing(logger)
+    def broadcast_states_to_slaves(self, states: List[SystemState]) -> SystemState:
+        """
+        broadcast_states_to_slaves(states)
+        Send a state to each slave.
+
+        :param states: a list of states. The list of states should include
+            the state for the master node. These are the states that will
+            be simulated on each replica for each step.
+        :returns: the state to run on the master node
+
+        """
+        self._wait("broadcast_states_to_slaves")
+        self._write_states(states)
+        self._wait("broadcast_states_to_slaves")
+        return self._copy_state(0)
+
+    @log_timing(logger)
+    def receive_state_from_master(self) -> SystemState:
+        """
+        receive_state_from_master()
+        Get state to run for this step
+
+        :returns: the state to run for this step
+
+        """
+        self._wait("receive_state_from_master")
+        self._wait("receive_state_from_master")
+        return self._copy_state(self._my_rank)
+
+    @log_timing(logger)
+    def gather_states_from_slaves(
+        self, state_on_master: SystemState
+    ) -> List[SystemState]:
+        """
+        gather_states_from_slaves(state_on_master)
+        Receive states from all slaves
+
+        :param state_on_master: the state on the master after simulating
+        :returns: A list of states, one from each replica.
+                  The returned states are the states after simulating.
+
+        """
+        self._wait("gather_states_from_slaves")
+        self._write_state(0, state_on_master)
+        self._wait("gather_states_from_slaves")
+        return self._view_states()
+
+    @log_timing(logger)
+    def send_state_to_master(self, state: SystemState) -> None:
+        """
+        send_state_to_master(state)
+        Send state to master
+
+        :param state: State to send to master. This is the state after
+                      simulating this step.
+        :returns: :const:`None`
+
+        """
+        self._wait("send_state_to_master")
+        self._write_state(self._my_rank, state)
+        self._wait("send_state_to_master")
+
+    @log_timing(logger)
+    def broadcast_states_for_energy_calc_to_slaves(
+        self, states: List[SystemState]
+    ) -> None:
+        """
+        broadcast_states_for_energy_calc_to_slaves(states)
+        Broadcast states to all slaves. Send all results from this step
+        to every slave so that we can calculate the energies and do
+        replica exchange.
+
+        :param states: a list of states
+        :returns: :const:`None`
+
+        """
+        self._wait("broadcast_states_for_energy_calc_to_slaves")
+        self._write_states(states)
+        self._wait("broadcast_states_for_energy_calc_to_slaves")
+
+    @log_timing(logger)
+    def exchange_states_for_energy_calc(self, state: SystemState) -> List[SystemState]:
+        """
+        exchange_states_for_energy_calc(state)
+        Exchange states between all processes.
+
+        :param state: the state for this node
+        :returns: a list of states from all nodes
+
+        """
+        self._wait("exchange_states_for_energy_calc")
+        self._write_state(self._my_rank, state)
+        self._wait("exchange_states_for_energy_calc")
+        return self._view_states()
+
+    @log_timing(logger)
+    def receive_states_for_energy_calc_from_master(self) -> List[SystemState]:
+        """
+        receive_states_for_energy_calc_from_master()
+        Receive all states from master.
+
+        :returns: a list of states to calculate the energy of
+
+        """
+        self._wait("receive_states_for_energy_calc_from_master")
+        self._wait("receive_states_for_energy_calc_from_master")
+        return self._view_states()
+
+    @log_timing(logger)
+    def gather_energies_from_slaves(
+        self, energies_on_master: List[float]
+    ) -> np.ndarray:
+        """
+        gather_energies_from_slaves(energies_on_master)
+        Receive a list of energies from each slave.
+
+        :param energies_on_master: a list of energies from the master
+        :returns: a square matrix of every state on every replica to be used
+                  for replica exchange
+
+        """
+        self._wait("gather_energies_from_slaves")
+        self._energies[0] = energies_on_master
+        self._wait("gather_energies_from_slaves")
+        # the energy matrix is small, and is kept by the ladder and the store,
+        # so it is returned as a copy
+        return self._energies.copy()
+
+    @log_timing(logger)
+    def send_energies_to_master(self, energies: List[float]) -> None:
+        """
+        send_energies_to_master(energies)
+        Send a list of energies to the master.
+
+        :param energies: a list of energies to send to the master
+        :returns: :const:`None`
+
+        """
+        self._wait("send_energies_to_master")
+        self._energies[self._my_rank] = energies
+        self._wait("send_energies_to_master")
+
+    @log_timing(logger)
+    def exchange_states_with_neighbors(
+        self, state: SystemState
+    ) -> Tuple[Optional[SystemState], Optional[SystemState]]:
+        """
+        exchange_states_with_neighbors(state)
+        Exchange states with the neighboring replicas only.
+
+        :param state: the state for this node
+        :returns: a tuple ``(left, right)`` of the states from the nodes with
+                  rank one lower and one higher than this node. The first
+                  and last nodes get :const:`None` for their missing neighbor.
+
+        """
+        self._wait("exchange_states_with_neighbors")
+        self._write_state(self._my_rank, state)
+        self._wait("exchange_states_with_neighbors")
+        left = self._view_state(self._my_rank - 1) if self._my_rank > 0 else None
+        right = (
+            self._view_state(self._my_rank + 1)
+            if self._my_rank < self._n_replicas - 1
+            else None
+        )
+        return left, right
+
+    @log_timing(logger)
+    def gather_neighbor_energies_from_slaves(
+        self, energies_on_master: List[float]
+    ) -> np.ndarray:
+        """
+        gather_neighbor_energies_from_slaves(energies_on_master)
+        Receive the neighbor energies from each slave.
+
+        :param energies_on_master: the energies of the left, own, and right
+            states computed on the master. Missing neighbors should be NaN.
+        :returns: a square matrix of energies, where only the diagonal and
+                  the first off-diagonals are filled. All other entries
+                  are NaN.
+
+        """
+        self._wait("gather_neighbor_energies_from_slaves")
+        self._neighbor_energies[0] = energies_on_master
+        self._wait("gather_neighbor_energies_from_slaves")
+        return banded_to_dense(self._neighbor_energies)
+
+    @log_timing(logger)
+    def send_neighbor_energies_to_master(self, energies: List[float]) -> None:
+        """
+        send_neighbor_energies_to_master(energies)
+        Send the energies of the left, own, and right states to the master.
+
+        :param energies: a list of three energies. Missing neighbors
+            should be NaN.
+        :returns: :const:`None`
+
+        """
+        self._wait("send_neighbor_energies_to_master")
+        self._neighbor_energies[self._my_rank] = energies
+        self._wait("send_neighbor_energies_to_master")
+
+    @log_timing(logger)
+    def exchange_state_with_partner(
+        self, state: SystemState, partner: Optional[int]
+    ) -> Optional[SystemState]:
+        """
+        exchange_state_with_partner(state, partner)
+        Swap states with the partner for peer-to-peer exchange.
+
+        :param state: the state for this node
+        :param partner: the rank of the partner, or :const:`None` if this
+            node has no partner this step
+        :returns: the state of the partner, or :const:`None` if there is
+                  no partner
+
+        Every node must call this, even if it has no partner.
+
+        """
+        self._wait("exchange_state_with_partner")
+        self._write_state(self._my_rank, state)
+        self._wait("exchange_state_with_partner")
+        return self._view_state(partner) if partner is not None else None
+
+    @log_timing(logger)
+    def exchange_energies_with_partner(
+        self, energies: List[float], partner: Optional[int]
+    ) -> Optional[List[float]]:
+        """
+        exchange_energies_with_partner(energies, partner)
+        Swap energies with the partner for peer-to-peer exchange.
+
+        :param energies: the energies of this node's state and of the
+            partner's state under this node's hamiltonian
+        :param partner: the rank of the partner, or :const:`None` if this
+            node has no partner this step
+        :returns: the same energies from the partner, or :const:`None` if
+                  there is no partner
+
+        """
+        self._wait("exchange_energies_with_partner")
+        self._partner_energies[self._my_rank] = energies
+        self._wait("exchange_energies_with_partner")
+        if partner is None:
+            return None
+        return list(self._partner_energies[partner])
+
+    @log_timing(logger)
+    def gather_exchange_records_from_slaves(
+        self, record_on_master: List[float]
+    ) -> np.ndarray:
+        """
+        gather_exchange_records_from_slaves(record_on_master)
+        Receive the record of the last peer-to-peer exchange from each slave.
+
+        :param record_on_master: the record from the master, see
+            :func:`meld.remd.slave_runner.exchange_with_partner`
+        :returns: an ``n_replicas x 4`` array with the record from each node
+
+        """
+        self._wait("gather_exchange_records_from_slaves")
+        self._exchange_records[0] = record_on_master
+        self._wait("gather_exchange_records_from_slaves")
+        return self._exchange_records.copy()
+
+    @log_timing(logger)
+    def send_exchange_record_to_master(self, record: List[float]) -> None:
+        """
+        send_exchange_record_to_master(record)
+        Send the record of the last peer-to-peer exchange to the master.
+
+        :param record: the record, see
+            :func:`meld.remd.slave_runner.exchange_with_partner`
+        :returns: :const:`None`
+
+        """
+        self._wait("send_exchange_record_to_master")
+        self._exchange_records[self._my_rank] = record
+        self._wait("send_exchange_record_to_master")
+
+    @log_timing(logger)
+    def negotiate_device_id(self) -> int:
+        # every rank is on this node, so each rank takes the next visible
+        # device, numbered in the same way as MPICommunicator
+        hostname = platform.node()
+        try:
+            env_visible_devices = os.environ["CUDA_VISIBLE_DEVICES"]
+        except KeyError:
+            logger.info("%s CUDA_VISIBLE_DEVICES is not set.", hostname)
+            device_id = self._my_rank
+        else:
+            logger.info("%s found cuda devices: %s", hostname, env_visible_devices)
+            visible_devices = [int(dev) for dev in env_visible_devices.split(",")]
+            if len(visible_devices) < self._n_replicas:
+                logger.error("More worker processes than GPUs")
+                raise RuntimeError("More worker processes than GPUs")
+            min_device_id = min(visible_devices)
+            device_id = visible_devices[self._my_rank]
+            if min_device_id != -1:
+                device_id -= min_device_id
+        logger.info("hostname: %s, device_id: %d", hostname, device_id)
+        return device_id
+
+    @property
+    def n_replicas(self) -> int:
+        return self._n_replicas
+
+    @property
+    def n_atoms(self) -> int:
+        return self._n_atoms
+
+    @property
+    def replicas_per_rank(self) -> int:
+        return 1
+
+    @property
+    def pipeline(self) -> bool:
+        return False
+
+    @property
+    def rank(self) -> int:
+        return self._my_rank
+
+    #
+    # shared memory
+    #
+    # All of the arrays are float64 and are laid out one after another in a
+    # single shared memory block. A box_vector of None is stored as NaN.
+    # Every communication waits on the barrier both before and after writing,
+    # so that no rank writes while another is still reading the result of
+    # the previous communication.
+    #
+
+    def _layout(self) -> List[Tuple[str, Tuple[int, ...]]]:
+        n_replicas = self._n_replicas
+        return [
+            ("positions", (n_replicas, self._n_atoms, 3)),
+            ("velocities", (n_replicas, self._n_atoms, 3)),
+            ("box_vectors", (n_replicas, 3)),
+            ("state_alphas", (n_replicas,)),
+            ("state_energies", (n_replicas,)),
+            ("alphas", (n_replicas,)),
+            ("energies", (n_replicas, n_replicas)),
+            ("neighbor_energies", (n_replicas, 3)),
+            ("partner_energies", (n_replicas, 2)),
+            ("exchange_records", (n_replicas, 4)),
+        ]
+
+    def _map_arrays(self) -> None:
+        assert self._memory is not None
+        buffer = self._memory.buf
+        offset = 0
+        for name, shape in self._layout():
+            array = np.ndarray(shape, np.float64, buffer=buffer, offset=offset)
+            setattr(self, f"_{name}", array)
+            offset += array.nbytes
+
+    def _attach(self, rank, memory, sync, connection) -> None:
+        self._my_rank = rank
+        self._memory = memory
+        self._sync = sync
+        self._connections = [connection]
+        self._map_arrays()
+
+    def _release(self) -> None:
+        # the arrays must be dropped before the memory can be closed
+        for name, _ in self._layout():
+            self.__dict__.pop(f"_{name}", None)
+        if self._memory is not None:
+            self._memory.close()
+            if self._my_rank == 0:
+                self._memory.unlink()
+            self._memory = None
+
+    def _wait(self, name: str) -> None:
+        try:
+            self._sync.wait(self._timeout)
+        except threading.BrokenBarrierError:
+            raise RuntimeError(self._timeout_message.format(name))
+
+    def _write_state(self, index: int, state: SystemState) -> None:
+        self._positions[index] = state.positions
+        self._velocities[index] = state.velocities
+        if state.box_vector is None:
+            self._box_vectors[index] = np.nan
+        else:
+            self._box_vectors[index] = state.box_vector
+        self._state_alphas[index] = state.alpha
+        self._state_energies[index] = state.energy
+
+    def _write_states(self, states: List[SystemState]) -> None:
+        # the states may be views into the shared arrays in a different
+        # order, e.g. after they are permuted, so they are stacked first
+        self._positions[:] = np.array([s.positions for s in states])
+        self._velocities[:] = np.array([s.velocities for s in states])
+        self._box_vectors[:] = [
+            np.full(3, np.nan) if s.box_vector is None else s.box_vector
+            for s in states
+        ]
+        self._state_alphas[:] = [s.alpha for s in states]
+        self._state_energies[:] = [s.energy for s in states]
+
+    def _view_state(self, index: int) -> SystemState:
+        # NaN marks a state without a box
+        box = self._box_vectors[index]
+        box_vector = None if np.isnan(box).any() else box
+        return SystemState(
+            self._positions[index],
+            self._velocities[index],
+            float(self._state_alphas[index]),
+            float(self._state_energies[index]),
+            box_vector,
+        )
+
+    def _view_states(self) -> List[SystemState]:
+        return [self._view_state(index) for index in range(self._n_replicas)]
+
+    def _copy_state(self, index: int) -> SystemState:
+        state = self._view_state(index)
+        state.positions = state.positions.copy()
+        state.velocities = state.velocities.copy()
+        if state.box_vector is not None:
+            state.box_vector = state.box_vector.copy()
+        return state
+
+
+def _run_shared_memory_worker(
+    communicator: SharedMemoryCommunicator,
+    rank: int,
+    name: str,
+    sync: Any,
+    connection: Any,
+    target: Callable[..., None],
+    args: Tuple[Any, ...],
+) -> None:
+    communicator._attach(rank, shared_memory.SharedMemory(name=name), sync, connection)
+    try:
+        target(communicator, *args)
+    except BaseException:
+        # don't leave the other ranks waiting for us until they time out
+        sync.abort()
+        raise
+    finally:
+        communicator._release()
+
+
+def get_mpi_comm_world() -> MPI.Comm:
+    """
+    Helper function to return the comm_world.
+
+    """
+    return MPI.COMM_WORLD
+
+
+def banded_to_dense(energies: np.ndarray) -> np.ndarray:
+    """
+    Convert neighbor energies to a square energy matrix.
+
+    :param energies: ``n_replicas x 3`` array, where ``energies[i]`` holds
+        the energies of structures ``i-1``, ``i``, and ``i+1`` under
+        Hamiltonian ``i``
+    :returns: ``n_replicas x n_replicas`` array with NaN for every entry
+        that was not computed
+
+    """
+    n_replicas = energies.shape[0]
+    dense = np.full((n_replicas, n_replicas), np.nan)
+    for i in range(n_replicas):
+        for offset in [-1, 0, 1]:
+            j = i + offset
+            if 0 <= j < n_replicas:
+                dense[i, j] = energies[i, offset + 1]
+    return dense
 
 
 # namedtuple to hold results for negotiate id
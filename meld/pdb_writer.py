@@ -4,14 +4,16 @@
 #
 
 import numpy as np  # type: ignore
-from typing import List
+from typing import List, Sequence
 
 header = "REMARK stage {stage}"
 footer = "TER\nEND\n\n"
-template = (
+atom_template = (
     "ATOM  {atom_number:>5d} {atom_name:4s} {residue_name:>3s} "
-    + "{residue_number:5d}    {x:8.3f}{y:8.3f}{z:8.3f}"
+    + "{residue_number:5d}    "
 )
+coordinate_template = "%8.3f%8.3f%8.3f"
+template = atom_template + "{x:8.3f}{y:8.3f}{z:8.3f}"
 
 
 class PDBWriter:
@@ -41,29 +43,61 @@ class PDBWriter:
         assert len(residue_names) == self._n_atoms
         self._residue_names = residue_names
 
+        self._frame_template = self._build_frame_template()
+
+    def __getstate__(self):
+        # the template is large, so we rebuild it rather than pickling it
+        excluded = ["_frame_template"]
+        return dict((k, v) for (k, v) in self.__dict__.items() if k not in excluded)
+
+    def __setstate__(self, state):
+        self.__dict__ = state
+        self._frame_template = self._build_frame_template()
+
     def get_pdb_string(self, coordinates: np.ndarray, stage: int) -> str:
         assert coordinates.shape[0] == self._n_atoms
         assert coordinates.shape[1] == 3
 
-        zipper = zip(
-            self._atom_numbers,
-            self._atom_names,
-            self._residue_numbers,
-            self._residue_names,
-            range(coordinates.shape[0]),
+        return self.header.format(stage=stage) + self._frame_template % tuple(
+            coordinates.ravel().tolist()
         )
+
+    def get_pdb_strings(self, coordinates: np.ndarray, stages: Sequence[int]) -> str:
+        """
+        Format several frames at once.
+
+        :param coordinates: n_frames x n_atoms x 3 array
+        :param stages: stage of each frame
+        :return: the frames concatenated together
+
+        """
+        assert coordinates.shape[0] == len(stages)
+        assert coordinates.shape[1] == self._n_atoms
+        assert coordinates.shape[2] == 3
+
+        frames = coordinates.reshape(len(stages), -1).tolist()
+        return "".join(
+            self.header.format(stage=stage) + self._frame_template % tuple(frame)
+            for frame, stage in zip(frames, stages)
+        )
+
+    def _build_frame_template(self) -> str:
+        # The atom information never changes, so we format it once and
+        # fill in the coordinates of each frame with a single % operation.
         lines = [
-            self.template.format(
+            atom_template.format(
                 atom_number=atom_num,
                 atom_name=atom_name,
                 residue_name=res_name,
                 residue_number=res_num,
-                x=coordinates[i, 0],
-                y=coordinates[i, 1],
-                z=coordinates[i, 2],
+            ).replace("%", "%%")
+            + coordinate_template
+            for atom_num, atom_name, res_num, res_name in zip(
+                self._atom_numbers,
+                self._atom_names,
+                self._residue_numbers,
+                self._residue_names,
             )
-            for atom_num, atom_name, res_num, res_name, i in zipper
         ]
-        lines.insert(0, self.header.format(stage=stage))
-        lines.append(self.footer)
-        return "\n".join(lines)
+        lines.append(self.footer.replace("%", "%%"))
+        return "\n" + "\n".join(lines)
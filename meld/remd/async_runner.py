@@ -0,0 +1,362 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+from meld.vault import DataStore
+from meld.system.state import SystemState
+from meld.remd.ladder import (
+    ExchangeCounts,
+    NearestNeighborLadder,
+    rescale_velocities,
+)
+from meld.remd.adaptor import Adaptor
+from meld.system.runner import ReplicaRunner
+from meld.comm import MPICommunicator, Segment
+import logging
+import numpy as np  # type: ignore
+from typing import Dict, List, Set
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncReplicaExchangeRunner:
+    """
+    Class to coordinate running of asynchronous replica exchange
+
+    :param n_replicas: number of replicas
+    :param max_steps: maximum number of steps to run
+    :param ladder: Ladder object to handle exchanges
+    :param adaptor: Adaptor object to handle alphas adaptation
+
+    With :class:`meld.remd.master_runner.MasterReplicaExchangeRunner`, every
+    replica runs each step in lock step, so each step takes as long as the
+    slowest rank. Here, the master does not run molecular dynamics itself.
+    It hands out segments of simulation, one replica at a time, to the other
+    ranks, the workers, as each of them becomes free. When a worker
+    finishes, its replica waits for the next free worker, and the master
+    attempts an exchange between it and each neighbor on the ladder that is
+    also waiting. The energies for exchanges are computed by the master.
+    Faster workers simply run more segments.
+
+    There can be any number of workers, but there should be fewer workers
+    than replicas, so that some replicas are always waiting to be
+    exchanged. The waiting replica that has run the fewest segments is
+    always run next.
+
+    The data is stored after every ``n_replicas`` segments, which counts as
+    one step. Each step stores the latest state at each ladder index, along
+    with the number of segments run at each ladder index
+    (:meth:`DataStore.save_replica_stages`) and the exchanges attempted
+    since the previous step (:meth:`DataStore.save_exchange_counts`). The
+    permutation vector combines all of the swaps since the previous step,
+    so the walkers can be followed as usual. The stored energy matrix only
+    has the diagonal. The alphas are adapted at the start of each step.
+
+    This requires a :class:`meld.comm.MPICommunicator` with
+    ``transport="pickle"``. The number of MPI processes does not need to
+    match the number of replicas.
+
+    """
+
+    #
+    # read only properties
+    #
+
+    @property
+    def n_replicas(self) -> int:
+        return self._n_replicas
+
+    @property
+    def alphas(self) -> List[float]:
+        return self._alphas
+
+    @property
+    def step(self) -> int:
+        return self._step
+
+    @property
+    def max_steps(self) -> int:
+        return self._max_steps
+
+    @property
+    def replica_stages(self) -> List[int]:
+        return self._replica_stages
+
+    #
+    # public methods
+    #
+
+    _alphas: List[float]
+
+    def __init__(
+        self,
+        n_replicas: int,
+        max_steps: int,
+        ladder: NearestNeighborLadder,
+        adaptor: Adaptor,
+    ) -> None:
+        self._n_replicas = n_replicas
+        self._max_steps = max_steps
+        # the number of segments run at each ladder index
+        self._replica_stages = [0] * n_replicas
+        self._step = 1
+        self.ladder = ladder
+        self.adaptor = adaptor
+        self._setup_alphas()
+
+    def to_slave(self) -> "AsyncSlaveRunner":
+        """
+        Return an AsyncSlaveRunner based on self.
+
+        """
+        return AsyncSlaveRunner.from_master(self)
+
+    def run(
+        self,
+        communicator: MPICommunicator,
+        system_runner: ReplicaRunner,
+        store: DataStore,
+    ):
+        """
+        Run replica exchange until finished
+
+        :param communicator: A communicator object to talk with workers
+        :param system_runner: a ReplicaRunner object to compute the energies
+        :param store: a Store object to handle storing data to disk
+
+        """
+        logger.info("Beginning asynchronous replica exchange")
+        # check to make sure n_replicas matches
+        assert self._n_replicas == store.n_replicas
+        if communicator.n_workers < 1:
+            raise RuntimeError("Asynchronous replica exchange needs a worker.")
+        if communicator.n_workers >= self._n_replicas:
+            logger.warning(
+                "There are %d workers for %d replicas. Replicas will rarely "
+                "wait at the same time, so few exchanges will be attempted.",
+                communicator.n_workers,
+                self._n_replicas,
+            )
+
+        # load previous state from the store, making sure that it was
+        # completely written before we stopped
+        store.verify_stage(self.step - 1)
+        states = store.load_states(stage=self.step - 1)
+
+        self._alphas = self.adaptor.adapt(self._alphas, self._step)
+        energies = [
+            self._compute_energy(state, index, system_runner)
+            for index, state in enumerate(states)
+        ]
+        waiting = list(range(self._n_replicas))
+        running: Dict[int, int] = {}
+        free_workers = list(range(1, communicator.n_workers + 1))
+        # we always minimize the first segment of each replica, either on
+        # the first stage or the first stage after a restart
+        minimized: Set[int] = set()
+
+        permutation_vector = list(range(self._n_replicas))
+        exchanges = self._no_exchanges()
+        n_segments = 0
+        while self._step <= self._max_steps:
+            # start the replicas that have run the fewest segments
+            while free_workers and waiting:
+                index = min(waiting, key=lambda i: (self._replica_stages[i], i))
+                waiting.remove(index)
+                worker = free_workers.pop(0)
+                segment = Segment(
+                    index,
+                    self._alphas[index],
+                    states[index],
+                    index not in minimized,
+                    self._step,
+                )
+                communicator.send_segment_to_worker(worker, segment)
+                minimized.add(index)
+                running[worker] = index
+
+            worker, index, state = communicator.receive_segment_state_from_worker()
+            del running[worker]
+            free_workers.append(worker)
+            states[index] = state
+            energies[index] = self._compute_energy(state, index, system_runner)
+            self._replica_stages[index] += 1
+            waiting.append(index)
+            n_segments += 1
+
+            # attempt exchanges with the neighbors that are also waiting
+            for i in [index - 1, index]:
+                if i in waiting and i + 1 in waiting:
+                    self._attempt_exchange(
+                        i,
+                        states,
+                        energies,
+                        permutation_vector,
+                        exchanges,
+                        system_runner,
+                    )
+
+            if n_segments == self._n_replicas:
+                self._finish_step(
+                    states, energies, permutation_vector, exchanges, store
+                )
+                permutation_vector = list(range(self._n_replicas))
+                exchanges = self._no_exchanges()
+                n_segments = 0
+                if self._step <= self._max_steps:
+                    self._alphas = self.adaptor.adapt(self._alphas, self._step)
+
+        # wait for the segments that are still running, then stop the workers
+        for _ in range(len(running)):
+            communicator.receive_segment_state_from_worker()
+        communicator.stop_workers()
+        logger.info(
+            "Finished %d steps of replica exchange successfully.", self._max_steps
+        )
+
+    #
+    # private helper methods
+    #
+
+    def _attempt_exchange(
+        self,
+        i: int,
+        states: List[SystemState],
+        energies: List[float],
+        permutation_vector: List[int],
+        exchanges: ExchangeCounts,
+        system_runner: ReplicaRunner,
+    ) -> None:
+        j = i + 1
+        # pair_energies[a, b] is structure b under hamiltonian a. They are
+        # all recomputed, as the alphas may have changed since the replicas
+        # finished their segments.
+        pair_energies = np.array(
+            [
+                [self._compute_energy(states[b], a, system_runner) for b in [i, j]]
+                for a in [i, j]
+            ]
+        )
+        accepted = self.ladder.attempt_exchange(i, pair_energies, self.adaptor)
+        exchanges.attempts[i] += 1
+        if not accepted:
+            return
+        exchanges.successes[i] += 1
+
+        scaler = system_runner.temperature_scaler
+        alpha_i, alpha_j = self._alphas[i], self._alphas[j]
+        state_i, state_j = states[i], states[j]
+        state_i.positions, state_j.positions = state_j.positions, state_i.positions
+        state_i.box_vector, state_j.box_vector = state_j.box_vector, state_i.box_vector
+        state_i.velocities, state_j.velocities = (
+            rescale_velocities(state_j.velocities, alpha_j, alpha_i, scaler),
+            rescale_velocities(state_i.velocities, alpha_i, alpha_j, scaler),
+        )
+        state_i.energy, state_j.energy = state_j.energy, state_i.energy
+        energies[i], energies[j] = pair_energies[0, 1], pair_energies[1, 0]
+        permutation_vector[i], permutation_vector[j] = (
+            permutation_vector[j],
+            permutation_vector[i],
+        )
+
+    def _finish_step(
+        self,
+        states: List[SystemState],
+        energies: List[float],
+        permutation_vector: List[int],
+        exchanges: ExchangeCounts,
+        store: DataStore,
+    ) -> None:
+        logger.info(
+            "Finished replica exchange step %d of %d.", self._step, self._max_steps
+        )
+        energy_matrix = np.full((self._n_replicas, self._n_replicas), np.nan)
+        np.fill_diagonal(energy_matrix, energies)
+
+        # store everything
+        store.save_states(states, self.step)
+        store.append_traj(states[0], self.step)
+        store.save_alphas(self._alphas, self.step)
+        store.save_permutation_vector(permutation_vector, self.step)
+        store.save_energy_matrix(energy_matrix, self.step)
+        store.save_replica_stages(self._replica_stages, self.step)
+        store.save_exchange_counts(exchanges, self.step)
+        store.save_acceptance_probabilities(
+            self.adaptor.get_acceptance_probabilities(), self.step
+        )
+        store.update_statistics(
+            self.step, energy_matrix, permutation_vector, self._alphas, exchanges
+        )
+        store.save_data_store()
+
+        # on to the next step!
+        self._step += 1
+        store.save_remd_runner(self)
+        store.backup(self.step - 1)
+
+    def _compute_energy(
+        self, state: SystemState, index: int, system_runner: ReplicaRunner
+    ) -> float:
+        # the energy of a state with the hamiltonian of a ladder index
+        system_runner.prepare_for_timestep(self._alphas[index], self._step)
+        return system_runner.get_energy(state)
+
+    def _no_exchanges(self) -> ExchangeCounts:
+        return ExchangeCounts(
+            np.zeros(self._n_replicas - 1, int), np.zeros(self._n_replicas - 1, int)
+        )
+
+    def _setup_alphas(self) -> None:
+        delta = 1.0 / (self._n_replicas - 1.0)
+        self._alphas = [i * delta for i in range(self._n_replicas)]
+
+
+class AsyncSlaveRunner:
+    """
+    This class runs segments of asynchronous replica exchange on the workers.
+
+    """
+
+    def __init__(self, max_steps):
+        self._max_steps = max_steps
+
+    @classmethod
+    def from_master(cls, master):
+        """
+        Initialize a new worker from a master.
+
+        :param master: a :class:`AsyncReplicaExchangeRunner` to serve as a
+                       template
+        :return: a :class:`AsyncSlaveRunner`
+
+        """
+        return cls(master.max_steps)
+
+    @property
+    def max_steps(self):
+        return self._max_steps
+
+    def run(self, communicator, system_runner):
+        """
+        Run segments until the master has no more.
+
+        :param communicator: a communicator object for talking to the master
+        :param system_runner: a system_runner object for actually running the
+                              simulations
+
+        """
+        while True:
+            segment = communicator.receive_segment_from_master()
+            if segment is None:
+                break
+
+            state = segment.state
+            system_runner.prepare_for_timestep(segment.alpha, segment.step)
+            state.alpha = segment.alpha
+            if segment.minimize:
+                state = system_runner.minimize_then_run(state)
+            else:
+                state = system_runner.run(state)
+            communicator.send_segment_state_to_master(segment.index, state)
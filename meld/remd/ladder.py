@@ -7,13 +7,19 @@ import random
 import math
 import logging
 import numpy as np  # type: ignore
-from typing import List
+from collections import namedtuple
+from typing import Callable, List, Optional
 from meld.remd.adaptor import Adaptor
 from meld.util import log_timing
 
 logger = logging.getLogger(__name__)
 
 
+# named tuple to hold the number of attempted and accepted swaps between
+# each pair of adjacent replicas
+ExchangeCounts = namedtuple("ExchangeCounts", "attempts successes")
+
+
 class NearestNeighborLadder:
     """
     Class to compute replica exchange swaps between neighboring replicas.
@@ -24,6 +30,21 @@ class NearestNeighborLadder:
 
     def __init__(self, n_trials: int) -> None:
         self.n_trials = n_trials
+        self._last_exchanges = ExchangeCounts(np.zeros(0, int), np.zeros(0, int))
+
+    def last_exchanges(self) -> ExchangeCounts:
+        """
+        Return the swaps attempted by the last call to compute the exchanges.
+
+        :return: an :class:`ExchangeCounts` with ``n_replicas - 1`` arrays
+                 counting the attempted and accepted swaps between replicas
+                 ``i`` and ``i + 1``
+
+        Unlike the adaptor, these counts are never reset, so they can be
+        accumulated over the whole run.
+
+        """
+        return self._last_exchanges
 
     @log_timing(logger)
     def compute_exchanges(self, energies: np.ndarray, adaptor: Adaptor) -> List[int]:
@@ -61,6 +82,9 @@ class NearestNeighborLadder:
 
         n_replicas = energies.shape[0]
         permutation_vector = list(range(n_replicas))
+        self._last_exchanges = ExchangeCounts(
+            np.zeros(n_replicas - 1, int), np.zeros(n_replicas - 1, int)
+        )
 
         choices = range(n_replicas - 1)
         for iteration in range(self.n_trials):
@@ -70,6 +94,90 @@ class NearestNeighborLadder:
 
         return permutation_vector
 
+    @log_timing(logger)
+    def compute_neighbor_exchanges(
+        self, energies: np.ndarray, adaptor: Adaptor
+    ) -> List[int]:
+        """
+        compute_neighbor_exchanges(energies, adaptor)
+        Compute the exchanges given a banded energy matrix.
+
+        :param energies: numpy array of energies, as for
+                         :meth:`compute_exchanges`
+        :param adaptor: replica exchange adaptor that is updated every
+                        attempted swap
+        :return: a permutation vector, as for :meth:`compute_exchanges`
+
+        Only the diagonal ``energies[i,i]`` and the first off-diagonals
+        ``energies[i,i+1]`` and ``energies[i+1,i]`` are used, so every
+        other entry may be NaN.
+
+        Rather than ``self.n_trials`` swaps between random pairs, this
+        method attempts a single sweep of swaps between disjoint pairs,
+        either ``(0, 1), (2, 3), ...`` or ``(1, 2), (3, 4), ...``, chosen
+        at random. Because no two trials involve the same replica, each
+        trial only needs entries from the band.
+
+        """
+        assert len(energies.shape) == 2
+        assert energies.shape[0] == energies.shape[1]
+
+        n_replicas = energies.shape[0]
+        permutation_vector = list(range(n_replicas))
+        self._last_exchanges = ExchangeCounts(
+            np.zeros(n_replicas - 1, int), np.zeros(n_replicas - 1, int)
+        )
+
+        first = random.choice([0, 1])
+        for i in range(first, n_replicas - 1, 2):
+            j = i + 1
+            self._do_trial(i, j, permutation_vector, energies, adaptor)
+
+        return permutation_vector
+
+    def record_peer_exchanges(
+        self, energies: np.ndarray, accepted: np.ndarray, adaptor: Adaptor
+    ) -> List[int]:
+        """
+        record_peer_exchanges(energies, accepted, adaptor)
+        Record exchanges that were decided by the replicas themselves.
+
+        :param energies: banded energy matrix, as for
+                         :meth:`compute_neighbor_exchanges`, from before the
+                         exchanges. The columns of each accepted pair are
+                         swapped, as they would be by
+                         :meth:`compute_neighbor_exchanges`.
+        :param accepted: ``n_replicas - 1`` array, where ``accepted[i]`` is 1
+                         if the swap between ``i`` and ``i + 1`` was accepted,
+                         0 if it was rejected, and -1 if it was not attempted
+        :param adaptor: replica exchange adaptor that is updated every
+                        attempted swap
+        :return: a permutation vector, as for :meth:`compute_exchanges`
+
+        This is used with peer-to-peer exchange, where each pair of
+        replicas decides its own swap with :func:`accept_peer_exchange`
+        and the master only keeps the books.
+
+        """
+        n_replicas = energies.shape[0]
+        assert len(accepted) == n_replicas - 1
+        permutation_vector = list(range(n_replicas))
+        self._last_exchanges = ExchangeCounts(
+            np.zeros(n_replicas - 1, int), np.zeros(n_replicas - 1, int)
+        )
+
+        for i, result in enumerate(accepted):
+            if result < 0:
+                continue
+            self._last_exchanges.attempts[i] += 1
+            if result:
+                self._last_exchanges.successes[i] += 1
+                self._swap_permutation(i, i + 1, permutation_vector)
+                self._swap_energies(i, i + 1, energies)
+            adaptor.update(i, bool(result))
+
+        return permutation_vector
+
     def _do_trial(
         self,
         i: int,
@@ -79,24 +187,47 @@ class NearestNeighborLadder:
         adaptor: Adaptor,
     ) -> None:
         """Perform a replica exchange trial"""
-        delta = energies[i, i] - energies[j, i] + energies[j, j] - energies[i, j]
-        accepted = False
-
-        if delta >= 0:
-            accepted = True
-        else:
-            metrop = math.exp(delta)
-            rand = random.random()
-            if rand < metrop:
-                accepted = True
+        accepted = self._metropolis(energies[np.ix_([i, j], [i, j])])
 
+        self._last_exchanges.attempts[i] += 1
         if accepted:
+            self._last_exchanges.successes[i] += 1
             self._swap_permutation(i, j, permutation_vector)
             self._swap_energies(i, j, energies)
             adaptor.update(i, True)
         else:
             adaptor.update(i, False)
 
+    def attempt_exchange(self, i: int, energies: np.ndarray, adaptor: Adaptor) -> bool:
+        """
+        attempt_exchange(i, energies, adaptor)
+        Attempt a single swap between replicas ``i`` and ``i + 1``.
+
+        :param i: the lower ladder index of the pair
+        :param energies: 2 x 2 array of energies in units of kT, where
+                         ``energies[a,b]`` is the energy of structure
+                         ``i + b`` with the hamiltonian of replica ``i + a``
+        :param adaptor: replica exchange adaptor that is updated with the
+                        result
+        :return: :const:`True` if the swap is accepted
+
+        This is used by asynchronous replica exchange, where swaps are
+        attempted one at a time between replicas that are waiting. It does
+        not change :meth:`last_exchanges`.
+
+        """
+        accepted = self._metropolis(energies)
+        adaptor.update(i, accepted)
+        return accepted
+
+    @staticmethod
+    def _metropolis(energies: np.ndarray) -> bool:
+        """Metropolis test for a 2 x 2 energy matrix"""
+        delta = energies[0, 0] - energies[1, 0] + energies[1, 1] - energies[0, 1]
+        if delta >= 0:
+            return True
+        return random.random() < math.exp(delta)
+
     @staticmethod
     def _swap_permutation(i: int, j: int, permutation_vector: List[int]) -> None:
         """Swap two elements of the permutation matrix"""
@@ -109,3 +240,78 @@ class NearestNeighborLadder:
     def _swap_energies(i: int, j: int, energies: np.ndarray) -> None:
         """Swap two columns of the energy matrix"""
         energies[:, [i, j]] = energies[:, [j, i]]
+
+
+def peer_exchange_partner(index: int, step: int, n_replicas: int) -> Optional[int]:
+    """
+    Find the partner of a replica for peer-to-peer exchange.
+
+    :param index: ladder index of the replica
+    :param step: the current step
+    :param n_replicas: number of replicas
+    :return: the ladder index of the partner, or :const:`None` if the
+             replica has no partner this step
+
+    Swaps are attempted between ``(0, 1), (2, 3), ...`` on even steps and
+    between ``(1, 2), (3, 4), ...`` on odd steps, so that every replica
+    can be exchanged with both of its neighbors.
+
+    """
+    if (index - step) % 2 == 0:
+        partner = index + 1
+    else:
+        partner = index - 1
+    if 0 <= partner < n_replicas:
+        return partner
+    return None
+
+
+def accept_peer_exchange(
+    energies: np.ndarray, lower: int, step: int, seed: int
+) -> bool:
+    """
+    Decide a swap between two neighboring replicas.
+
+    :param energies: 2 x 2 array of energies in units of kT, where
+                     ``energies[i,j]`` is the energy of structure j with
+                     the hamiltonian of replica i, and the replica with the
+                     lower ladder index is first
+    :param lower: the lower ladder index of the pair
+    :param step: the current step
+    :param seed: random seed shared by all replicas
+    :return: :const:`True` if the swap is accepted
+
+    The random number for the Metropolis test is drawn from a generator
+    seeded with ``seed``, ``step``, and ``lower``. Both replicas of the pair
+    therefore reach the same decision without further communication.
+
+    """
+    delta = energies[0, 0] - energies[1, 0] + energies[1, 1] - energies[0, 1]
+    if delta >= 0:
+        return True
+    rand = np.random.RandomState([seed, step, lower]).random_sample()
+    return bool(rand < math.exp(delta))
+
+
+def rescale_velocities(
+    velocities: np.ndarray,
+    old_alpha: float,
+    new_alpha: float,
+    temperature_scaler: Callable[[float], float],
+) -> np.ndarray:
+    """
+    Rescale velocities to the temperature of a new alpha.
+
+    :param velocities: n_atoms x 3 array of velocities at ``old_alpha``
+    :param old_alpha: the alpha the velocities are from
+    :param new_alpha: the alpha to rescale the velocities to
+    :param temperature_scaler: gives the temperature of each alpha
+    :return: the rescaled velocities
+
+    This is used whenever a structure moves to a different place on the
+    ladder, so that its kinetic energy matches the new temperature.
+
+    """
+    old_temperature = temperature_scaler(old_alpha)
+    new_temperature = temperature_scaler(new_alpha)
+    return math.sqrt(new_temperature / old_temperature) * velocities
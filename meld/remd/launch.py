@@ -7,15 +7,17 @@ import logging
 import logging.handlers
 import meld
 from meld import util
+from meld import comm
 from meld import vault
 from meld.system import get_runner
 from simtk.openmm import version as mm_version  # type: ignore
 from meld.remd import multiplex_runner
 import socket
 import multiprocessing as mp
-from typing import Tuple, Union
+from typing import Optional, Tuple, Union
 
 Handler = Union[logging.StreamHandler, logging.handlers.SocketHandler]
+Communicator = Union[comm.MPICommunicator, comm.SharedMemoryCommunicator]
 
 
 logger = logging.getLogger(__name__)
@@ -30,14 +32,71 @@ def launch(
     console_handler: Handler,
     debug: bool = False,
     console_log: bool = False,
+    async_writes: bool = False,
+    shared_memory: bool = False,
 ) -> None:
+    """
+    Launch replica exchange on this rank.
+
+    :param console_handler: the handler that logs to the console, which is
+        replaced by the handler set up here
+    :param debug: log at the debug level
+    :param console_log: log to the console rather than to ``remd.log``
+    :param async_writes: write data to disk from a background thread
+    :param shared_memory: run every replica on this node, with the slaves in
+        worker processes that communicate through a
+        :class:`meld.comm.SharedMemoryCommunicator`, rather than under
+        ``mpirun``
+
+    """
     logger.info("loading data store")
     store = vault.DataStore.load_data_store()
 
     logger.info("initializing communicator")
     communicator = store.load_communicator()
+    if not shared_memory:
+        communicator.initialize()
+        _launch_rank(
+            store, communicator, console_handler, debug, console_log, async_writes
+        )
+        return
+
+    communicator = comm.SharedMemoryCommunicator(
+        communicator.n_atoms, communicator.n_replicas
+    )
     communicator.initialize()
-
+    logger.info("starting %d worker processes", communicator.n_replicas - 1)
+    communicator.start_workers(_launch_shared_memory_worker, debug, console_log)
+    try:
+        _launch_rank(
+            store, communicator, console_handler, debug, console_log, async_writes
+        )
+    except BaseException:
+        communicator.abort()
+        raise
+    communicator.close()
+
+
+def _launch_shared_memory_worker(
+    communicator: comm.SharedMemoryCommunicator, debug: bool, console_log: bool
+) -> None:
+    store = vault.DataStore.load_data_store()
+    # the worker may have set up logging when the main module was
+    # imported, so we start from a clean slate
+    meld_logger = logging.getLogger("meld")
+    for handler in list(meld_logger.handlers):
+        meld_logger.removeHandler(handler)
+    _launch_rank(store, communicator, None, debug, console_log, False)
+
+
+def _launch_rank(
+    store: vault.DataStore,
+    communicator: Communicator,
+    console_handler: Optional[Handler],
+    debug: bool,
+    console_log: bool,
+    async_writes: bool,
+) -> None:
     #
     # setup logging
     #
@@ -52,7 +111,8 @@ def launch(
     # remove the console handler, so that
     # we can add a new handler below without
     # duplicate logging messages
-    meld_logger.removeHandler(console_handler)
+    if console_handler is not None:
+        meld_logger.removeHandler(console_handler)
 
     if not console_log:
         if communicator.is_master():
@@ -105,7 +165,12 @@ def launch(
     if communicator.is_master():
         store.initialize(mode="a")
         remd_runner = store.load_remd_runner()
-        remd_runner.run(communicator, system_runner, store)
+        writer: Union[vault.DataStore, vault.AsyncDataStoreWriter] = store
+        if async_writes:
+            logger.info("Writing data in the background")
+            writer = vault.AsyncDataStoreWriter(store)
+        remd_runner.run(communicator, system_runner, writer)
+        writer.close()
     else:
         remd_runner = store.load_remd_runner().to_slave()
         remd_runner.run(communicator, system_runner)
@@ -117,7 +182,7 @@ def launch(
 
 
 def launch_multiplex(
-    console_handler: Handler, debug: bool = False
+    console_handler: Handler, debug: bool = False, async_writes: bool = False
 ) -> None:
     logger.info("Loading data store")
     store = vault.DataStore.load_data_store()
@@ -158,4 +223,8 @@ def launch_multiplex(
         remd_runner._step,
     )
 
+    if async_writes:
+        logger.info("Writing data in the background")
+        store = vault.AsyncDataStoreWriter(store)
     runner.run(system_runner, store)
+    store.close()
@@ -6,14 +6,17 @@
 from meld.vault import DataStore
 from meld.system.state import SystemState
 from meld.remd import slave_runner
-from meld.remd.ladder import NearestNeighborLadder
+from meld.remd.ladder import NearestNeighborLadder, rescale_velocities
 from meld.remd.adaptor import Adaptor
 from meld.remd.reseed import NullReseeder
 from meld.system.runner import ReplicaRunner
 from meld.comm import MPICommunicator
+import copy
 import logging
 import math
-from typing import List, Union
+import random
+import numpy as np  # type: ignore
+from typing import List, Optional, Tuple, Union
 
 
 logger = logging.getLogger(__name__)
@@ -30,6 +33,13 @@ class MasterReplicaExchangeRunner:
     :param max_steps: maximum number of steps to run
     :param ladder: Ladder object to handle exchanges
     :param adaptor: Adaptor object to handle alphas adaptation
+    :param neighbor_energies_only: only compute the energies needed for
+        exchanges between neighboring replicas
+    :param swap_alphas: exchange alphas between ranks rather than coordinates
+    :param peer_exchange: let neighboring ranks decide exchanges between
+        themselves
+    :param state_interval: with ``peer_exchange``, only gather the states
+        of every rank every this many steps
 
     """
 
@@ -53,6 +63,81 @@ class MasterReplicaExchangeRunner:
     def max_steps(self) -> int:
         return self._max_steps
 
+    @property
+    def neighbor_energies_only(self) -> bool:
+        """
+        Only compute the energies needed for neighbor exchanges.
+
+        By default, every state is evaluated under every replica's
+        Hamiltonian, which requires ``n_replicas**2`` energy evaluations per
+        step. Otherwise, each replica only receives the states of its two
+        neighbors and computes three energies. Exchanges are then attempted
+        with :meth:`NearestNeighborLadder.compute_neighbor_exchanges` and
+        the energy matrix that is stored is NaN outside of the tridiagonal
+        band.
+
+        """
+        return self._neighbor_energies_only
+
+    @property
+    def swap_alphas(self) -> bool:
+        """
+        Exchange alphas between ranks rather than coordinates.
+
+        By default, the coordinates and velocities of exchanged replicas are
+        permuted and the master scatters the full states back out every
+        step. Otherwise, each rank keeps its own configuration and only its
+        alpha is permuted, with the velocities rescaled locally to the new
+        temperature. The master broadcasts only the alphas and keeps track
+        of which rank is at each ladder index (see :attr:`replica_ranks`).
+        States are still stored in ladder order, along with the rank holding
+        each structure (see :meth:`DataStore.save_replica_ranks`).
+
+        """
+        return self._swap_alphas
+
+    @property
+    def peer_exchange(self) -> bool:
+        """
+        Let neighboring ranks decide exchanges between themselves.
+
+        Rank ``r`` always runs ladder index ``r``, and on each step the pairs
+        ``(0, 1), (2, 3), ...`` or ``(1, 2), (3, 4), ...`` alternately swap
+        their states and energies directly. Both ranks of a pair draw the
+        same random number from a generator seeded with
+        :attr:`exchange_seed`, so they agree on the outcome without the
+        master. If the swap is accepted, each keeps the structure of the
+        other. The master receives a small record of each exchange, from
+        which the permutation vector, the banded energy matrix, and the
+        adaptor are updated. This cannot be combined with ``swap_alphas``,
+        ``neighbor_energies_only``, or reseeding.
+
+        """
+        return self._peer_exchange
+
+    @property
+    def exchange_seed(self) -> int:
+        return self._exchange_seed
+
+    @property
+    def state_interval(self) -> int:
+        """
+        Number of steps between gathering the states with peer exchange.
+
+        The states are also gathered on the last step. In between, the
+        master only stores its own state, at ladder index 0, with
+        :meth:`DataStore.save_partial_states`. The store and runner are only
+        saved on the steps where the states are gathered, so a run restarts
+        from the last of these. The :class:`meld.vault.StoragePolicy` must
+        not need the other states in between.
+
+        """
+        return self._state_interval
+
+    @property
+    def replica_ranks(self) -> List[int]:
+        return self._replica_ranks
+
     #
     # public methods
     #
@@ -65,9 +150,35 @@ class MasterReplicaExchangeRunner:
         max_steps: int,
         ladder: NearestNeighborLadder,
         adaptor: Adaptor,
+        neighbor_energies_only: bool = False,
+        swap_alphas: bool = False,
+        peer_exchange: bool = False,
+        state_interval: int = 1,
     ) -> None:
+        if neighbor_energies_only and swap_alphas:
+            # neighbor energies rely on adjacent ranks having adjacent alphas
+            raise ValueError(
+                "neighbor_energies_only and swap_alphas cannot be used together"
+            )
+        if peer_exchange and (neighbor_energies_only or swap_alphas):
+            raise ValueError(
+                "peer_exchange cannot be used with neighbor_energies_only or "
+                "swap_alphas"
+            )
+        if state_interval < 1:
+            raise ValueError("state_interval must be at least 1")
+        if state_interval > 1 and not peer_exchange:
+            raise ValueError("state_interval requires peer_exchange")
         self._n_replicas = n_replicas
         self._max_steps = max_steps
+        self._neighbor_energies_only = neighbor_energies_only
+        self._swap_alphas = swap_alphas
+        self._peer_exchange = peer_exchange
+        # shared by all ranks, so that pairs agree on their exchanges
+        self._exchange_seed = random.randrange(2 ** 32)
+        self._state_interval = state_interval
+        # the rank holding the structure at each ladder index
+        self._replica_ranks = list(range(n_replicas))
         self._step = 1
         self.ladder = ladder
         self.adaptor = adaptor
@@ -94,15 +205,43 @@ class MasterReplicaExchangeRunner:
         :param system_runner: a ReplicaRunner object to run the simulations
         :param store: a Store object to handle storing data to disk
 
+        If the communicator has more than one replica per rank (see
+        :class:`meld.comm.MPICommunicator`), each rank runs its slice of the
+        replicas one after another and computes the energies of every state
+        under each of them. The results are the same as with one replica per
+        rank. This cannot be combined with ``swap_alphas``,
+        ``neighbor_energies_only``, or ``peer_exchange``.
+
+        If the communicator pipelines the exchange, each rank computes the
+        energy of each state as soon as it arrives, rather than waiting for
+        every state first.
+
         """
         logger.info("Beginning replica exchange")
         # check to make sure n_replicas matches
         assert self._n_replicas == communicator.n_replicas
         assert self._n_replicas == store.n_replicas
-
-        # load previous state from the store
+        if self._swap_alphas and not isinstance(self.reseeder, NullReseeder):
+            raise RuntimeError("Reseeding is not supported with swap_alphas.")
+        if self._peer_exchange and not isinstance(self.reseeder, NullReseeder):
+            raise RuntimeError("Reseeding is not supported with peer_exchange.")
+        if self._state_interval > 1:
+            self._check_state_interval(store)
+
+        # load previous state from the store, making sure that it was
+        # completely written before we stopped
+        store.verify_stage(self.step - 1)
         states = store.load_states(stage=self.step - 1)
 
+        if communicator.replicas_per_rank > 1:
+            if self._swap_alphas or self._neighbor_energies_only or self._peer_exchange:
+                raise RuntimeError(
+                    "swap_alphas, neighbor_energies_only, and peer_exchange are "
+                    "not supported with more than one replica per rank."
+                )
+            self._run_batches(communicator, system_runner, store, states)
+            return
+
         # we always minimize when we first start, either on the first
         # stage or the first stage after a restart
         minimize = True
@@ -112,13 +251,33 @@ class MasterReplicaExchangeRunner:
                 "Running replica exchange step %d of %d.", self._step, self._max_steps
             )
 
-            # update alphas
-            system_runner.prepare_for_timestep(0., self._step)
-            self._alphas = self.adaptor.adapt(self._alphas, self._step)
-            communicator.broadcast_alphas_to_slaves(self._alphas)
+            if self._swap_alphas or self._peer_exchange:
+                # update alphas, each rank keeps its own state after the
+                # first step
+                self._alphas = self.adaptor.adapt(self._alphas, self._step)
+                rank_alphas = self._by_rank(self._alphas)
+                communicator.broadcast_alphas_to_slaves(rank_alphas)
+                if minimize:
+                    my_state = communicator.broadcast_states_to_slaves(
+                        self._by_rank(states)
+                    )
+                else:
+                    my_state.velocities = rescale_velocities(
+                        my_state.velocities,
+                        my_state.alpha,
+                        rank_alphas[0],
+                        system_runner.temperature_scaler,
+                    )
+                my_state.alpha = rank_alphas[0]
+                system_runner.prepare_for_timestep(rank_alphas[0], self._step)
+            else:
+                # update alphas
+                system_runner.prepare_for_timestep(0., self._step)
+                self._alphas = self.adaptor.adapt(self._alphas, self._step)
+                communicator.broadcast_alphas_to_slaves(self._alphas)
+                my_state = communicator.broadcast_states_to_slaves(states)
 
             # do one step
-            my_state = communicator.broadcast_states_to_slaves(states)
             if minimize:
                 logger.info("First step, minimizing and then running.")
                 my_state = system_runner.minimize_then_run(my_state)
@@ -127,42 +286,190 @@ class MasterReplicaExchangeRunner:
                 logger.info("Running molecular dynamics.")
                 my_state = system_runner.run(my_state)
 
-            # gather all of the states
-            states = communicator.exchange_states_for_energy_calc(my_state)
+            if self._peer_exchange:
+                # swap with our partner, then gather the states for storage
+                # and the record of each exchange
+                my_state, my_record = slave_runner.exchange_with_partner(
+                    communicator,
+                    my_state,
+                    self._step,
+                    self._exchange_seed,
+                    system_runner,
+                )
+                if slave_runner.gathers_peer_states(
+                    self._step, self._max_steps, self._state_interval
+                ):
+                    states = communicator.gather_states_from_slaves(my_state)
+                else:
+                    # we only have our own state, at ladder index 0
+                    states = [my_state] + [None] * (self._n_replicas - 1)
+                records = communicator.gather_exchange_records_from_slaves(my_record)
+                energies, accepted = self._unpack_exchange_records(records)
+
+                # the states were already exchanged by the ranks
+                permutation_vector = self.ladder.record_peer_exchanges(
+                    energies, accepted, self.adaptor
+                )
+            elif self._neighbor_energies_only:
+                # gather all of the states for storage, but only
+                # compute the energies of our neighbors
+                states = communicator.gather_states_from_slaves(my_state)
+                neighbors = communicator.exchange_states_with_neighbors(my_state)
+                my_energies = self._compute_neighbor_energies(
+                    my_state, neighbors, system_runner
+                )
+                energies = communicator.gather_neighbor_energies_from_slaves(
+                    my_energies
+                )
+
+                # ask the ladder how to permute things
+                permutation_vector = self.ladder.compute_neighbor_exchanges(
+                    energies, self.adaptor
+                )
+                states = self._permute_states(permutation_vector, states, system_runner)
+            else:
+                if communicator.pipeline:
+                    # compute our energy for each state as it arrives
+                    states, my_energies = slave_runner.exchange_and_compute_energies(
+                        communicator, my_state, system_runner
+                    )
+                else:
+                    # gather all of the states
+                    states = communicator.exchange_states_for_energy_calc(my_state)
+
+                    # compute our energy for each state
+                    my_energies = self._compute_energies(states, system_runner)
+                energies = communicator.gather_energies_from_slaves(my_energies)
+
+                if self._swap_alphas:
+                    # put the states and energies in ladder order. We copy
+                    # the states so that permuting them for storage does not
+                    # modify the state that we keep running.
+                    ranks = self._replica_ranks
+                    states = [copy.copy(states[rank]) for rank in ranks]
+                    energies = np.array(energies)[np.ix_(ranks, ranks)]
+
+                # ask the ladder how to permute things
+                permutation_vector = self.ladder.compute_exchanges(
+                    energies, self.adaptor
+                )
+                if self._swap_alphas:
+                    self._replica_ranks = [
+                        self._replica_ranks[index] for index in permutation_vector
+                    ]
+                states = self._permute_states(permutation_vector, states, system_runner)
+            self._finish_step(states, energies, permutation_vector, store)
+        logger.info(
+            "Finished %d steps of replica exchange successfully.", self._max_steps
+        )
+
+    #
+    # private helper methods
+    #
+
+    def _run_batches(
+        self,
+        communicator: MPICommunicator,
+        system_runner: ReplicaRunner,
+        store: DataStore,
+        states: List[SystemState],
+    ) -> None:
+        # each rank runs a slice of the replicas, one after another
+        minimize = True
+        while self._step <= self._max_steps:
+            logger.info(
+                "Running replica exchange step %d of %d.", self._step, self._max_steps
+            )
+            self._alphas = self.adaptor.adapt(self._alphas, self._step)
+            my_alphas = communicator.broadcast_alpha_batches_to_slaves(self._alphas)
+            my_states = communicator.broadcast_state_batches_to_slaves(states)
+
+            if minimize:
+                logger.info("First step, minimizing and then running.")
+            else:
+                logger.info("Running molecular dynamics.")
+            my_states = slave_runner.run_batch(
+                my_states, my_alphas, self._step, system_runner, minimize
+            )
+            minimize = False
 
-            # compute our energy for each state
-            my_energies = self._compute_energies(states, system_runner)
-            energies = communicator.gather_energies_from_slaves(my_energies)
+            # gather all of the states and compute the energies of every
+            # state under each of our replicas
+            states = communicator.exchange_state_batches_for_energy_calc(my_states)
+            my_energies = slave_runner.compute_batch_energies(
+                states, my_alphas, self._step, system_runner
+            )
+            energies = communicator.gather_energy_batches_from_slaves(my_energies)
 
-            # ask the ladder how to permute things
             permutation_vector = self.ladder.compute_exchanges(energies, self.adaptor)
             states = self._permute_states(permutation_vector, states, system_runner)
+            self._finish_step(states, energies, permutation_vector, store)
+        logger.info(
+            "Finished %d steps of replica exchange successfully.", self._max_steps
+        )
 
-            # perform reseeding if it is time
-            self.reseeder.reseed(self.step, states, store)
+    def _finish_step(
+        self,
+        states: List[SystemState],
+        energies: np.ndarray,
+        permutation_vector: List[int],
+        store: DataStore,
+    ) -> None:
+        # perform reseeding if it is time
+        self.reseeder.reseed(self.step, states, store)
 
-            # store everything
+        # store everything
+        complete = all(state is not None for state in states)
+        if complete:
             store.save_states(states, self.step)
-            store.append_traj(states[0], self.step)
-            store.save_alphas(self._alphas, self.step)
-            store.save_permutation_vector(permutation_vector, self.step)
-            store.save_energy_matrix(energies, self.step)
-            store.save_acceptance_probabilities(
-                self.adaptor.get_acceptance_probabilities(), self.step
-            )
-            store.save_data_store()
+        else:
+            store.save_partial_states(states, self.step)
+        store.append_traj(states[0], self.step)
+        store.save_alphas(self._alphas, self.step)
+        store.save_permutation_vector(permutation_vector, self.step)
+        store.save_energy_matrix(energies, self.step)
+        if self._swap_alphas:
+            store.save_replica_ranks(self._replica_ranks, self.step)
+        store.save_acceptance_probabilities(
+            self.adaptor.get_acceptance_probabilities(), self.step
+        )
+        store.update_statistics(
+            self.step,
+            energies,
+            permutation_vector,
+            self._alphas,
+            self.ladder.last_exchanges(),
+        )
 
-            # on to the next step!
-            self._step += 1
+        # on to the next step!
+        self._step += 1
+        if complete:
+            # only checkpoint the stages that a run can be restarted from
+            store.save_data_store()
             store.save_remd_runner(self)
             store.backup(self.step - 1)
-        logger.info(
-            "Finished %d steps of replica exchange successfully.", self._max_steps
-        )
 
-    #
-    # private helper methods
-    #
+    def _check_state_interval(self, store: DataStore) -> None:
+        # between the steps where the states are gathered, we only have the
+        # state at ladder index 0, so that is all the policy may store, and
+        # backups must fall on steps where the states are gathered
+        policy = store.storage_policy
+        interval = self._state_interval
+        if (
+            policy.position_interval % interval
+            or (
+                policy.velocity_interval is not None
+                and policy.velocity_interval % interval
+            )
+            or any(replica != 0 for replica in policy.full_replicas)
+            or store.block_size % interval
+        ):
+            raise RuntimeError(
+                f"With state_interval={interval}, the position_interval, "
+                "velocity_interval, and block_size of the store must be "
+                "multiples of state_interval, and full_replicas may only "
+                "contain replica 0."
+            )
 
     @staticmethod
     def _compute_energies(
@@ -173,6 +480,34 @@ class MasterReplicaExchangeRunner:
             my_energies.append(system_runner.get_energy(state))
         return my_energies
 
+    @staticmethod
+    def _compute_neighbor_energies(
+        state: SystemState,
+        neighbors: Tuple[Optional[SystemState], Optional[SystemState]],
+        system_runner: ReplicaRunner,
+    ) -> List[float]:
+        left, right = neighbors
+        return [
+            system_runner.get_energy(left) if left is not None else math.nan,
+            system_runner.get_energy(state),
+            system_runner.get_energy(right) if right is not None else math.nan,
+        ]
+
+    @staticmethod
+    def _unpack_exchange_records(records: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # build the banded energy matrix and the outcome of the swap between
+        # each pair from the records of the peer-to-peer exchanges
+        n_replicas = len(records)
+        energies = np.full((n_replicas, n_replicas), np.nan)
+        accepted = np.full(n_replicas - 1, -1, dtype=int)
+        for rank, (own_energy, partner_energy, partner, result) in enumerate(records):
+            energies[rank, rank] = own_energy
+            if partner >= 0:
+                energies[rank, int(partner)] = partner_energy
+                if partner > rank:
+                    accepted[rank] = int(result)
+        return energies, accepted
+
     @staticmethod
     def _permute_states(
         permutation_matrix: List[int],
@@ -183,17 +518,27 @@ class MasterReplicaExchangeRunner:
         old_velocities = [s.velocities for s in states]
         old_box_vectors = [s.box_vector for s in states]
         old_energy = [s.energy for s in states]
-        temperatures = [system_runner.temperature_scaler(s.alpha) for s in states]
+        alphas = [s.alpha for s in states]
 
         for i, index in enumerate(permutation_matrix):
             states[i].positions = old_coords[index]
             states[i].box_vector = old_box_vectors[index]
-            states[i].velocities = (
-                math.sqrt(temperatures[i] / temperatures[index]) * old_velocities[index]
+            states[i].velocities = rescale_velocities(
+                old_velocities[index],
+                alphas[index],
+                alphas[i],
+                system_runner.temperature_scaler,
             )
             states[i].energy = old_energy[index]
         return states
 
+    def _by_rank(self, values: List) -> List:
+        # reorder values from ladder order to rank order
+        by_rank = [None] * self._n_replicas
+        for index, rank in enumerate(self._replica_ranks):
+            by_rank[rank] = values[index]
+        return by_rank
+
     def _setup_alphas(self) -> None:
         delta = 1.0 / (self._n_replicas - 1.0)
         self._alphas = [i * delta for i in range(self._n_replicas)]
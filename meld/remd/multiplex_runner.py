@@ -4,9 +4,9 @@
 #
 
 import numpy as np  #type: ignore
+from meld.remd.ladder import rescale_velocities
 from meld.remd.reseed import NullReseeder
 import logging
-import math
 
 
 logger = logging.getLogger(__name__)
@@ -71,7 +71,9 @@ class MultiplexReplicaExchangeRunner:
         # check to make sure n_replicas matches
         assert self._n_replicas == store.n_replicas
 
-        # load previous state from the store
+        # load previous state from the store, making sure that it was
+        # completely written before we stopped
+        store.verify_stage(self.step - 1)
         states = store.load_states(stage=self.step - 1)
 
         while self._step <= self._max_steps:
@@ -122,6 +124,13 @@ class MultiplexReplicaExchangeRunner:
             store.save_acceptance_probabilities(
                 self.adaptor.get_acceptance_probabilities(), self.step
             )
+            store.update_statistics(
+                self.step,
+                energies,
+                permutation_vector,
+                self._alphas,
+                self.ladder.last_exchanges(),
+            )
             store.save_data_store()
 
             # on to the next step!
@@ -149,12 +158,15 @@ class MultiplexReplicaExchangeRunner:
         old_velocities = [s.velocities for s in states]
         old_box_vectors = [s.box_vector for s in states]
         old_energy = [s.energy for s in states]
-        temperatures = [system_runner.temperature_scaler(s.alpha) for s in states]
+        alphas = [s.alpha for s in states]
         for i, index in enumerate(permutation_matrix):
             states[i].positions = old_coords[index]
             states[i].box_vector = old_box_vectors[index]
-            states[i].velocities = (
-                math.sqrt(temperatures[i] / temperatures[index]) * old_velocities[index]
+            states[i].velocities = rescale_velocities(
+                old_velocities[index],
+                alphas[index],
+                alphas[i],
+                system_runner.temperature_scaler,
             )
             states[i].energy = old_energy[index]
         return states
@@ -3,6 +3,16 @@
 # All rights reserved
 #
 
+import math
+import numpy as np  # type: ignore
+from meld.system.state import SystemState
+from meld.remd.ladder import (
+    accept_peer_exchange,
+    peer_exchange_partner,
+    rescale_velocities,
+)
+from typing import List, Optional, Tuple
+
 
 class SlaveReplicaExchangeRunner:
     """
@@ -10,9 +20,23 @@ class SlaveReplicaExchangeRunner:
 
     """
 
-    def __init__(self, step, max_steps):
+    def __init__(
+        self,
+        step,
+        max_steps,
+        neighbor_energies_only=False,
+        swap_alphas=False,
+        peer_exchange=False,
+        exchange_seed=0,
+        state_interval=1,
+    ):
         self._step = step
         self._max_steps = max_steps
+        self._neighbor_energies_only = neighbor_energies_only
+        self._swap_alphas = swap_alphas
+        self._peer_exchange = peer_exchange
+        self._exchange_seed = exchange_seed
+        self._state_interval = state_interval
 
     @classmethod
     def from_master(cls, master):
@@ -25,7 +49,15 @@ class SlaveReplicaExchangeRunner:
         :return: a :class:`SlaveReplicaExchangeRunner`
 
         """
-        new_slave = cls(master.step, master.max_steps)
+        new_slave = cls(
+            master.step,
+            master.max_steps,
+            neighbor_energies_only=master.neighbor_energies_only,
+            swap_alphas=master.swap_alphas,
+            peer_exchange=master.peer_exchange,
+            exchange_seed=master.exchange_seed,
+            state_interval=master.state_interval,
+        )
         return new_slave
 
     @property
@@ -36,6 +68,26 @@ class SlaveReplicaExchangeRunner:
     def max_steps(self):
         return self._max_steps
 
+    @property
+    def neighbor_energies_only(self):
+        return self._neighbor_energies_only
+
+    @property
+    def swap_alphas(self):
+        return self._swap_alphas
+
+    @property
+    def peer_exchange(self):
+        return self._peer_exchange
+
+    @property
+    def exchange_seed(self):
+        return self._exchange_seed
+
+    @property
+    def state_interval(self):
+        return self._state_interval
+
     def run(self, communicator, system_runner):
         """
         Continue running slave jobs until done.
@@ -45,7 +97,12 @@ class SlaveReplicaExchangeRunner:
                               simulations
 
         """
+        if communicator.replicas_per_rank > 1:
+            self._run_batches(communicator, system_runner)
+            return
+
         my_alpha = None
+        state = None
 
         # we always minimize when we first start, either on the first
         # stage or the first stage after a restart
@@ -53,7 +110,17 @@ class SlaveReplicaExchangeRunner:
         while self._step <= self._max_steps:
             # update simulation conditions
             new_alpha = communicator.receive_alpha_from_master()
-            state = communicator.receive_state_from_master()
+            if (self._swap_alphas or self._peer_exchange) and state is not None:
+                # keep our own state, but rescale the velocities to
+                # the temperature of our new alpha
+                state.velocities = rescale_velocities(
+                    state.velocities,
+                    state.alpha,
+                    new_alpha,
+                    system_runner.temperature_scaler,
+                )
+            else:
+                state = communicator.receive_state_from_master()
 
             my_alpha = new_alpha
             system_runner.prepare_for_timestep(my_alpha, self._step)
@@ -67,12 +134,205 @@ class SlaveReplicaExchangeRunner:
                 state = system_runner.run(state)
 
             # compute energies
-            states = communicator.exchange_states_for_energy_calc(state)
+            if self._peer_exchange:
+                state, record = exchange_with_partner(
+                    communicator, state, self._step, self._exchange_seed, system_runner
+                )
+                if gathers_peer_states(
+                    self._step, self._max_steps, self._state_interval
+                ):
+                    communicator.send_state_to_master(state)
+                communicator.send_exchange_record_to_master(record)
+            elif self._neighbor_energies_only:
+                communicator.send_state_to_master(state)
+                left, right = communicator.exchange_states_with_neighbors(state)
+                energies = [
+                    system_runner.get_energy(left) if left is not None else math.nan,
+                    system_runner.get_energy(state),
+                    system_runner.get_energy(right) if right is not None else math.nan,
+                ]
+                communicator.send_neighbor_energies_to_master(energies)
+            elif communicator.pipeline:
+                _, energies = exchange_and_compute_energies(
+                    communicator, state, system_runner
+                )
+                communicator.send_energies_to_master(energies)
+            else:
+                states = communicator.exchange_states_for_energy_calc(state)
 
-            energies = []
-            for state in states:
-                energy = system_runner.get_energy(state)
-                energies.append(energy)
-            communicator.send_energies_to_master(energies)
+                energies = []
+                for other_state in states:
+                    energy = system_runner.get_energy(other_state)
+                    energies.append(energy)
+                communicator.send_energies_to_master(energies)
 
             self._step += 1
+
+        if communicator.pipeline:
+            communicator.wait_for_sends()
+
+    def _run_batches(self, communicator, system_runner):
+        # each rank runs a slice of the replicas, one after another
+        minimize = True
+        while self._step <= self._max_steps:
+            alphas = communicator.receive_alpha_batch_from_master()
+            states = communicator.receive_state_batch_from_master()
+            states = run_batch(states, alphas, self._step, system_runner, minimize)
+            minimize = False
+
+            all_states = communicator.exchange_state_batches_for_energy_calc(states)
+            energies = compute_batch_energies(
+                all_states, alphas, self._step, system_runner
+            )
+            communicator.send_energy_batches_to_master(energies)
+
+            self._step += 1
+
+
+def exchange_and_compute_energies(
+    communicator, state, system_runner
+) -> Tuple[List[SystemState], List[float]]:
+    """
+    Exchange states and compute the energy of each one as it arrives.
+
+    :param communicator: a communicator with ``pipeline=True``
+    :param state: the state for this rank
+    :param system_runner: a system_runner object to compute the energies
+    :returns: a tuple ``(states, energies)`` of the state from every rank
+              and its energy
+
+    """
+    states: List[Optional[SystemState]] = [None] * communicator.n_replicas
+    energies = [math.nan] * communicator.n_replicas
+    for rank, other_state in communicator.iter_states_for_energy_calc(state):
+        states[rank] = other_state
+        energies[rank] = system_runner.get_energy(other_state)
+    return states, energies  # type: ignore
+
+
+def gathers_peer_states(step, max_steps, state_interval) -> bool:
+    """
+    Decide if the states are sent to the master with peer-to-peer exchange.
+
+    :param step: the current step
+    :param max_steps: the last step of the run
+    :param state_interval: gather the states every this many steps
+    :returns: :const:`True` if every rank sends its state this step
+
+    The states are always gathered on the last step, so that the run can
+    be continued.
+
+    """
+    return step % state_interval == 0 or step == max_steps
+
+
+def exchange_with_partner(
+    communicator, state, step, seed, system_runner
+) -> Tuple[SystemState, List[float]]:
+    """
+    Attempt a peer-to-peer exchange with the neighboring replica.
+
+    :param communicator: a communicator with one replica per rank
+    :param state: the state for this rank
+    :param step: the current step
+    :param seed: random seed shared by all replicas
+    :param system_runner: a system_runner object to compute the energies
+    :returns: a tuple ``(state, record)`` of the state to continue with
+              and a record of the exchange for the master
+
+    Rank ``r`` always runs ladder index ``r``. The pairs of ranks given by
+    :func:`meld.remd.ladder.peer_exchange_partner` swap their states, compute
+    the energy of both under their own hamiltonian, and swap these energies.
+    Both ranks of a pair then make the same decision with
+    :func:`meld.remd.ladder.accept_peer_exchange`. If the swap is accepted,
+    each rank continues with the structure of its partner, with the
+    velocities rescaled to its own temperature.
+
+    The record is ``[own energy, energy of the partner's structure, partner,
+    accepted]``, where the partner and accepted are -1 if there was no
+    partner, and accepted is otherwise 1 or 0. The energies are of the
+    structures before any swap.
+
+    """
+    rank = communicator.rank
+    partner = peer_exchange_partner(rank, step, communicator.n_replicas)
+    partner_state = communicator.exchange_state_with_partner(state, partner)
+    own_energy = system_runner.get_energy(state)
+    if partner_state is None:
+        partner_energy = math.nan
+    else:
+        partner_energy = system_runner.get_energy(partner_state)
+    partner_energies = communicator.exchange_energies_with_partner(
+        [own_energy, partner_energy], partner
+    )
+    if partner is None:
+        return state, [own_energy, partner_energy, -1.0, -1.0]
+
+    # energies[i, j] is structure j under hamiltonian i, ours first
+    energies = np.array(
+        [
+            [own_energy, partner_energy],
+            [partner_energies[1], partner_energies[0]],
+        ]
+    )
+    if partner < rank:
+        energies = energies[::-1, ::-1]
+    accepted = accept_peer_exchange(energies, min(rank, partner), step, seed)
+
+    if accepted:
+        # the partner's state may be a view into a communication buffer
+        state.positions = np.array(partner_state.positions)
+        state.velocities = rescale_velocities(
+            partner_state.velocities,
+            partner_state.alpha,
+            state.alpha,
+            system_runner.temperature_scaler,
+        )
+        state.box_vector = (
+            None
+            if partner_state.box_vector is None
+            else np.array(partner_state.box_vector)
+        )
+        state.energy = partner_state.energy
+    return state, [own_energy, partner_energy, float(partner), float(accepted)]
+
+
+def run_batch(states, alphas, step, system_runner, minimize):
+    """
+    Run one stage of simulation for each of a rank's replicas.
+
+    :param states: the states of the rank's replicas
+    :param alphas: the alpha of each replica
+    :param step: the current step
+    :param system_runner: a system_runner object to run the simulations
+    :param minimize: minimize each state before running
+    :returns: a list of the states after simulating
+
+    """
+    new_states = []
+    for state, alpha in zip(states, alphas):
+        system_runner.prepare_for_timestep(alpha, step)
+        state.alpha = alpha
+        if minimize:
+            new_states.append(system_runner.minimize_then_run(state))
+        else:
+            new_states.append(system_runner.run(state))
+    return new_states
+
+
+def compute_batch_energies(states, alphas, step, system_runner) -> List[List[float]]:
+    """
+    Compute the energy of every state under each of a rank's replicas.
+
+    :param states: the states of all replicas
+    :param alphas: the alpha of each of the rank's replicas
+    :param step: the current step
+    :param system_runner: a system_runner object to compute the energies
+    :returns: one row of energies for each of the rank's replicas
+
+    """
+    energies = []
+    for alpha in alphas:
+        system_runner.prepare_for_timestep(alpha, step)
+        energies.append([system_runner.get_energy(state) for state in states])
+    return energies
@@ -0,0 +1,190 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+import numpy as np  # type: ignore
+from typing import List, Tuple
+
+
+class RunningStatistics:
+    """
+    Summaries of a replica exchange run that are updated every stage.
+
+    :param n_replicas: number of replicas
+
+    The runners update these statistics with the data from each stage, and
+    they are stored along with the :class:`meld.vault.DataStore`. This
+    allows common questions about a run to be answered without reading the
+    stored time series.
+
+    - the mean and variance of the energy at each ladder index, computed
+      with Welford's algorithm from the diagonal of the energy matrix
+    - the number of attempted and accepted swaps between each pair of
+      adjacent replicas, which unlike the adaptor's counts are never reset
+    - the walker at each ladder index, whether each walker last visited the
+      bottom or top of the ladder, and the number of round trips each walker
+      has made
+    - the alphas each time they change
+
+    Walkers are numbered by their ladder index at stage 0, as for
+    :meth:`meld.vault.DataStore.load_walker_index`.
+
+    """
+
+    def __init__(self, n_replicas: int) -> None:
+        self._n_replicas = n_replicas
+        self._n_stages = 0
+        self._last_stage = 0
+        self._energy_mean = np.zeros(n_replicas)
+        self._energy_m2 = np.zeros(n_replicas)
+        self._attempts = np.zeros(n_replicas - 1, dtype=int)
+        self._successes = np.zeros(n_replicas - 1, dtype=int)
+        self._walker_index = np.arange(n_replicas)
+        # +1 if the walker last visited the bottom of the ladder, -1 if it
+        # last visited the top, and 0 if it has visited neither. At stage 0,
+        # the first and last walkers are at the ends.
+        self._walker_direction = np.zeros(n_replicas, dtype=int)
+        self._walker_direction[0] = 1
+        self._walker_direction[-1] = -1
+        self._half_trips = np.zeros(n_replicas, dtype=int)
+        # number of stages each ladder index held an upward or downward walker
+        self._up_count = np.zeros(n_replicas, dtype=int)
+        self._down_count = np.zeros(n_replicas, dtype=int)
+        self._alpha_history: List[Tuple[int, List[float]]] = []
+
+    def update(self, stage, energy_matrix, permutation_vector, alphas, exchanges):
+        """
+        Add the data from one stage.
+
+        :param stage: int stage the data is from
+        :param energy_matrix: n_replicas x n_replicas array, as stored with
+            :meth:`meld.vault.DataStore.save_energy_matrix`
+        :param permutation_vector: n_replicas array of int
+        :param alphas: n_replicas array of alphas used for this stage
+        :param exchanges: :class:`meld.remd.ladder.ExchangeCounts` for
+            this stage
+
+        Stages that are not after the last stage that was added are ignored,
+        e.g. a stage that is repeated after a restart.
+
+        """
+        if stage <= self._last_stage:
+            return
+        self._last_stage = stage
+        self._n_stages += 1
+
+        energies = np.diagonal(np.asarray(energy_matrix, dtype=float))
+        delta = energies - self._energy_mean
+        self._energy_mean += delta / self._n_stages
+        self._energy_m2 += delta * (energies - self._energy_mean)
+
+        self._attempts += np.asarray(exchanges.attempts, dtype=int)
+        self._successes += np.asarray(exchanges.successes, dtype=int)
+
+        self._walker_index = self._walker_index[np.asarray(permutation_vector)]
+        bottom = self._walker_index[0]
+        top = self._walker_index[-1]
+        for walker, direction in [(bottom, 1), (top, -1)]:
+            if self._walker_direction[walker] == -direction:
+                self._half_trips[walker] += 1
+            self._walker_direction[walker] = direction
+        directions = self._walker_direction[self._walker_index]
+        self._up_count += directions == 1
+        self._down_count += directions == -1
+
+        alphas = [float(alpha) for alpha in alphas]
+        if not self._alpha_history or self._alpha_history[-1][1] != alphas:
+            self._alpha_history.append((stage, alphas))
+
+    @property
+    def n_replicas(self) -> int:
+        return self._n_replicas
+
+    @property
+    def n_stages(self) -> int:
+        """Number of stages included in the statistics."""
+        return self._n_stages
+
+    @property
+    def last_stage(self) -> int:
+        """The last stage included in the statistics, 0 if there are none."""
+        return self._last_stage
+
+    @property
+    def energy_mean(self) -> np.ndarray:
+        """Mean energy at each ladder index."""
+        if not self._n_stages:
+            return np.full(self._n_replicas, np.nan)
+        return self._energy_mean.copy()
+
+    @property
+    def energy_variance(self) -> np.ndarray:
+        """Sample variance of the energy at each ladder index."""
+        if self._n_stages < 2:
+            return np.full(self._n_replicas, np.nan)
+        return self._energy_m2 / (self._n_stages - 1)
+
+    @property
+    def attempts(self) -> np.ndarray:
+        """Attempted swaps between ladder indices ``i`` and ``i + 1``."""
+        return self._attempts.copy()
+
+    @property
+    def successes(self) -> np.ndarray:
+        """Accepted swaps between ladder indices ``i`` and ``i + 1``."""
+        return self._successes.copy()
+
+    @property
+    def acceptance_probabilities(self) -> np.ndarray:
+        """Fraction of accepted swaps for each pair, NaN if none were tried."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(
+                self._attempts > 0, self._successes / self._attempts, np.nan
+            )
+
+    @property
+    def walker_index(self) -> np.ndarray:
+        """The walker at each ladder index after the last stage."""
+        return self._walker_index.copy()
+
+    @property
+    def walker_direction(self) -> np.ndarray:
+        """
+        The direction of each walker.
+
+        This is +1 if the walker last visited the bottom of the ladder, so is
+        moving up, -1 if it last visited the top, and 0 if it has visited
+        neither.
+
+        """
+        return self._walker_direction.copy()
+
+    @property
+    def round_trips(self) -> np.ndarray:
+        """Number of trips each walker has made to the other end and back."""
+        return self._half_trips // 2
+
+    @property
+    def f_up(self) -> np.ndarray:
+        """
+        Fraction of the time each ladder index held a walker moving up.
+
+        Only walkers that have visited one of the ends are counted. This is
+        NaN for ladder indices that have never held such a walker.
+
+        """
+        total = self._up_count + self._down_count
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(total > 0, self._up_count / total, np.nan)
+
+    @property
+    def alpha_history(self) -> List[Tuple[int, List[float]]]:
+        """
+        The alphas each time they changed.
+
+        A list of ``(stage, alphas)``, where ``alphas`` were used from
+        ``stage`` until the stage of the next entry.
+
+        """
+        return list(self._alpha_history)
@@ -0,0 +1,594 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+"""
+Backends for the block files written by :class:`meld.vault.DataStore`.
+
+A backend opens and creates datasets. The datasets provide the part of the
+``netCDF4.Dataset`` interface that the store uses: dimensions, variables
+that are read and written by slicing and return masked arrays, and
+attributes on the dataset and its variables. The store does not need to
+know which backend it is writing to.
+
+The netcdf backend is the default. The raw backend stores each block as a
+directory holding one uncompressed binary file per variable and a JSON
+manifest describing them. Variables with a ``timesteps`` dimension are
+stored one stage after another, so appending a stage is a single write at
+the end of the file, and different variables can be written at the same
+time from different threads.
+
+"""
+
+import json
+import os
+import shutil
+import threading
+import netCDF4 as cdf  # type: ignore
+import numpy as np  # type: ignore
+from meld import checkpoint
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+
+class StorageBackend:
+    """
+    Base class for storage backends.
+
+    :attr name: name used to select the backend
+    :attr extension: extension of the block files
+    :attr parallel_writes: True if different variables of the same dataset
+        can be written from different threads
+
+    """
+
+    name = ""
+    extension = ""
+    parallel_writes = False
+
+    def open(self, path: str, mode: str) -> Any:
+        """
+        Open a dataset.
+
+        :param path: path of the dataset
+        :param mode: 'w' to create a new dataset, 'a' to modify an existing
+            one, or 'r' to read one
+        :return: the dataset, which must be closed after use
+
+        """
+        raise NotImplementedError()
+
+    def stat(self, path: str) -> Tuple[int, int]:
+        """Return the size and modification time in ns of a dataset."""
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def remove(self, path: str) -> None:
+        """Remove a dataset."""
+        os.remove(path)
+
+
+class NetCDFBackend(StorageBackend):
+    """Store each block as a compressed netcdf file."""
+
+    name = "netcdf"
+    extension = ".nc"
+
+    def open(self, path: str, mode: str) -> Any:
+        if mode == "w":
+            return cdf.Dataset(path, "w", format="NETCDF4")
+        if mode == "a":
+            return cdf.Dataset(path, "a")
+        return cdf.Dataset(path, "r")
+
+
+class RawBackend(StorageBackend):
+    """
+    Store each block as a directory of uncompressed binary files.
+
+    Compression, chunking, and checksum settings of the
+    :class:`meld.vault.StorageProfile` are ignored, but its precision is
+    used.
+
+    """
+
+    name = "raw"
+    extension = ".raw"
+    parallel_writes = True
+
+    def open(self, path: str, mode: str) -> "RawDataset":
+        return RawDataset(path, mode)
+
+    def stat(self, path: str) -> Tuple[int, int]:
+        size = 0
+        mtime = 0
+        for entry in os.scandir(path):
+            stat = entry.stat()
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime_ns)
+        return size, mtime
+
+    def remove(self, path: str) -> None:
+        shutil.rmtree(path)
+
+
+STORAGE_BACKENDS: Dict[str, StorageBackend] = {
+    "netcdf": NetCDFBackend(),
+    "raw": RawBackend(),
+}
+
+
+def backend_for_path(path: str) -> StorageBackend:
+    """Return the backend that wrote path, based on its extension."""
+    for backend in STORAGE_BACKENDS.values():
+        if path.endswith(backend.extension):
+            return backend
+    raise ValueError(f"Unknown storage backend for {path}")
+
+
+def open_dataset(path: str, mode: str) -> Any:
+    """Open a dataset with the backend that wrote it."""
+    return backend_for_path(path).open(path, mode)
+
+
+# the default fill values used by netcdf, so that unwritten data is masked
+# in the same way by both backends
+_FILL_VALUES = {
+    "i1": -127,
+    "u1": 255,
+    "i2": -32767,
+    "u2": 65535,
+    "i4": -2147483647,
+    "u4": 4294967295,
+    "i8": -9223372036854775806,
+    "u8": 18446744073709551614,
+    "f4": 9.969209968386869e36,
+    "f8": 9.969209968386869e36,
+}
+
+
+class RawDataset:
+    """
+    A dataset stored as a directory of binary files.
+
+    :param path: path of the directory
+    :param mode: 'w', 'a', or 'r'
+
+    The layout is described by ``manifest.json``, which records the
+    dimensions, the type and dimensions of each variable, and the attributes.
+    The manifest is written atomically when the dataset is synced or closed.
+    Its attributes, like the committed stage, therefore only change once the
+    data written before has been synced to disk.
+
+    Variables with a ``timesteps`` dimension can only be written one range
+    of stages at a time. Stages that have not been written are masked when
+    read.
+
+    """
+
+    manifest_filename = "manifest.json"
+
+    def __init__(self, path: str, mode: str) -> None:
+        if mode not in ["w", "a", "r"]:
+            raise ValueError(f"Unknown mode {mode}")
+        self._path = path
+        self._writable = mode != "r"
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._written: set = set()
+        self._closed = False
+        if mode == "w":
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.mkdir(path)
+            self._attributes: Dict[str, Any] = {}
+            self._dimensions: Dict[str, Optional[int]] = {}
+            self._variables: Dict[str, RawVariable] = {}
+            self._dirty = True
+        else:
+            manifest_path = os.path.join(path, self.manifest_filename)
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+            self._attributes = manifest["attributes"]
+            self._dimensions = manifest["dimensions"]
+            self._variables = {
+                name: RawVariable(
+                    self,
+                    name,
+                    np.dtype(entry["dtype"]),
+                    tuple(entry["dimensions"]),
+                    entry["attributes"],
+                )
+                for name, entry in manifest["variables"].items()
+            }
+
+    def __enter__(self) -> "RawDataset":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __getattr__(self, name: str) -> Any:
+        if not name.startswith("_") and name in self._attributes:
+            return self._attributes[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            self.setncatts({name: value})
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def variables(self) -> Dict[str, "RawVariable"]:
+        return self._variables
+
+    @property
+    def dimensions(self) -> Dict[str, "RawDimension"]:
+        return {name: RawDimension(self, name) for name in self._dimensions}
+
+    def ncattrs(self) -> Sequence[str]:
+        return list(self._attributes)
+
+    def getncattr(self, name: str) -> Any:
+        return self._attributes[name]
+
+    def setncatts(self, attributes: Dict[str, Any]) -> None:
+        self._check_writable()
+        for name, value in attributes.items():
+            self._attributes[name] = _to_json(value)
+        self._dirty = True
+
+    def createDimension(self, name: str, size: Optional[int]) -> "RawDimension":
+        self._check_writable()
+        self._dimensions[name] = size
+        self._dirty = True
+        return RawDimension(self, name)
+
+    def createVariable(
+        self, name: str, dtype: Any, dimensions: Sequence[str], **kwargs
+    ) -> "RawVariable":
+        # compression and chunking options are accepted and ignored
+        self._check_writable()
+        variable = RawVariable(self, name, np.dtype(dtype), tuple(dimensions), {})
+        variable._create()
+        self._variables[name] = variable
+        self._dirty = True
+        return variable
+
+    def sync(self) -> None:
+        """Make everything written so far durable, then write the manifest."""
+        if not self._writable:
+            return
+        with self._lock:
+            for name in self._written:
+                self._variables[name]._fsync()
+            self._written = set()
+            if self._dirty:
+                self._write_manifest()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        # there is nothing left to save if the directory was removed
+        if os.path.isdir(self._path):
+            self.sync()
+        self._closed = True
+
+    def _check_writable(self) -> None:
+        if not self._writable:
+            raise RuntimeError(f"{self._path} was opened read-only")
+
+    def _before_write(self, name: str) -> None:
+        # readers must be able to open the dataset once data is written
+        self._check_writable()
+        with self._lock:
+            self._written.add(name)
+            if self._dirty:
+                self._write_manifest()
+
+    def _write_manifest(self) -> None:
+        manifest = {
+            "format": "meld-raw",
+            "version": 1,
+            "attributes": self._attributes,
+            "dimensions": self._dimensions,
+            "variables": {
+                name: {
+                    "dtype": variable.dtype.str,
+                    "dimensions": list(variable.dimensions),
+                    "attributes": variable._attributes,
+                }
+                for name, variable in self._variables.items()
+            },
+        }
+        checkpoint.atomic_write(
+            os.path.join(self._path, self.manifest_filename),
+            json.dumps(manifest, indent=2).encode(),
+        )
+        self._dirty = False
+
+    def _n_stages(self) -> int:
+        # like a netcdf unlimited dimension, this is the number of stages
+        # written to any variable
+        return max(
+            [v._n_records() for v in self._variables.values() if v._is_stage],
+            default=0,
+        )
+
+
+class RawDimension:
+    """A dimension of a :class:`RawDataset`."""
+
+    def __init__(self, dataset: RawDataset, name: str) -> None:
+        self._dataset = dataset
+        self.name = name
+
+    def __len__(self) -> int:
+        size = self._dataset._dimensions[self.name]
+        if size is None:
+            return self._dataset._n_stages()
+        return size
+
+    def isunlimited(self) -> bool:
+        return self._dataset._dimensions[self.name] is None
+
+
+class RawVariable:
+    """
+    A variable of a :class:`RawDataset`, stored in ``<name>.bin``.
+
+    Indexing follows netcdf rather than numpy, so lists of indices select
+    along each axis independently.
+
+    """
+
+    def __init__(
+        self,
+        dataset: RawDataset,
+        name: str,
+        dtype: np.dtype,
+        dimensions: Tuple[str, ...],
+        attributes: Dict[str, Any],
+    ) -> None:
+        self._dataset = dataset
+        self._name = name
+        self._dtype = dtype
+        self._dimensions = dimensions
+        self._attributes = attributes
+        self._fill_value = dtype.type(_FILL_VALUES[dtype.str[1:]])
+        self._path = os.path.join(dataset.path, f"{name}.bin")
+        self._is_stage = bool(dimensions) and dimensions[-1] == "timesteps"
+
+    def __getattr__(self, name: str) -> Any:
+        if not name.startswith("_") and name in self._attributes:
+            return self._attributes[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            self.setncatts({name: value})
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    @property
+    def dimensions(self) -> Tuple[str, ...]:
+        return self._dimensions
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return tuple(len(self._dataset.dimensions[d]) for d in self._dimensions)
+
+    def ncattrs(self) -> Sequence[str]:
+        return list(self._attributes)
+
+    def setncatts(self, attributes: Dict[str, Any]) -> None:
+        self._dataset._check_writable()
+        for name, value in attributes.items():
+            self._attributes[name] = _to_json(value)
+        self._dataset._dirty = True
+
+    def chunking(self) -> str:
+        return "contiguous"
+
+    def __getitem__(self, index: Any) -> np.ma.MaskedArray:
+        index = _expand_index(index, len(self._dimensions))
+        if not self._is_stage:
+            return self._decode(_orthogonal_index(self._read_all(), index))
+
+        # read the range of stages that covers the index, then select
+        n_stages = self._dataset._n_stages()
+        stage_index = index[-1]
+        if isinstance(stage_index, slice):
+            start, stop, step = stage_index.indices(n_stages)
+            if step == 1:
+                first, last = start, max(start, stop)
+                relative: Any = slice(None)
+            else:
+                stage_index = np.arange(start, stop, step)
+        elif np.ndim(stage_index) == 0:
+            stage = int(stage_index)
+            if stage < 0:
+                stage += n_stages
+            if not 0 <= stage < n_stages:
+                raise IndexError(f"Stage {stage_index} is out of range")
+            first, last = stage, stage + 1
+            relative = 0
+        if not isinstance(stage_index, slice) and np.ndim(stage_index) > 0:
+            stages = np.asarray(stage_index, dtype=int)
+            stages = np.where(stages < 0, stages + n_stages, stages)
+            first = int(stages.min()) if stages.size else 0
+            last = int(stages.max()) + 1 if stages.size else 0
+            relative = stages - first
+        data = np.moveaxis(self._read_records(first, last), 0, -1)
+        return self._decode(_orthogonal_index(data, index[:-1] + (relative,)))
+
+    def __setitem__(self, index: Any, value: Any) -> None:
+        index = _expand_index(index, len(self._dimensions))
+        self._dataset._before_write(self._name)
+        if not self._is_stage:
+            shape = self.shape
+            if not all(shape):
+                return
+            mapped = np.memmap(self._path, dtype=self._dtype, mode="r+", shape=shape)
+            mapped[index] = self._encode(value)
+            mapped.flush()
+            del mapped
+            return
+
+        stage_index = index[-1]
+        if isinstance(stage_index, slice):
+            if stage_index.step not in [None, 1]:
+                raise IndexError("Stages must be written in order")
+            first = stage_index.start or 0
+            if stage_index.stop is None:
+                last = first + np.shape(value)[-1]
+            else:
+                last = stage_index.stop
+            relative: Any = slice(None)
+        else:
+            first = int(stage_index)
+            last = first + 1
+            relative = 0
+
+        if all(_is_full_slice(i) for i in index[:-1]):
+            # appending whole stages doesn't need to read anything
+            encoded = self._encode(value)
+            if not isinstance(stage_index, slice):
+                encoded = encoded[..., np.newaxis]
+            shape = self._record_shape() + (last - first,)
+            data = np.broadcast_to(encoded, shape)
+        else:
+            data = np.moveaxis(self._read_records(first, last), 0, -1)
+            data[index[:-1] + (relative,)] = self._encode(value)
+        self._write_records(first, np.moveaxis(data, -1, 0))
+
+    def _create(self) -> None:
+        # stage variables start empty, others start out filled
+        if self._is_stage:
+            open(self._path, "wb").close()
+        else:
+            np.full(self.shape, self._fill_value, dtype=self._dtype).tofile(self._path)
+
+    def _record_shape(self) -> Tuple[int, ...]:
+        # the shape of a stage, without needing the number of stages
+        dimensions = self._dataset.dimensions
+        return tuple(len(dimensions[d]) for d in self._dimensions[:-1])
+
+    def _record_bytes(self) -> int:
+        return int(np.prod(self._record_shape(), dtype=int)) * self._dtype.itemsize
+
+    def _n_records(self) -> int:
+        record_bytes = self._record_bytes()
+        if not record_bytes:
+            return 0
+        return os.path.getsize(self._path) // record_bytes
+
+    def _read_all(self) -> np.ndarray:
+        return np.fromfile(self._path, dtype=self._dtype).reshape(self.shape)
+
+    def _read_records(self, first: int, last: int) -> np.ndarray:
+        record_shape = self._record_shape()
+        data = np.full((last - first,) + record_shape, self._fill_value, self._dtype)
+        available = min(last, self._n_records()) - first
+        if available > 0:
+            count = available * int(np.prod(record_shape, dtype=int))
+            data[:available] = np.fromfile(
+                self._path,
+                dtype=self._dtype,
+                count=count,
+                offset=first * self._record_bytes(),
+            ).reshape((available,) + record_shape)
+        return data
+
+    def _write_records(self, first: int, records: np.ndarray) -> None:
+        record_bytes = self._record_bytes()
+        if not record_bytes:
+            return
+        with open(self._path, "r+b") as data_file:
+            n_records = os.fstat(data_file.fileno()).st_size // record_bytes
+            if first > n_records:
+                # fill the gap, so that it reads back as masked
+                gap = np.full(
+                    (first - n_records,) + records.shape[1:],
+                    self._fill_value,
+                    self._dtype,
+                )
+                data_file.seek(n_records * record_bytes)
+                data_file.write(gap.tobytes())
+            data_file.seek(first * record_bytes)
+            data_file.write(np.ascontiguousarray(records).tobytes())
+
+    def _fsync(self) -> None:
+        with open(self._path, "r+b") as data_file:
+            os.fsync(data_file.fileno())
+
+    def _encode(self, value: Any) -> np.ndarray:
+        # scale, then replace masked values with the fill value
+        value = np.ma.asarray(value)
+        mask = np.ma.getmaskarray(value)
+        data = np.asarray(np.ma.getdata(value))
+        scale = self._attributes.get("scale_factor")
+        if scale is not None:
+            data = np.around(data / scale)
+        data = np.where(mask, 0, data).astype(self._dtype)
+        data[mask] = self._fill_value
+        return data
+
+    def _decode(self, data: np.ndarray) -> np.ma.MaskedArray:
+        mask = data == self._fill_value
+        scale = self._attributes.get("scale_factor")
+        if scale is not None:
+            data = data * np.float64(scale)
+        return np.ma.masked_array(data, mask=mask)
+
+
+def _expand_index(index: Any, ndim: int) -> Tuple[Any, ...]:
+    # a tuple with one entry per dimension, without an Ellipsis
+    if not isinstance(index, tuple):
+        index = (index,)
+    n_ellipsis = sum(1 for i in index if i is Ellipsis)
+    if n_ellipsis > 1:
+        raise IndexError("An index can only have a single Ellipsis")
+    if n_ellipsis:
+        position = next(n for n, i in enumerate(index) if i is Ellipsis)
+        fill = (slice(None),) * (ndim - len(index) + 1)
+        index = index[:position] + fill + index[position + 1 :]
+    if len(index) > ndim:
+        raise IndexError("Too many indices")
+    return index + (slice(None),) * (ndim - len(index))
+
+
+def _orthogonal_index(data: np.ndarray, index: Tuple[Any, ...]) -> np.ndarray:
+    # apply the index to each axis in turn, starting from the last so that
+    # integers removing an axis do not change the earlier axes
+    for axis in reversed(range(len(index))):
+        i = index[axis]
+        if isinstance(i, slice):
+            data = data[(slice(None),) * axis + (i,)]
+        else:
+            data = np.take(data, np.asarray(i), axis=axis)
+    return data
+
+
+def _is_full_slice(index: Any) -> bool:
+    return isinstance(index, slice) and index == slice(None)
+
+
+def _to_json(value: Any) -> Any:
+    # numpy scalars are not JSON serializable
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
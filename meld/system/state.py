@@ -4,6 +4,7 @@
 #
 
 import numpy as np  #type: ignore
+from typing import Optional
 
 
 class SystemState:
@@ -14,6 +15,8 @@ class SystemState:
     :param velocities: velocities for structure, same as coords
     :param alpha: alpha value, within ``[0, 1]``
     :param energy: total potential energy, including restraints
+    :param box_vector: box vectors, ``numpy.array(3)``, or None without
+        periodic boundary conditions
 
     """
 
@@ -23,7 +26,7 @@ class SystemState:
         velocities: np.ndarray,
         alpha: float,
         energy: float,
-        box_vector: np.ndarray,
+        box_vector: Optional[np.ndarray],
     ) -> None:
         self.positions = positions
         self.velocities = velocities
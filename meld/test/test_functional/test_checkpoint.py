@@ -0,0 +1,108 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+import os
+import pickle
+import unittest
+from unittest import mock  # type: ignore
+from meld import checkpoint
+from meld.test.helper import TempDirHelper
+
+
+class TestAtomicWrite(unittest.TestCase, TempDirHelper):
+    def setUp(self):
+        self.setUpTempDir()
+
+    def tearDown(self):
+        self.tearDownTempDir()
+
+    def test_replaces_contents(self):
+        "should replace the contents of the file"
+        checkpoint.atomic_write("test.dat", b"old")
+        checkpoint.atomic_write("test.dat", b"new")
+
+        with open("test.dat", "rb") as f:
+            self.assertEqual(f.read(), b"new")
+        self.assertEqual(os.listdir("."), ["test.dat"])
+
+    def test_does_not_modify_links(self):
+        "should not modify other links to the old file"
+        checkpoint.atomic_write("test.dat", b"old")
+        checkpoint.link_or_copy("test.dat", "backup.dat")
+
+        checkpoint.atomic_write("test.dat", b"new")
+
+        with open("backup.dat", "rb") as f:
+            self.assertEqual(f.read(), b"old")
+
+    def test_link_to_same_file(self):
+        "linking a file to itself should do nothing"
+        checkpoint.atomic_write("test.dat", b"old")
+        checkpoint.link_or_copy("test.dat", "backup.dat")
+
+        checkpoint.link_or_copy("test.dat", "backup.dat")
+
+        self.assertEqual(sorted(os.listdir(".")), ["backup.dat", "test.dat"])
+
+
+class TestCheckpointWriter(unittest.TestCase, TempDirHelper):
+    def setUp(self):
+        self.setUpTempDir()
+        self.writer = checkpoint.CheckpointWriter("Objects")
+
+    def tearDown(self):
+        self.tearDownTempDir()
+
+    def test_skips_unchanged_objects(self):
+        "should only write an object when it changes"
+        self.assertTrue(self.writer.write_object([1, 2], "test.dat"))
+        self.assertFalse(self.writer.write_object([1, 2], "test.dat"))
+        self.assertTrue(self.writer.write_object([1, 3], "test.dat"))
+
+        with open("test.dat", "rb") as f:
+            self.assertEqual(pickle.load(f), [1, 3])
+
+    def test_rewrites_missing_file(self):
+        "should write an unchanged object if the file was removed"
+        self.writer.write_object([1, 2], "test.dat")
+        os.remove("test.dat")
+
+        self.assertTrue(self.writer.write_object([1, 2], "test.dat"))
+
+    def test_objects_do_not_sync_directory(self):
+        "only immutable objects should sync the directory after the rename"
+        with mock.patch.object(checkpoint, "_fsync_directory") as fsync:
+            self.writer.write_object([1, 2], "test.dat")
+            fsync.assert_not_called()
+
+            self.writer.write_immutable({"a": 1}, "first.dat")
+            self.assertTrue(fsync.called)
+
+    def test_shared_objects_are_referenced(self):
+        "shared objects should be stored once and loaded with the object"
+        shared = {"atoms": list(range(1000))}
+        self.writer.write_object([shared, 1], "test.dat", shared=[shared])
+        self.writer.write_object([shared, 2], "test.dat", shared=[shared])
+
+        self.assertEqual(len(os.listdir("Objects")), 1)
+        self.assertLess(os.path.getsize("test.dat"), 200)
+        loaded = checkpoint.load_object("test.dat", "Objects")
+        self.assertEqual(loaded, [shared, 2])
+
+    def test_load_object_reads_plain_pickles(self):
+        "files written without shared objects should load the same way"
+        self.writer.write_object([1, 2], "test.dat")
+
+        self.assertEqual(checkpoint.load_object("test.dat", "Objects"), [1, 2])
+
+    def test_immutable_objects_are_stored_once(self):
+        "identical immutable objects should share one stored copy"
+        digest = self.writer.write_immutable({"a": 1}, "first.dat")
+        self.writer.write_immutable({"a": 1}, "second.dat")
+
+        self.assertEqual(os.listdir("Objects"), [f"{digest}.dat"])
+        self.assertTrue(os.path.samefile("first.dat", "second.dat"))
+        with open("second.dat", "rb") as f:
+            self.assertEqual(pickle.load(f), {"a": 1})
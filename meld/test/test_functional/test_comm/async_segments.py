@@ -0,0 +1,56 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+import numpy as np  # type: ignore
+from meld import comm
+from meld.system.state import SystemState
+
+N_ATOMS = 500
+N_REPLICAS = 4
+
+
+def generate_state(index):
+    coords = index * np.ones((N_ATOMS, 3))
+    vels = index * np.ones((N_ATOMS, 3))
+    alpha = float(index) / 10.
+    energy = float(index)
+    box_vectors = index * np.ones(3)
+
+    return SystemState(coords, vels, alpha, energy, box_vectors)
+
+
+def main():
+    c = comm.MPICommunicator(N_ATOMS, N_REPLICAS)
+    c.initialize()
+
+    if c.is_master():
+        # hand out one segment per replica to whichever worker is free
+        assert c.n_workers == 2
+        free_workers = list(range(1, c.n_workers + 1))
+        pending = list(range(N_REPLICAS))
+        finished = []
+        while len(finished) < N_REPLICAS:
+            while free_workers and pending:
+                index = pending.pop(0)
+                segment = comm.Segment(index, 0.1, generate_state(index), True, 1)
+                c.send_segment_to_worker(free_workers.pop(0), segment)
+            worker, index, state = c.receive_segment_state_from_worker()
+            assert state.positions[0, 0] == index + 1
+            finished.append(index)
+            free_workers.append(worker)
+        assert sorted(finished) == list(range(N_REPLICAS))
+        c.stop_workers()
+    else:
+        while True:
+            segment = c.receive_segment_from_master()
+            if segment is None:
+                break
+            state = segment.state
+            state.positions = state.positions + 1
+            c.send_segment_state_to_master(segment.index, state)
+
+
+if __name__ == "__main__":
+    main()
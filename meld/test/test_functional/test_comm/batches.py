@@ -0,0 +1,80 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+import numpy as np  # type: ignore
+from meld import comm
+from meld.system.state import SystemState
+
+N_ATOMS = 500
+N_REPLICAS = 8
+REPLICAS_PER_RANK = 4
+
+
+def generate_state(index):
+    coords = index * np.ones((N_ATOMS, 3))
+    vels = index * np.ones((N_ATOMS, 3))
+    alpha = float(index) / 10.
+    energy = float(index)
+    box_vectors = index * np.ones(3)
+
+    return SystemState(coords, vels, alpha, energy, box_vectors)
+
+
+def check_state(state, index):
+    assert state.positions.shape == (N_ATOMS, 3)
+    assert state.positions[0, 0] == index
+    assert state.velocities[0, 0] == index
+    assert state.box_vector[0] == index
+    assert state.alpha == index / 10.
+    assert state.energy == index
+
+
+def check_batches(transport):
+    c = comm.MPICommunicator(
+        N_ATOMS, N_REPLICAS, transport=transport, replicas_per_rank=REPLICAS_PER_RANK
+    )
+    c.initialize()
+    my_replicas = range(
+        c.rank * REPLICAS_PER_RANK, (c.rank + 1) * REPLICAS_PER_RANK
+    )
+
+    # scatter
+    if c.is_master():
+        alphas = c.broadcast_alpha_batches_to_slaves(
+            [index / 10. for index in range(N_REPLICAS)]
+        )
+        states = c.broadcast_state_batches_to_slaves(
+            [generate_state(index) for index in range(N_REPLICAS)]
+        )
+    else:
+        alphas = c.receive_alpha_batch_from_master()
+        states = c.receive_state_batch_from_master()
+    assert alphas == [index / 10. for index in my_replicas]
+    for state, index in zip(states, my_replicas):
+        check_state(state, index)
+
+    # allgather
+    all_states = c.exchange_state_batches_for_energy_calc(states)
+    assert len(all_states) == N_REPLICAS
+    for index in range(N_REPLICAS):
+        check_state(all_states[index], index)
+
+    # gather
+    energies = [[10 * index + j for j in range(N_REPLICAS)] for index in my_replicas]
+    if c.is_master():
+        energy_matrix = c.gather_energy_batches_from_slaves(energies)
+        expected = np.add.outer(10 * np.arange(N_REPLICAS), np.arange(N_REPLICAS))
+        np.testing.assert_equal(energy_matrix, expected)
+    else:
+        c.send_energy_batches_to_master(energies)
+
+
+def main():
+    check_batches("pickle")
+    check_batches("buffer")
+
+
+if __name__ == "__main__":
+    main()
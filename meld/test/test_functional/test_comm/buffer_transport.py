@@ -0,0 +1,76 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+import numpy as np  # type: ignore
+from meld import comm
+from meld.system.state import SystemState
+
+N_ATOMS = 5000
+N_REPLICAS = 4
+
+
+def generate_state(index):
+    # distinct values for every atom and coordinate, so that a packing
+    # error anywhere in the record is caught
+    coords = index + np.arange(3 * N_ATOMS).reshape(N_ATOMS, 3) / N_ATOMS
+    vels = -coords
+    alpha = float(index) / 10.
+    energy = float(index)
+    # the odd replicas have no box vector
+    box_vectors = index + np.array([1., 2., 3.]) if index % 2 == 0 else None
+
+    return SystemState(coords, vels, alpha, energy, box_vectors)
+
+
+def check_state(state, index):
+    expected = generate_state(index)
+    assert state.positions.shape == (N_ATOMS, 3)
+    np.testing.assert_equal(state.positions, expected.positions)
+    np.testing.assert_equal(state.velocities, expected.velocities)
+    if expected.box_vector is None:
+        assert state.box_vector is None
+    else:
+        np.testing.assert_equal(state.box_vector, expected.box_vector)
+    assert state.alpha == index / 10.
+    assert state.energy == index
+
+
+def main():
+    c = comm.MPICommunicator(N_ATOMS, N_REPLICAS, transport="buffer")
+    c.initialize()
+
+    # scatter
+    if c.is_master():
+        states = [generate_state(index) for index in range(N_REPLICAS)]
+        my_state = c.broadcast_states_to_slaves(states)
+    else:
+        my_state = c.receive_state_from_master()
+    check_state(my_state, c.rank)
+
+    # allgather
+    all_states = c.exchange_states_for_energy_calc(generate_state(c.rank))
+    for index in range(N_REPLICAS):
+        check_state(all_states[index], index)
+
+    # gather
+    if c.is_master():
+        all_states = c.gather_states_from_slaves(generate_state(c.rank))
+        for index in range(N_REPLICAS):
+            check_state(all_states[index], index)
+    else:
+        c.send_state_to_master(generate_state(c.rank))
+
+    # broadcast
+    if c.is_master():
+        states = [generate_state(index) for index in range(N_REPLICAS)]
+        c.broadcast_states_for_energy_calc_to_slaves(states)
+    else:
+        all_states = c.receive_states_for_energy_calc_from_master()
+        for index in range(N_REPLICAS):
+            check_state(all_states[index], index)
+
+
+if __name__ == "__main__":
+    main()
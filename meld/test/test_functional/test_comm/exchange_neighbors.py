@@ -0,0 +1,72 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+import numpy as np  # type: ignore
+from meld import comm
+from meld.system.state import SystemState
+
+N_ATOMS = 5000
+N_REPLICAS = 4
+
+
+def generate_state(index):
+    coords = index * np.ones((N_ATOMS, 3))
+    vels = index * np.ones((N_ATOMS, 3))
+    alpha = float(index) / 10.
+    energy = float(index)
+    box_vectors = np.zeros(3)
+
+    return SystemState(coords, vels, alpha, energy, box_vectors)
+
+
+def check_state(state, index):
+    assert state.positions[0, 0] == index
+    assert state.velocities[0, 0] == index
+    assert state.alpha == index / 10.
+    assert state.energy == index
+
+
+def check_neighbors(c):
+    left, right = c.exchange_states_with_neighbors(generate_state(c.rank))
+    if c.rank == 0:
+        assert left is None
+    else:
+        check_state(left, c.rank - 1)
+    if c.rank == N_REPLICAS - 1:
+        assert right is None
+    else:
+        check_state(right, c.rank + 1)
+
+
+def check_energies(c):
+    energies = [c.rank - 0.5, float(c.rank), c.rank + 0.5]
+    if c.rank == 0:
+        energies[0] = np.nan
+    if c.rank == N_REPLICAS - 1:
+        energies[2] = np.nan
+
+    if c.is_master():
+        matrix = c.gather_neighbor_energies_from_slaves(energies)
+        assert matrix.shape == (N_REPLICAS, N_REPLICAS)
+        for i in range(N_REPLICAS):
+            for j in range(N_REPLICAS):
+                if abs(i - j) > 1:
+                    assert np.isnan(matrix[i, j])
+                else:
+                    assert matrix[i, j] == i + 0.5 * (j - i)
+    else:
+        c.send_neighbor_energies_to_master(energies)
+
+
+def main():
+    for transport in ["pickle", "buffer"]:
+        c = comm.MPICommunicator(N_ATOMS, N_REPLICAS, transport=transport)
+        c.initialize()
+        check_neighbors(c)
+        check_energies(c)
+
+
+if __name__ == "__main__":
+    main()
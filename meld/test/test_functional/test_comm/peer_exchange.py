@@ -0,0 +1,68 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+import numpy as np  # type: ignore
+from meld import comm
+from meld.remd.ladder import peer_exchange_partner
+from meld.system.state import SystemState
+
+N_ATOMS = 500
+N_REPLICAS = 4
+
+
+def generate_state(index):
+    coords = index * np.ones((N_ATOMS, 3))
+    vels = index * np.ones((N_ATOMS, 3))
+    alpha = float(index) / 10.
+    energy = float(index)
+    box_vectors = index * np.ones(3)
+
+    return SystemState(coords, vels, alpha, energy, box_vectors)
+
+
+def check_state(state, index):
+    assert state.positions.shape == (N_ATOMS, 3)
+    assert state.positions[0, 0] == index
+    assert state.velocities[0, 0] == index
+    assert state.box_vector[0] == index
+    assert state.alpha == index / 10.
+    assert state.energy == index
+
+
+def main():
+    for transport in ["pickle", "buffer"]:
+        c = comm.MPICommunicator(N_ATOMS, N_REPLICAS, transport=transport)
+        c.initialize()
+
+        for step in [1, 2]:
+            partner = peer_exchange_partner(c.rank, step, N_REPLICAS)
+
+            # swap states with our partner
+            state = c.exchange_state_with_partner(generate_state(c.rank), partner)
+            if partner is None:
+                assert state is None
+            else:
+                check_state(state, partner)
+
+            # swap energies with our partner
+            energies = c.exchange_energies_with_partner([c.rank, 10 * c.rank], partner)
+            if partner is None:
+                assert energies is None
+            else:
+                assert energies == [partner, 10 * partner]
+
+            # gather the records
+            record = [c.rank, step, -1.0, -1.0]
+            if c.is_master():
+                records = c.gather_exchange_records_from_slaves(record)
+                assert records.shape == (N_REPLICAS, 4)
+                np.testing.assert_equal(records[:, 0], np.arange(N_REPLICAS))
+                np.testing.assert_equal(records[:, 1], step)
+            else:
+                c.send_exchange_record_to_master(record)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+import numpy as np  # type: ignore
+from meld import comm
+from meld.system.state import SystemState
+
+N_ATOMS = 5000
+N_REPLICAS = 4
+
+
+def generate_state(index):
+    coords = index * np.ones((N_ATOMS, 3))
+    vels = index * np.ones((N_ATOMS, 3))
+    alpha = float(index) / 10.
+    energy = float(index)
+    box_vectors = index * np.ones(3)
+
+    return SystemState(coords, vels, alpha, energy, box_vectors)
+
+
+def check_state(state, index):
+    assert state.positions.shape == (N_ATOMS, 3)
+    assert state.positions[0, 0] == index
+    assert state.velocities[0, 0] == index
+    assert state.box_vector[0] == index
+    assert state.alpha == index / 10.
+    assert state.energy == index
+
+
+def main():
+    c = comm.MPICommunicator(N_ATOMS, N_REPLICAS, transport="buffer", pipeline=True)
+    c.initialize()
+
+    for step in range(3):
+        # exchange states, our own state comes first
+        received = list(c.iter_states_for_energy_calc(generate_state(c.rank)))
+        assert received[0][0] == c.rank
+        assert sorted(rank for rank, _ in received) == list(range(N_REPLICAS))
+        for rank, state in received:
+            check_state(state, rank)
+
+        # gather energies
+        energies = [10 * c.rank + rank + step for rank in range(N_REPLICAS)]
+        if c.is_master():
+            energy_matrix = c.gather_energies_from_slaves(energies)
+            expected = np.add.outer(10 * np.arange(N_REPLICAS), np.arange(N_REPLICAS))
+            np.testing.assert_equal(energy_matrix, expected + step)
+        else:
+            c.send_energies_to_master(energies)
+
+    if not c.is_master():
+        c.wait_for_sends()
+
+
+if __name__ == "__main__":
+    main()
@@ -39,3 +39,33 @@ class CommTestCase(unittest.TestCase):
         directory = self.get_directory()
         path = os.path.join(directory, 'meld/test/test_functional/test_comm/gather_states.py')
         subprocess.check_call(f"PYTHONPATH={directory} mpirun -np 4 python {path}", shell=True)
+
+    def test_buffer_transport(self):
+        directory = self.get_directory()
+        path = os.path.join(directory, 'meld/test/test_functional/test_comm/buffer_transport.py')
+        subprocess.check_call(f"PYTHONPATH={directory} mpirun -np 4 python {path}", shell=True)
+
+    def test_exchange_neighbors(self):
+        directory = self.get_directory()
+        path = os.path.join(directory, 'meld/test/test_functional/test_comm/exchange_neighbors.py')
+        subprocess.check_call(f"PYTHONPATH={directory} mpirun -np 4 python {path}", shell=True)
+
+    def test_batches(self):
+        directory = self.get_directory()
+        path = os.path.join(directory, 'meld/test/test_functional/test_comm/batches.py')
+        subprocess.check_call(f"PYTHONPATH={directory} mpirun -np 2 python {path}", shell=True)
+
+    def test_pipeline(self):
+        directory = self.get_directory()
+        path = os.path.join(directory, 'meld/test/test_functional/test_comm/pipeline.py')
+        subprocess.check_call(f"PYTHONPATH={directory} mpirun -np 4 python {path}", shell=True)
+
+    def test_peer_exchange(self):
+        directory = self.get_directory()
+        path = os.path.join(directory, 'meld/test/test_functional/test_comm/peer_exchange.py')
+        subprocess.check_call(f"PYTHONPATH={directory} mpirun -np 4 python {path}", shell=True)
+
+    def test_async_segments(self):
+        directory = self.get_directory()
+        path = os.path.join(directory, 'meld/test/test_functional/test_comm/async_segments.py')
+        subprocess.check_call(f"PYTHONPATH={directory} mpirun -np 3 python {path}", shell=True)
@@ -3,11 +3,12 @@
 # All rights reserved
 #
 
+import logging
 import unittest
 import os
 import subprocess
 import numpy as np  # type: ignore
-from meld.remd import ladder, adaptor, master_runner
+from meld.remd import ladder, adaptor, master_runner, async_runner, launch
 from meld.system import state, RunOptions, ConstantTemperatureScaler
 from meld import comm, vault, pdb_writer
 from meld.test import helper
@@ -28,21 +29,42 @@ def gen_state(index):
     return state.SystemState(pos, vel, alpha, energy, box_vectors)
 
 
-def setup_system():
+def setup_system(peer_exchange=False, asynchronous=False, state_interval=1):
     # create a store
     writer = pdb_writer.PDBWriter(
         range(N_ATOMS), ["CA"] * N_ATOMS, [1] * N_ATOMS, ["ALA"] * N_ATOMS
     )
-    store = vault.DataStore(N_ATOMS, N_REPLICAS, writer, block_size=BACKUP_FREQ)
+    storage_policy = None
+    if state_interval > 1:
+        storage_policy = vault.StoragePolicy(
+            position_interval=state_interval, velocity_interval=None
+        )
+    store = vault.DataStore(
+        N_ATOMS,
+        N_REPLICAS,
+        writer,
+        block_size=BACKUP_FREQ,
+        storage_policy=storage_policy,
+    )
     store.initialize(mode="w")
 
     # create and store the remd_runner
     l = ladder.NearestNeighborLadder(n_trials=100)
     policy = adaptor.AdaptationPolicy(1.0, 50, 100)
     a = adaptor.EqualAcceptanceAdaptor(n_replicas=N_REPLICAS, adaptation_policy=policy)
-    remd_runner = master_runner.MasterReplicaExchangeRunner(
-        N_REPLICAS, max_steps=N_STEPS, ladder=l, adaptor=a
-    )
+    if asynchronous:
+        remd_runner = async_runner.AsyncReplicaExchangeRunner(
+            N_REPLICAS, max_steps=N_STEPS, ladder=l, adaptor=a
+        )
+    else:
+        remd_runner = master_runner.MasterReplicaExchangeRunner(
+            N_REPLICAS,
+            max_steps=N_STEPS,
+            ladder=l,
+            adaptor=a,
+            peer_exchange=peer_exchange,
+            state_interval=state_interval,
+        )
     store.save_remd_runner(remd_runner)
 
     # create and store the communicator
@@ -90,3 +112,122 @@ class FakeRemdTestCase(unittest.TestCase, helper.TempDirHelper):
         self.assertEqual(pos.shape[0], N_REPLICAS)
         self.assertEqual(pos.shape[1], N_ATOMS)
         self.assertEqual(pos.shape[2], 3)
+
+
+class AsyncFakeRemdTestCase(unittest.TestCase, helper.TempDirHelper):
+    def setUp(self):
+        self.setUpTempDir()
+        setup_system(asynchronous=True)
+        # two workers for four replicas
+        subprocess.check_call("mpirun -np 3 launch_remd", shell=True)
+
+    def tearDown(self):
+        self.tearDownTempDir()
+
+    def test_should_record_schedule(self):
+        s = vault.DataStore.load_data_store()
+        s.initialize(mode="r")
+
+        # each step is one segment per replica on average
+        stages = s.load_replica_stages(N_STEPS - 1)
+        self.assertEqual(sum(stages), N_REPLICAS * (N_STEPS - 1))
+        exchanges = s.load_exchange_counts(N_STEPS - 1)
+        self.assertEqual(len(exchanges.attempts), N_REPLICAS - 1)
+
+
+class SharedMemoryFakeRemdTestCase(unittest.TestCase, helper.TempDirHelper):
+    def setUp(self):
+        self.setUpTempDir()
+        setup_system()
+        launch.launch(logging.NullHandler(), console_log=True, shared_memory=True)
+
+    def tearDown(self):
+        self.tearDownTempDir()
+
+    def test_should_have_correct_number_of_steps(self):
+        s = vault.DataStore.load_data_store()
+        s.initialize(mode="a")
+        pos = s.load_positions(N_STEPS)
+
+        self.assertEqual(pos.shape[0], N_REPLICAS)
+        self.assertEqual(pos.shape[1], N_ATOMS)
+        self.assertEqual(pos.shape[2], 3)
+
+    def test_should_keep_states_apart(self):
+        s = vault.DataStore.load_data_store()
+        s.initialize(mode="a")
+        pos = s.load_positions(N_STEPS)
+
+        # the fake runner doesn't change the states, so each replica
+        # still has one of the initial states
+        self.assertEqual(
+            sorted(pos[:, 0, 0]), [float(i) for i in range(N_REPLICAS)]
+        )
+
+
+class PeerExchangeFakeRemdTestCase(unittest.TestCase, helper.TempDirHelper):
+    def setUp(self):
+        self.setUpTempDir()
+        setup_system(peer_exchange=True)
+        launch.launch(logging.NullHandler(), console_log=True, shared_memory=True)
+
+    def tearDown(self):
+        self.tearDownTempDir()
+
+    def test_states_should_follow_permutation_vectors(self):
+        s = vault.DataStore.load_data_store()
+        s.initialize(mode="r")
+
+        # the ranks swap the states themselves, which must agree with
+        # the permutation vectors recorded by the master. The last stage
+        # is in a block that is not yet safe to read.
+        n_swaps = 0
+        for stage in range(1, N_STEPS):
+            before = s.load_positions(stage - 1)[:, 0, 0]
+            after = s.load_positions(stage)[:, 0, 0]
+            perm = s.load_permutation_vector(stage)
+            np.testing.assert_equal(after, before[perm])
+            n_swaps += np.sum(perm != np.arange(N_REPLICAS))
+        self.assertGreater(n_swaps, 0)
+        self.assertEqual(sorted(after), [float(i) for i in range(N_REPLICAS)])
+
+
+class PeerExchangeStateIntervalFakeRemdTestCase(
+    unittest.TestCase, helper.TempDirHelper
+):
+    def setUp(self):
+        self.setUpTempDir()
+        setup_system(peer_exchange=True, state_interval=2)
+        launch.launch(logging.NullHandler(), console_log=True, shared_memory=True)
+
+    def tearDown(self):
+        self.tearDownTempDir()
+
+    def test_states_should_follow_permutation_vectors(self):
+        s = vault.DataStore.load_data_store()
+        s.initialize(mode="r")
+
+        # every replica is only stored on the even stages, but replica 0
+        # is stored at every stage
+        for stage in range(2, N_STEPS, 2):
+            before = s.load_positions(stage - 2)[:, 0, 0]
+            middle = s.load_positions(stage - 1)[:, 0, 0]
+            after = s.load_positions(stage)[:, 0, 0]
+            perm = s.load_permutation_vector(stage - 1)
+            perm = perm[s.load_permutation_vector(stage)]
+            np.testing.assert_equal(after, before[perm])
+            first = s.load_permutation_vector(stage - 1)[0]
+            self.assertEqual(middle[0], before[first])
+            self.assertTrue(np.ma.getmaskarray(middle)[1:].all())
+
+    def test_should_restart_from_last_stage(self):
+        s = vault.DataStore.load_data_store()
+        runner = s.load_remd_runner()
+        s.initialize(mode="a")
+
+        self.assertEqual(runner.step, N_STEPS + 1)
+        states = s.load_states(N_STEPS)
+        self.assertEqual(
+            sorted(state.positions[0, 0] for state in states),
+            [float(i) for i in range(N_REPLICAS)],
+        )
@@ -0,0 +1,155 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+import math
+import pickle
+import unittest
+import numpy as np  # type: ignore
+from meld import comm
+from meld.system.state import SystemState
+
+N_ATOMS = 50
+N_REPLICAS = 4
+
+
+def generate_state(index):
+    coords = index * np.ones((N_ATOMS, 3))
+    vels = index * np.ones((N_ATOMS, 3))
+    alpha = float(index) / 10.
+    energy = float(index)
+    box_vectors = index * np.ones(3)
+
+    return SystemState(coords, vels, alpha, energy, box_vectors)
+
+
+def check_state(state, index):
+    assert state.positions.shape == (N_ATOMS, 3)
+    assert state.positions[0, 0] == index
+    assert state.velocities[0, 0] == index
+    assert state.box_vector[0] == index
+    assert state.alpha == index / 10.
+    assert state.energy == index
+
+
+def run_slave(c):
+    assert not c.is_master()
+
+    alpha = c.receive_alpha_from_master()
+    assert alpha == c.rank / 10.
+
+    my_state = c.receive_state_from_master()
+    check_state(my_state, c.rank)
+
+    c.send_state_to_master(my_state)
+
+    states = c.exchange_states_for_energy_calc(my_state)
+    for index in range(N_REPLICAS):
+        check_state(states[index], index)
+    c.send_energies_to_master([10 * c.rank + s.energy for s in states])
+
+    states = c.receive_states_for_energy_calc_from_master()
+    for index in range(N_REPLICAS):
+        check_state(states[index], N_REPLICAS - 1 - index)
+
+    left, right = c.exchange_states_with_neighbors(my_state)
+    check_state(left, c.rank - 1)
+    if c.rank == N_REPLICAS - 1:
+        assert right is None
+    else:
+        check_state(right, c.rank + 1)
+    c.send_neighbor_energies_to_master([c.rank, c.rank, c.rank])
+
+    assert c.receive_logger_address_from_master() == ("localhost", 1234)
+    c.barrier()
+
+
+def gather_slave(c):
+    c.receive_alpha_from_master()
+    c.send_state_to_master(c.receive_state_from_master())
+
+
+def fail_slave(c):
+    if c.rank == 1:
+        raise RuntimeError("failed on purpose")
+    c.barrier()
+
+
+class SharedMemoryCommunicatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.c = comm.SharedMemoryCommunicator(N_ATOMS, N_REPLICAS, timeout=60)
+        self.c.initialize()
+
+    def tearDown(self):
+        self.c.abort()
+
+    def test_communication_with_slaves(self):
+        "should communicate with the slaves through shared memory"
+        self.c.start_workers(run_slave)
+        self.assertTrue(self.c.is_master())
+
+        self.c.broadcast_alphas_to_slaves([i / 10. for i in range(N_REPLICAS)])
+
+        my_state = self.c.broadcast_states_to_slaves(
+            [generate_state(i) for i in range(N_REPLICAS)]
+        )
+        check_state(my_state, 0)
+
+        states = self.c.gather_states_from_slaves(my_state)
+        for index in range(N_REPLICAS):
+            check_state(states[index], index)
+
+        states = self.c.exchange_states_for_energy_calc(my_state)
+        energies = self.c.gather_energies_from_slaves([s.energy for s in states])
+        expected = np.add.outer(10 * np.arange(N_REPLICAS), np.arange(N_REPLICAS))
+        np.testing.assert_equal(energies, expected)
+
+        self.c.broadcast_states_for_energy_calc_to_slaves(
+            [generate_state(i) for i in reversed(range(N_REPLICAS))]
+        )
+
+        left, right = self.c.exchange_states_with_neighbors(my_state)
+        self.assertIsNone(left)
+        check_state(right, 1)
+        energies = self.c.gather_neighbor_energies_from_slaves([math.nan, 0, 0])
+        self.assertEqual(energies[2, 2], 2)
+        self.assertEqual(energies[2, 3], 2)
+        self.assertTrue(np.isnan(energies[0, 2]))
+
+        self.c.broadcast_logger_address_to_slaves(("localhost", 1234))
+        self.c.barrier()
+        self.c.close()
+
+    def test_gathered_states_are_views(self):
+        "should gather states on the master without copying them"
+        self.c.start_workers(gather_slave)
+        self.c.broadcast_alphas_to_slaves([i / 10. for i in range(N_REPLICAS)])
+        my_state = self.c.broadcast_states_to_slaves(
+            [generate_state(i) for i in range(N_REPLICAS)]
+        )
+
+        states = self.c.gather_states_from_slaves(my_state)
+
+        for index in range(N_REPLICAS):
+            check_state(states[index], index)
+            self.assertFalse(states[index].positions.flags.owndata)
+        self.assertTrue(my_state.positions.flags.owndata)
+        self.c.close()
+
+    def test_failed_worker_breaks_barrier(self):
+        "should raise on the master when a worker fails"
+        self.c.start_workers(fail_slave)
+
+        with self.assertRaises(RuntimeError):
+            self.c.barrier()
+        with self.assertRaises(RuntimeError):
+            self.c.close()
+
+    def test_can_be_pickled(self):
+        "should pickle without the shared memory"
+        c = pickle.loads(pickle.dumps(self.c))
+
+        self.assertEqual(c.n_atoms, N_ATOMS)
+        self.assertEqual(c.n_replicas, N_REPLICAS)
+        self.assertFalse(hasattr(c, "_positions"))
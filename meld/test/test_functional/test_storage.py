@@ -0,0 +1,112 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+import json
+import os
+import unittest
+import numpy as np  #type: ignore
+from meld import storage
+from meld.test.helper import TempDirHelper
+
+
+class RawDatasetTestCase(unittest.TestCase, TempDirHelper):
+    def setUp(self):
+        self.setUpTempDir()
+        self.dataset = storage.RawDataset("block.raw", "w")
+        self.dataset.createDimension("n_replicas", 3)
+        self.dataset.createDimension("cartesian", 2)
+        self.dataset.createDimension("timesteps", None)
+        self.positions = self.dataset.createVariable(
+            "positions", "f4", ["n_replicas", "cartesian", "timesteps"]
+        )
+        self.slots = self.dataset.createVariable("slots", int, ["n_replicas"])
+
+    def tearDown(self):
+        self.dataset.close()
+        self.tearDownTempDir()
+
+    def test_appends_stages(self):
+        "should read back stages written one at a time"
+        for stage in range(3):
+            self.positions[..., stage] = stage * np.ones((3, 2))
+
+        data = self.positions[...]
+        self.assertEqual(data.shape, (3, 2, 3))
+        np.testing.assert_equal(data[0, 0], [0, 1, 2])
+        self.assertEqual(len(self.dataset.dimensions["timesteps"]), 3)
+
+    def test_indexes_each_axis_independently(self):
+        "lists of indices should select along each axis, as in netcdf"
+        values = np.arange(3 * 2 * 4).reshape((3, 2, 4))
+        self.positions[..., 0:4] = values
+
+        data = self.positions[[0, 2], [1], 1:3]
+
+        np.testing.assert_equal(data, values[[0, 2]][:, [1]][..., 1:3])
+
+    def test_unwritten_stages_are_masked(self):
+        "stages that were skipped and masked values should be masked"
+        value = np.ma.masked_all((3, 2))
+        value[1] = 1.0
+        self.positions[..., 2] = value
+
+        data = self.positions[..., :]
+
+        self.assertTrue(data.mask[..., :2].all())
+        np.testing.assert_equal(data.mask[..., 2], value.mask)
+
+    def test_scale_factor(self):
+        "values should be rounded to the scale factor"
+        fixed = self.dataset.createVariable(
+            "fixed", "i4", ["n_replicas", "cartesian", "timesteps"]
+        )
+        fixed.scale_factor = 0.5
+
+        fixed[..., 0] = 1.3 * np.ones((3, 2))
+
+        np.testing.assert_almost_equal(fixed[..., 0], 1.5)
+
+    def test_reopen(self):
+        "data and attributes should be readable after closing"
+        self.dataset.committed_stage = 0
+        self.positions[..., 0] = np.ones((3, 2))
+        self.slots[1] = 7
+        self.dataset.close()
+
+        with storage.RawDataset("block.raw", "r") as dataset:
+            self.assertEqual(dataset.committed_stage, 0)
+            np.testing.assert_equal(dataset.variables["positions"][..., 0], 1.0)
+            self.assertEqual(dataset.variables["slots"][1], 7)
+            self.assertTrue(dataset.variables["slots"][:].mask[0])
+
+    def test_attributes_are_written_on_sync(self):
+        "changed attributes should only be visible after sync"
+        self.positions[..., 0] = np.ones((3, 2))
+        self.dataset.committed_stage = 0
+
+        with open(os.path.join("block.raw", "manifest.json")) as manifest_file:
+            self.assertNotIn("committed_stage", json.load(manifest_file)["attributes"])
+        self.dataset.sync()
+        with open(os.path.join("block.raw", "manifest.json")) as manifest_file:
+            self.assertEqual(json.load(manifest_file)["attributes"]["committed_stage"], 0)
+
+    def test_read_only(self):
+        "should not write to a dataset opened read-only"
+        self.dataset.close()
+
+        with storage.RawDataset("block.raw", "r") as dataset:
+            with self.assertRaises(RuntimeError):
+                dataset.variables["positions"][..., 0] = np.ones((3, 2))
+
+
+class BackendForPathTestCase(unittest.TestCase):
+    def test_detects_backend(self):
+        "should choose the backend from the extension"
+        self.assertEqual(storage.backend_for_path("block_000000.nc").name, "netcdf")
+        self.assertEqual(storage.backend_for_path("block_000000.raw").name, "raw")
+
+    def test_raises_on_unknown_extension(self):
+        with self.assertRaises(ValueError):
+            storage.backend_for_path("block_000000.h5")
@@ -0,0 +1,118 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+import os
+import pickle
+import unittest
+import numpy as np  # type: ignore
+from meld import trajectory, vault
+from meld.system import state
+from meld.test.helper import TempDirHelper
+
+
+class TestDCDTrajectoryWriter(unittest.TestCase, TempDirHelper):
+    def setUp(self):
+        self.setUpTempDir()
+        self.N_ATOMS = 10
+        self.positions = np.random.random((6, self.N_ATOMS, 3))
+
+    def tearDown(self):
+        self.tearDownTempDir()
+
+    def test_round_trip(self):
+        "should read back the frames that were written"
+        writer = trajectory.DCDTrajectoryWriter("traj.dcd")
+        for stage in range(6):
+            writer.write(self.positions[stage], stage)
+        writer.close()
+
+        result = trajectory.read_dcd("traj.dcd")
+
+        np.testing.assert_allclose(result, self.positions, rtol=1e-6)
+
+    def test_atoms_and_stride(self):
+        "should only write the selected atoms every stride stages"
+        writer = trajectory.DCDTrajectoryWriter("traj.dcd", atoms=[1, 3], stride=2)
+        for stage in range(6):
+            writer.write(self.positions[stage], stage)
+        writer.close()
+
+        result = trajectory.read_dcd("traj.dcd")
+
+        np.testing.assert_allclose(
+            result, self.positions[::2][:, [1, 3], :], rtol=1e-6
+        )
+
+    def test_readable_while_open(self):
+        "the header should be up to date after each frame"
+        writer = trajectory.DCDTrajectoryWriter("traj.dcd")
+        writer.write(self.positions[0], 0)
+        writer.write(self.positions[1], 1)
+
+        result = trajectory.read_dcd("traj.dcd")
+        writer.close()
+
+        self.assertEqual(result.shape, (2, self.N_ATOMS, 3))
+
+    def test_appends_after_unpickling(self):
+        "should append to the existing file after a restart"
+        writer = trajectory.DCDTrajectoryWriter("traj.dcd")
+        writer.write(self.positions[0], 0)
+        writer = pickle.loads(pickle.dumps(writer))
+        writer.write(self.positions[1], 1)
+        writer.close()
+
+        result = trajectory.read_dcd("traj.dcd")
+
+        np.testing.assert_allclose(result, self.positions[:2], rtol=1e-6)
+
+    def test_drops_partial_frame(self):
+        "should discard a partially written frame when re-opening"
+        writer = trajectory.DCDTrajectoryWriter("traj.dcd")
+        writer.write(self.positions[0], 0)
+        writer.close()
+        with open("traj.dcd", "ab") as dcd_file:
+            dcd_file.write(b"partial frame")
+
+        writer.write(self.positions[1], 1)
+        writer.close()
+
+        result = trajectory.read_dcd("traj.dcd")
+
+        np.testing.assert_allclose(result, self.positions[:2], rtol=1e-6)
+
+    def test_rejects_wrong_number_of_atoms(self):
+        "should raise if the number of atoms changes"
+        writer = trajectory.DCDTrajectoryWriter("traj.dcd")
+        writer.write(self.positions[0], 0)
+
+        with self.assertRaises(ValueError):
+            writer.write(self.positions[1, :5, :], 1)
+        writer.close()
+
+
+class TestDataStoreTrajectoryWriter(unittest.TestCase, TempDirHelper):
+    def setUp(self):
+        self.setUpTempDir()
+
+    def tearDown(self):
+        self.tearDownTempDir()
+
+    def test_append_traj_uses_writer(self):
+        "append_traj should write to the trajectory writer"
+        writer = trajectory.DCDTrajectoryWriter()
+        store = vault.DataStore(5, 2, object(), trajectory_writer=writer)
+        store.initialize(mode="w")
+        positions = np.ones((5, 3))
+        s = state.SystemState(positions, positions, 0.0, 0.0, np.zeros(3))
+
+        store.append_traj(s, 1)
+        store.close()
+
+        self.assertTrue(os.path.exists("Data/trajectory.dcd"))
+        self.assertFalse(os.path.exists("Data/trajectory.pdb"))
+        np.testing.assert_allclose(
+            trajectory.read_dcd("Data/trajectory.dcd"), [positions]
+        )
@@ -6,8 +6,12 @@
 #
 
 import numpy as np  #type: ignore
+import netCDF4  #type: ignore
 import unittest
+from unittest import mock  #type: ignore
 import os
+import pickle
+import json
 from meld import vault, comm
 from meld.remd import master_runner, ladder, adaptor
 from meld import system
@@ -76,6 +80,25 @@ class DataStorePickleTestCase(unittest.TestCase):
 
             self.assertEqual(store.n_atoms, store2.n_atoms)
             self.assertEqual(store.n_replicas, store2.n_replicas)
+
+    def test_statistics_are_saved_with_data_store(self):
+        "the running statistics should be reloaded with the DataStore"
+        with in_temp_dir():
+            # dummy pdb writer; can't use a mock because they can't be pickled
+            pdb_writer = object()
+            store = vault.DataStore(self.N_ATOMS, self.N_REPLICAS, pdb_writer)
+            store.initialize(mode="w")
+            exchanges = ladder.ExchangeCounts(np.ones(3, int), np.zeros(3, int))
+
+            store.update_statistics(
+                1, np.eye(self.N_REPLICAS), [0, 1, 2, 3], [0, 0.5, 0.75, 1], exchanges
+            )
+            store.save_data_store()
+            store2 = vault.DataStore.load_data_store()
+
+            self.assertEqual(store2.statistics.n_stages, 1)
+            np.testing.assert_equal(store2.statistics.energy_mean, 1.0)
+            np.testing.assert_equal(store2.statistics.attempts, 1)
             self.assertIsNone(store2._cdf_data_set)
             self.assertTrue(os.path.exists("Data/data_store.dat"))
 
@@ -311,6 +334,777 @@ class DataStoreHD5TestCase(unittest.TestCase, TempDirHelper):
 
         np.testing.assert_equal(test_vec, test_vec2)
 
+    def test_can_save_and_load_replica_ranks(self):
+        "should be able to save and load replica ranks"
+        test_ranks = np.array(list(reversed(range(self.N_REPLICAS))))
+        STAGE = 0
+
+        self.store.save_replica_ranks(test_ranks, STAGE)
+        self.store.save_data_store()
+        self.store.close()
+        store2 = vault.DataStore.load_data_store()
+        store2.initialize(mode="a")
+        test_ranks2 = store2.load_replica_ranks(STAGE)
+
+        np.testing.assert_equal(test_ranks, test_ranks2)
+
+    def test_can_save_and_load_replica_stages(self):
+        "should be able to save and load the segments run at each index"
+        test_stages = np.arange(self.N_REPLICAS) + 3
+        STAGE = 0
+
+        self.store.save_replica_stages(test_stages, STAGE)
+        self.store.save_data_store()
+        self.store.close()
+        store2 = vault.DataStore.load_data_store()
+        store2.initialize(mode="a")
+        test_stages2 = store2.load_replica_stages(STAGE)
+
+        np.testing.assert_equal(test_stages, test_stages2)
+
+    def test_can_save_and_load_exchange_counts(self):
+        "should be able to save and load the exchanges of a stage"
+        attempts = np.arange(self.N_REPLICAS - 1) + 2
+        successes = np.arange(self.N_REPLICAS - 1)
+        STAGE = 0
+
+        self.store.save_exchange_counts(
+            ladder.ExchangeCounts(attempts, successes), STAGE
+        )
+        self.store.save_data_store()
+        self.store.close()
+        store2 = vault.DataStore.load_data_store()
+        store2.initialize(mode="a")
+        exchanges = store2.load_exchange_counts(STAGE)
+
+        np.testing.assert_equal(exchanges.attempts, attempts)
+        np.testing.assert_equal(exchanges.successes, successes)
+
+
+class DataStoreStageBufferTestCase(unittest.TestCase, TempDirHelper):
+    """
+    Test that buffered stages are written and loaded correctly.
+    """
+
+    def setUp(self):
+        self.setUpTempDir()
+
+        self.N_ATOMS = 50
+        self.N_REPLICAS = 4
+        # dummy pdb writer; can't use a mock because they can't be pickled
+        pdb_writer = object()
+        self.store = vault.DataStore(
+            self.N_ATOMS,
+            self.N_REPLICAS,
+            pdb_writer,
+            block_size=10,
+            buffer_stages=3,
+        )
+        self.store.initialize(mode="w")
+        self.test_pos = np.ones((self.N_REPLICAS, self.N_ATOMS, 3))
+
+    def tearDown(self):
+        self.tearDownTempDir()
+
+    def n_written(self):
+        return self.store._cdf_data_set.variables["positions"].shape[-1]
+
+    def test_rejects_zero_buffer_stages(self):
+        "should raise if buffer_stages is less than one"
+        with self.assertRaises(ValueError):
+            vault.DataStore(self.N_ATOMS, self.N_REPLICAS, object(), buffer_stages=0)
+
+    def test_stages_are_buffered(self):
+        "should not write until the buffer is full"
+        for i in range(3):
+            self.store.save_positions(i * self.test_pos, i)
+
+        self.assertEqual(self.n_written(), 0)
+
+        self.store.save_positions(self.test_pos, 3)
+
+        self.assertEqual(self.n_written(), 3)
+
+    def test_loads_buffered_stage(self):
+        "should load stages that have not been written yet"
+        self.store.save_positions(2 * self.test_pos, 0)
+
+        np.testing.assert_equal(self.store.load_positions(0), 2 * self.test_pos)
+
+    def test_flushes_on_new_block(self):
+        "should write the buffer when the block fills up"
+        for i in range(11):
+            self.store.save_positions(i * self.test_pos, i)
+
+        for i in range(10):
+            np.testing.assert_equal(
+                self.store.load_positions_random_access(i), i * self.test_pos
+            )
+
+    def test_flushes_on_backup(self):
+        "should write the buffer when a backup is made"
+        self.store.save_positions(self.test_pos, 0)
+
+        self.store.backup(0)
+
+        self.assertEqual(self.n_written(), 1)
+
+    def test_flushes_on_close(self):
+        "should write the buffer on close"
+        self.store.save_alphas(np.zeros(self.N_REPLICAS), 0)
+        self.store.save_positions(self.test_pos, 0)
+        self.store.save_positions(2 * self.test_pos, 1)
+        self.store.save_data_store()
+        self.store.close()
+
+        store2 = vault.DataStore.load_data_store()
+        store2.initialize(mode="a")
+
+        np.testing.assert_equal(store2.load_positions(1), 2 * self.test_pos)
+        np.testing.assert_equal(store2.load_alphas(0), np.zeros(self.N_REPLICAS))
+
+
+class DataStoreStorageProfileTestCase(unittest.TestCase, TempDirHelper):
+    """
+    Test that storage profiles control how data is written.
+    """
+
+    def setUp(self):
+        self.setUpTempDir()
+
+        self.N_ATOMS = 50
+        self.N_REPLICAS = 4
+        self.test_pos = np.random.random((self.N_REPLICAS, self.N_ATOMS, 3))
+
+    def tearDown(self):
+        self.tearDownTempDir()
+
+    def save_and_reload(self, storage_profile):
+        # dummy pdb writer; can't use a mock because they can't be pickled
+        store = vault.DataStore(
+            self.N_ATOMS, self.N_REPLICAS, object(), storage_profile=storage_profile
+        )
+        store.initialize(mode="w")
+        store.save_positions(self.test_pos, 0)
+        store.save_data_store()
+        store.close()
+        store2 = vault.DataStore.load_data_store()
+        store2.initialize(mode="a")
+        return store2
+
+    def test_rejects_unknown_profile(self):
+        "should raise if the profile name is unknown"
+        with self.assertRaises(ValueError):
+            vault.DataStore(
+                self.N_ATOMS, self.N_REPLICAS, object(), storage_profile="bogus"
+            )
+
+    def test_default_profile_is_double_precision(self):
+        "the default profile should store doubles"
+        store = self.save_and_reload("default")
+
+        positions = store.load_positions(0)
+
+        self.assertEqual(positions.dtype, np.float64)
+        np.testing.assert_equal(positions, self.test_pos)
+
+    def test_fast_profile_is_single_precision(self):
+        "the fast profile should store floats"
+        store = self.save_and_reload("fast")
+
+        positions = store.load_positions(0)
+
+        self.assertEqual(positions.dtype, np.float32)
+        np.testing.assert_allclose(positions, self.test_pos, rtol=1e-6)
+
+    def test_fixed_point_positions(self):
+        "positions should be decoded to the requested precision"
+        profile = vault.StorageProfile("test", position_precision=1e-3)
+        store = self.save_and_reload(profile)
+
+        positions = store.load_positions(0)
+
+        np.testing.assert_allclose(positions, self.test_pos, atol=0.5e-3)
+
+    def test_profile_is_recorded(self):
+        "the profile should be stored in the file metadata"
+        store = self.save_and_reload("balanced")
+
+        self.assertEqual(store.storage_profile.name, "balanced")
+        self.assertEqual(store._cdf_data_set.storage_profile, "balanced")
+        self.assertEqual(store._cdf_data_set.storage_complevel, 1)
+
+
+class DataStoreStoragePolicyTestCase(unittest.TestCase, TempDirHelper):
+    """
+    Test storing a subset of the trajectory.
+    """
+
+    def setUp(self):
+        self.setUpTempDir()
+
+        self.N_ATOMS = 20
+        self.N_REPLICAS = 4
+        self.policy = vault.StoragePolicy(
+            position_interval=5, velocity_interval=None, atoms=[1, 3, 5]
+        )
+        # dummy pdb writer; can't use a mock because they can't be pickled
+        self.store = vault.DataStore(
+            self.N_ATOMS,
+            self.N_REPLICAS,
+            object(),
+            block_size=10,
+            storage_policy=self.policy,
+        )
+        self.store.initialize(mode="w")
+        self.states = {}
+
+    def tearDown(self):
+        self.tearDownTempDir()
+
+    def run_stages(self, stages):
+        for stage in stages:
+            self.states[stage] = [
+                system.SystemState(
+                    np.random.random((self.N_ATOMS, 3)),
+                    np.random.random((self.N_ATOMS, 3)),
+                    i / 10.0,
+                    float(i),
+                    np.random.random(3),
+                )
+                for i in range(self.N_REPLICAS)
+            ]
+            self.store.save_states(self.states[stage], stage)
+            self.store.save_data_store()
+
+    def test_rejects_bad_intervals(self):
+        "should raise for intervals less than one"
+        with self.assertRaises(ValueError):
+            vault.StoragePolicy(position_interval=0)
+        with self.assertRaises(ValueError):
+            vault.StoragePolicy(velocity_interval=0)
+
+    def test_stores_atom_subset(self):
+        "should only store the selected atoms"
+        self.run_stages(range(6))
+
+        positions = self.store.load_positions(5)
+
+        self.assertEqual(positions.shape, (self.N_REPLICAS, 3, 3))
+        np.testing.assert_equal(positions[2], self.states[5][2].positions[[1, 3, 5]])
+
+    def test_stores_full_replicas_every_stage(self):
+        "should store the other replicas every position_interval stages"
+        self.run_stages(range(6))
+
+        positions = self.store.load_positions(3)
+
+        self.assertFalse(np.ma.is_masked(positions[0]))
+        self.assertTrue(positions[1:].mask.all())
+        np.testing.assert_equal(positions[0], self.states[3][0].positions[[1, 3, 5]])
+
+    def test_range_has_nan_for_positions_not_stored(self):
+        "should return NaN rather than the fill value from load_range"
+        self.run_stages(range(6))
+
+        positions = self.store.load_range("positions", 0, 6)
+
+        self.assertFalse(np.ma.isMaskedArray(positions))
+        self.assertTrue(np.isnan(positions[1:, ..., 3]).all())
+        np.testing.assert_equal(
+            positions[1, ..., 5], self.states[5][1].positions[[1, 3, 5]]
+        )
+        np.testing.assert_equal(
+            positions[0, ..., 3], self.states[3][0].positions[[1, 3, 5]]
+        )
+
+    def test_iterate_positions_has_nan_for_positions_not_stored(self):
+        "should yield NaN for positions not stored, also from worker processes"
+        self.run_stages(range(12))
+        self.store.close()
+
+        store = vault.DataStore.load_data_store()
+        store.initialize(mode="r")
+        for read_workers in [1, 2]:
+            store.read_workers = read_workers
+            frames = list(store.iterate_positions(0, 10))
+
+            self.assertTrue(np.isnan(frames[3][1:]).all())
+            np.testing.assert_equal(
+                frames[5][2], self.states[5][2].positions[[1, 3, 5]]
+            )
+
+    def test_saves_partial_states(self):
+        "should save the available states, but not keep them for restarts"
+        self.run_stages(range(2))
+        states = [self.states[1][0]] + [None] * (self.N_REPLICAS - 1)
+        self.store.save_partial_states(states, 2)
+        self.store.save_data_store()
+
+        positions = self.store.load_positions(2)
+        np.testing.assert_equal(positions[0], self.states[1][0].positions[[1, 3, 5]])
+        self.assertTrue(positions[1:].mask.all())
+        self.assertTrue(self.store.load_energies(2)[1:].mask.all())
+        self.assertTrue(self.store.load_box_vectors(2)[1:].mask.all())
+        with self.assertRaises(RuntimeError):
+            self.store.load_states(2)
+
+    def test_partial_states_must_have_stored_replicas(self):
+        "should raise if the policy stores a replica that is missing"
+        self.run_stages(range(5))
+        states = [self.states[4][0]] + [None] * (self.N_REPLICAS - 1)
+
+        with self.assertRaises(RuntimeError):
+            self.store.save_partial_states(states, 5)
+
+    def test_does_not_store_velocities(self):
+        "should not store velocities with velocity_interval=None"
+        self.run_stages(range(6))
+
+        self.assertTrue(self.store.load_velocities(5).mask.all())
+
+    def test_loads_latest_full_state(self):
+        "should load the complete state of the latest stage"
+        self.run_stages(range(6))
+
+        states = self.store.load_states(5)
+
+        np.testing.assert_equal(states[1].positions, self.states[5][1].positions)
+        np.testing.assert_equal(states[1].velocities, self.states[5][1].velocities)
+
+    def test_cannot_load_incomplete_state(self):
+        "should raise when loading a stage that was not stored completely"
+        self.run_stages(range(6))
+
+        with self.assertRaises(RuntimeError):
+            self.store.load_states(2)
+
+    def test_keeps_full_state_at_end_of_block(self):
+        "should keep the complete state of the last stage of each block"
+        self.run_stages(range(12))
+        self.store.close()
+
+        store = vault.DataStore.load_data_store()
+        store.initialize(mode="r")
+        states = store.load_states(9)
+
+        np.testing.assert_equal(states[3].positions, self.states[9][3].positions)
+        np.testing.assert_equal(states[3].velocities, self.states[9][3].velocities)
+
+    def test_ignores_restart_data_for_uncompleted_stage(self):
+        "should not restart from a stage that was not completed"
+        self.run_stages(range(4))
+        # interrupted after the positions were saved
+        self.store.save_positions(np.zeros((self.N_REPLICAS, self.N_ATOMS, 3)), 4)
+        self.store.close()
+
+        store = vault.DataStore.load_data_store()
+        store.initialize(mode="a")
+
+        with self.assertRaises(RuntimeError):
+            store.load_states(4)
+        np.testing.assert_equal(
+            store.load_states(3)[0].positions, self.states[3][0].positions
+        )
+
+
+class DataStoreEnergyBandTestCase(unittest.TestCase, TempDirHelper):
+    """
+    Test storing a band of the energy matrix.
+    """
+
+    def setUp(self):
+        self.setUpTempDir()
+
+        self.N_REPLICAS = 6
+        # dummy pdb writer; can't use a mock because they can't be pickled
+        self.store = vault.DataStore(
+            10,
+            self.N_REPLICAS,
+            object(),
+            block_size=10,
+            storage_policy=vault.StoragePolicy(energy_matrix_band=1),
+        )
+        self.store.initialize(mode="w")
+        self.matrix = np.random.random((self.N_REPLICAS, self.N_REPLICAS))
+        i, j = np.indices(self.matrix.shape)
+        self.expected = np.where(abs(i - j) <= 1, self.matrix, np.nan)
+
+    def tearDown(self):
+        self.tearDownTempDir()
+
+    def test_only_stores_band(self):
+        "should store the band rather than the full matrix"
+        self.store.save_energy_matrix(self.matrix, 0)
+
+        variables = self.store._cdf_data_set.variables
+        self.assertNotIn("energy_matrix", variables)
+        self.assertEqual(variables["energy_matrix_band"].shape, (6, 3, 1))
+
+    def test_loads_dense_matrix(self):
+        "should load a dense matrix with NaN outside of the band"
+        self.store.save_energy_matrix(self.matrix, 0)
+
+        np.testing.assert_equal(self.store.load_energy_matrix(0), self.expected)
+
+    def test_loads_all_matrices(self):
+        "should load all of the matrices as dense arrays"
+        for stage in range(12):
+            self.store.save_energy_matrix(stage * self.matrix, stage)
+
+        matrices = self.store.load_all_energy_matrices()
+
+        self.assertEqual(matrices.shape, (6, 6, 10))
+        np.testing.assert_equal(matrices[..., 7], 7 * self.expected)
+
+
+class DataStoreLoadRangeTestCase(unittest.TestCase, TempDirHelper):
+    """
+    Test loading ranges of stages across blocks.
+    """
+
+    def setUp(self):
+        self.setUpTempDir()
+
+        self.N_ATOMS = 20
+        self.N_REPLICAS = 4
+        self.N_STAGES = 25
+        # dummy pdb writer; can't use a mock because they can't be pickled
+        self.store = vault.DataStore(
+            self.N_ATOMS, self.N_REPLICAS, object(), block_size=10
+        )
+        self.store.initialize(mode="w")
+        self.positions = np.random.random(
+            (self.N_REPLICAS, self.N_ATOMS, 3, self.N_STAGES)
+        )
+        for stage in range(self.N_STAGES):
+            self.store.save_positions(self.positions[..., stage], stage)
+            self.store.save_alphas(stage * np.ones(self.N_REPLICAS), stage)
+
+    def tearDown(self):
+        self.tearDownTempDir()
+
+    def test_load_range_across_blocks(self):
+        "should load a range of stages spanning several blocks"
+        result = self.store.load_range("positions", 5, 22)
+
+        np.testing.assert_equal(result, self.positions[..., 5:22])
+
+    def test_load_range_subset(self):
+        "should only load the requested replicas and atoms"
+        result = self.store.load_range(
+            "positions", 0, 20, replicas=[3, 1], atoms=[0, 5, 7]
+        )
+
+        expected = self.positions[[3, 1]][:, [0, 5, 7]][..., 0:20]
+        np.testing.assert_equal(result, expected)
+
+    def test_iterate_range_yields_blocks(self):
+        "should yield one array for each block"
+        result = list(self.store.iterate_range("alphas", 5, 25, replicas=[0]))
+
+        self.assertEqual([r.shape for r in result], [(1, 5), (1, 10), (1, 5)])
+        np.testing.assert_equal(result[1], [np.arange(10, 20)])
+
+    def test_defaults_to_safe_frames(self):
+        "should load up to max_safe_frame by default"
+        result = self.store.load_range("alphas")
+
+        self.assertEqual(result.shape, (self.N_REPLICAS, 20))
+
+    def test_rejects_atoms_for_alphas(self):
+        "should not allow selecting atoms for per-replica data"
+        with self.assertRaises(ValueError):
+            self.store.load_range("alphas", 0, 10, atoms=[0])
+
+    def test_rejects_unknown_variable(self):
+        "should raise for an unknown variable"
+        with self.assertRaises(ValueError):
+            self.store.load_range("bogus", 0, 10)
+
+    def test_iterate_positions(self):
+        "should yield the positions for each stage"
+        result = list(self.store.iterate_positions(8, 12))
+
+        self.assertEqual(len(result), 4)
+        np.testing.assert_equal(result[3], self.positions[..., 11])
+
+    def test_parallel_load_range(self):
+        "should load the same data with read workers"
+        self.store.read_workers = 2
+        self.store.read_prefetch = 1
+
+        result = self.store.load_range("positions", 3, 25, replicas=[2, 0])
+
+        np.testing.assert_equal(result, self.positions[[2, 0]][..., 3:25])
+
+    def test_parallel_rejects_unknown_variable(self):
+        "should raise for an unknown variable with read workers"
+        self.store.read_workers = 2
+
+        with self.assertRaises(ValueError):
+            self.store.load_range("bogus", 0, 10)
+
+    def test_rejects_zero_read_workers(self):
+        "should raise if read_workers is less than one"
+        with self.assertRaises(ValueError):
+            self.store.read_workers = 0
+
+
+class DataStoreConsolidateTestCase(unittest.TestCase, TempDirHelper):
+    """
+    Test consolidating the block files into a single file.
+    """
+
+    def setUp(self):
+        self.setUpTempDir()
+
+        self.N_ATOMS = 10
+        self.N_REPLICAS = 4
+        # dummy pdb writer; can't use a mock because they can't be pickled
+        pdb_writer = object()
+        store = vault.DataStore(
+            self.N_ATOMS, self.N_REPLICAS, pdb_writer, block_size=10
+        )
+        store.initialize(mode="w")
+        self.positions = np.random.random((self.N_REPLICAS, self.N_ATOMS, 3, 25))
+        self.permutations = np.array(
+            [np.roll(np.arange(self.N_REPLICAS), stage) for stage in range(25)]
+        ).T
+        for stage in range(25):
+            store.save_positions(self.positions[..., stage], stage)
+            store.save_alphas(stage * np.ones(self.N_REPLICAS), stage)
+            store.save_permutation_vector(self.permutations[:, stage], stage)
+        store.save_data_store()
+        store.close()
+
+        self.store = vault.DataStore.load_data_store()
+        self.store.initialize(mode="r")
+
+    def tearDown(self):
+        self.store.close()
+        self.tearDownTempDir()
+
+    def reopen(self):
+        self.store.close()
+        self.store = vault.DataStore.load_data_store()
+        self.store.initialize(mode="r")
+
+    def test_consolidates_finished_blocks(self):
+        "should write the finished blocks to the consolidated file"
+        n_stages = self.store.consolidate()
+
+        self.assertEqual(n_stages, 20)
+        self.assertTrue(os.path.exists("Data/consolidated.nc"))
+
+    def test_reads_from_consolidated_file(self):
+        "should read the same data from the consolidated file"
+        self.store.consolidate()
+        os.remove("Data/Blocks/block_000000.nc")
+        os.remove("Data/Blocks/block_000001.nc")
+        self.reopen()
+
+        np.testing.assert_equal(
+            self.store.load_all_positions(), self.positions[..., :20]
+        )
+        np.testing.assert_equal(self.store.load_alphas(15), 15 * np.ones(4))
+        np.testing.assert_equal(
+            self.store.load_positions_random_access(3), self.positions[..., 3]
+        )
+
+    def test_float32(self):
+        "should store positions as single precision"
+        self.store.consolidate(float32=True)
+        self.reopen()
+
+        np.testing.assert_allclose(
+            self.store.load_range("positions", 0, 20),
+            self.positions[..., :20],
+            rtol=1e-6,
+        )
+
+    def test_chunks_by_replica(self):
+        "should store each replica's time series in separate chunks"
+        self.store.consolidate(chunk_bytes=10 * self.N_ATOMS * 3 * 8)
+
+        with netCDF4.Dataset("Data/consolidated.nc") as dataset:
+            self.assertEqual(
+                dataset.variables["positions"].chunking(), [1, self.N_ATOMS, 3, 10]
+            )
+            self.assertEqual(dataset.variables["alphas"].chunking(), [1, 20])
+
+    def test_walker_index(self):
+        "should follow each walker through the permutations"
+        expected = self.store.load_walker_index()
+        self.store.consolidate()
+        self.reopen()
+
+        walker_index = self.store.load_walker_index(5, 10)
+
+        np.testing.assert_equal(walker_index, expected[:, 5:10])
+        walkers = np.arange(self.N_REPLICAS)
+        for stage in range(1, 10):
+            walkers = walkers[self.permutations[:, stage]]
+        np.testing.assert_equal(walker_index[:, -1], walkers)
+
+    def test_requires_readonly_mode(self):
+        "should raise if the store is not read-only"
+        store = vault.DataStore.load_data_store()
+        store.initialize(mode="a")
+
+        with self.assertRaises(RuntimeError):
+            store.consolidate()
+        store.close()
+
+
+class DataStoreMemmapCacheTestCase(unittest.TestCase, TempDirHelper):
+    """
+    Test the memory-mapped analysis cache.
+    """
+
+    def setUp(self):
+        self.setUpTempDir()
+
+        self.N_ATOMS = 10
+        self.N_REPLICAS = 4
+        # dummy pdb writer; can't use a mock because they can't be pickled
+        pdb_writer = object()
+        store = vault.DataStore(
+            self.N_ATOMS, self.N_REPLICAS, pdb_writer, block_size=10
+        )
+        store.initialize(mode="w")
+        self.positions = np.random.random((self.N_REPLICAS, self.N_ATOMS, 3, 25))
+        for stage in range(25):
+            store.save_positions(self.positions[..., stage], stage)
+            store.save_alphas(stage * np.ones(self.N_REPLICAS), stage)
+        store.save_data_store()
+        store.close()
+
+        self.store = vault.DataStore.load_data_store()
+        self.store.initialize(mode="r")
+
+    def tearDown(self):
+        self.store.close()
+        self.tearDownTempDir()
+
+    def reopen(self):
+        self.store.close()
+        self.store = vault.DataStore.load_data_store()
+        self.store.initialize(mode="r")
+
+    def test_writes_npy_files(self):
+        "should write an npy file for each variable"
+        n_stages = self.store.materialize_cache(variables=["alphas", "positions"])
+
+        self.assertEqual(n_stages, 20)
+        alphas = np.load("Data/Cache/alphas.npy")
+        np.testing.assert_equal(alphas[0], np.arange(20))
+
+    def test_loads_from_cache(self):
+        "should load memory-mapped data when the cache is present"
+        self.store.materialize_cache(variables=["alphas", "positions"])
+        self.reopen()
+
+        positions = self.store.load_positions(5)
+
+        np.testing.assert_equal(positions, self.positions[..., 5])
+        np.testing.assert_equal(
+            self.store.load_range("positions"), self.positions[..., :20]
+        )
+
+    def test_cached_stages_are_masked_copies(self):
+        "should load single stages the same way with and without the cache"
+        uncached = self.store.load_positions(5)
+        self.store.materialize_cache(variables=["alphas", "positions"])
+        self.reopen()
+
+        positions = self.store.load_positions(5)
+
+        self.assertIsInstance(positions, np.ma.MaskedArray)
+        self.assertNotIsInstance(positions.data, np.memmap)
+        self.assertTrue(positions.flags.writeable)
+        np.testing.assert_equal(positions, uncached)
+
+    def test_casts_floats_to_dtype(self):
+        "should store floating point variables with the requested type"
+        self.store.materialize_cache(variables=["alphas"], dtype="f4")
+        self.reopen()
+
+        self.assertEqual(self.store.load_alphas(3).dtype, np.float32)
+
+    def test_ignores_stale_cache(self):
+        "should not use the cache if a block file has changed"
+        self.store.materialize_cache(variables=["alphas"])
+        stat = os.stat("Data/Blocks/block_000001.nc")
+        os.utime(
+            "Data/Blocks/block_000001.nc",
+            ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9),
+        )
+        self.reopen()
+
+        self.assertNotIsInstance(self.store.load_alphas(3), np.memmap)
+        np.testing.assert_equal(self.store.load_alphas(3), 3 * np.ones(4))
+
+
+class DataStoreRandomAccessTestCase(unittest.TestCase, TempDirHelper):
+    """
+    Test the caching of random-access reads.
+    """
+
+    def setUp(self):
+        self.setUpTempDir()
+
+        self.N_ATOMS = 20
+        self.N_REPLICAS = 4
+        # dummy pdb writer; can't use a mock because they can't be pickled
+        self.store = vault.DataStore(
+            self.N_ATOMS,
+            self.N_REPLICAS,
+            object(),
+            block_size=10,
+            max_open_blocks=2,
+            random_access_cache_bytes=10 * self.N_REPLICAS * self.N_ATOMS * 3 * 8,
+        )
+        self.store.initialize(mode="w")
+        self.test_pos = np.ones((self.N_REPLICAS, self.N_ATOMS, 3))
+        for stage in range(35):
+            self.store.save_positions(stage * self.test_pos, stage)
+
+    def tearDown(self):
+        self.store.close()
+        self.tearDownTempDir()
+
+    def test_loads_from_all_blocks(self):
+        "should load the right positions from each block"
+        for stage in [3, 15, 27, 33, 4]:
+            np.testing.assert_equal(
+                self.store.load_positions_random_access(stage),
+                stage * self.test_pos,
+            )
+
+    def test_limits_open_blocks(self):
+        "should keep at most max_open_blocks files open"
+        for stage in [3, 15, 27]:
+            self.store.load_positions_random_access(stage)
+
+        self.assertEqual(list(self.store._read_handles), [1, 2])
+
+    def test_cache_is_not_modified(self):
+        "modifying the result should not change later reads"
+        positions = self.store.load_positions_random_access(3)
+        positions[:] = -1.0
+
+        np.testing.assert_equal(
+            self.store.load_positions_random_access(3), 3 * self.test_pos
+        )
+
+    def test_cache_is_bounded(self):
+        "should keep at most random_access_cache_bytes in the cache"
+        for stage in range(30):
+            self.store.load_positions_random_access(stage)
+
+        self.assertEqual(len(self.store._random_access_cache._arrays), 10)
+
 
 class DataStoreBackupTestCase(unittest.TestCase, TempDirHelper):
     """
@@ -377,6 +1171,312 @@ class DataStoreBackupTestCase(unittest.TestCase, TempDirHelper):
 
         self.assertTrue(os.path.exists("Data/Backup/remd_runner.dat"))
 
+    def test_backup_is_not_changed_by_later_saves(self):
+        "saving after a backup should not change the backup"
+        self.store.backup(stage=0)
+        self.store._current_stage = 1
+
+        self.store.save_data_store()
+
+        store = vault.DataStore.load_data_store(load_backup=True)
+        self.assertEqual(store._current_stage, 0)
+
+
+class DataStoreCommittedStageTestCase(unittest.TestCase, TempDirHelper):
+    """
+    Test that completed stages are recorded and checked on restart.
+    """
+
+    def setUp(self):
+        self.setUpTempDir()
+
+        self.N_ATOMS = 50
+        self.N_REPLICAS = 4
+        # dummy pdb writer; can't use a mock because they can't be pickled
+        pdb_writer = object()
+        self.store = vault.DataStore(
+            self.N_ATOMS, self.N_REPLICAS, pdb_writer, block_size=10, commit_interval=1
+        )
+        self.store.initialize(mode="w")
+        self.test_pos = np.ones((self.N_REPLICAS, self.N_ATOMS, 3))
+
+    def tearDown(self):
+        self.tearDownTempDir()
+
+    def run_stages(self, stages, store=None):
+        store = self.store if store is None else store
+        for stage in stages:
+            store.save_positions(stage * self.test_pos, stage)
+            store.save_alphas(stage * np.ones(self.N_REPLICAS), stage)
+            store.save_data_store()
+
+    def reopen(self):
+        self.store.close()
+        store = vault.DataStore.load_data_store()
+        store.initialize(mode="a")
+        return store
+
+    def test_nothing_committed_initially(self):
+        "should start with no committed stages"
+        self.assertEqual(self.store.committed_stage, -1)
+
+    def test_save_data_store_commits_stage(self):
+        "should commit the current stage when the data store is saved"
+        self.run_stages(range(3))
+
+        self.assertEqual(self.store.committed_stage, 2)
+
+    def test_uncommitted_stage_is_not_marked(self):
+        "should not commit a stage until the data store is saved"
+        self.run_stages(range(3))
+
+        self.store.save_positions(self.test_pos, 3)
+
+        self.assertEqual(self.store.committed_stage, 2)
+        with self.assertRaises(RuntimeError):
+            self.store.verify_stage(3)
+
+    def test_resumes_from_committed_stage(self):
+        "should load the last committed stage after reopening"
+        self.run_stages(range(5))
+        # an incomplete stage that was interrupted
+        self.store.save_positions(self.test_pos, 5)
+
+        store = self.reopen()
+
+        self.assertEqual(store.committed_stage, 4)
+        store.verify_stage(4)
+        np.testing.assert_equal(store.load_positions(4), 4 * self.test_pos)
+
+    def test_resumes_from_previous_block(self):
+        "should resume from the previous block if a new block was not committed"
+        self.run_stages(range(10))
+        # starts block 1, but the stage is never completed
+        self.store.save_positions(self.test_pos, 10)
+        with open(self.store.data_store_path, "wb") as store_file:
+            pickle.dump(self.store, store_file)
+
+        store = self.reopen()
+
+        self.assertEqual(store.committed_stage, 9)
+        store.verify_stage(9)
+        self.run_stages([10], store)
+        np.testing.assert_equal(store.load_positions(10), 10 * self.test_pos)
+
+    def test_commits_every_commit_interval_stages(self):
+        "should only record completed stages every commit_interval stages"
+        self.store._commit_interval = 3
+
+        self.run_stages(range(5))
+        self.assertEqual(self.store.committed_stage, 2)
+
+        self.run_stages([5])
+        self.assertEqual(self.store.committed_stage, 5)
+
+    def test_commits_on_close_without_commit_interval(self):
+        "should record completed stages at block boundaries and on close"
+        self.store._commit_interval = None
+
+        self.run_stages(range(12))
+        self.assertEqual(self.store.committed_stage, -1)
+        store = self.reopen()
+
+        self.assertEqual(store.committed_stage, 11)
+        store.close()
+
+    def test_commit_interval_must_be_positive(self):
+        "should raise if commit_interval is less than one"
+        with self.assertRaises(ValueError):
+            vault.DataStore(self.N_ATOMS, self.N_REPLICAS, object(), commit_interval=0)
+
+    def test_stage_can_be_run_again_after_reopening(self):
+        "should update the checksum of a committed stage that is saved again"
+        self.run_stages(range(4))
+        store = self.reopen()
+
+        # the runner was not saved after stage 3, so it is run again
+        store.save_positions(2 * 3 * self.test_pos, 3)
+        self.assertEqual(store.committed_stage, 2)
+        store.save_alphas(3 * np.ones(self.N_REPLICAS), 3)
+        store.save_data_store()
+        self.run_stages([4], store)
+        store.close()
+
+        store = vault.DataStore.load_data_store()
+        store.initialize(mode="a")
+        self.assertEqual(store.committed_stage, 4)
+        np.testing.assert_equal(store.load_positions(3), 2 * 3 * self.test_pos)
+        store.close()
+
+    def test_detects_corrupt_stage(self):
+        "should raise if a committed stage does not match its checksum"
+        self.run_stages(range(3))
+        self.store._cdf_data_set.variables["positions"][0, 0, 0, 1] = 42.0
+
+        with self.assertRaises(RuntimeError):
+            self.reopen()
+
+    def test_buffered_stages_are_committed_when_written(self):
+        "should only commit buffered stages once they are on disk"
+        self.store._buffer_stages = 3
+
+        self.run_stages(range(3))
+        self.assertEqual(self.store.committed_stage, -1)
+
+        self.run_stages([3])
+        self.assertEqual(self.store.committed_stage, 2)
+
+
+class DataStoreRawBackendTestCase(unittest.TestCase, TempDirHelper):
+    """
+    Test that the raw backend can be used for the block files.
+    """
+
+    def setUp(self):
+        self.setUpTempDir()
+
+        self.N_ATOMS = 50
+        self.N_REPLICAS = 4
+        # dummy pdb writer; can't use a mock because they can't be pickled
+        pdb_writer = object()
+        self.store = vault.DataStore(
+            self.N_ATOMS,
+            self.N_REPLICAS,
+            pdb_writer,
+            block_size=10,
+            buffer_stages=3,
+            storage_profile="archive",
+        )
+        self.store.initialize(mode="w", backend="raw")
+
+    def tearDown(self):
+        self.store.close()
+        self.tearDownTempDir()
+
+    def run_stages(self, stages):
+        for stage in stages:
+            positions = stage * np.ones((self.N_REPLICAS, self.N_ATOMS, 3))
+            self.store.save_positions(positions, stage)
+            self.store.save_alphas(np.linspace(0, 1, self.N_REPLICAS), stage)
+            self.store.save_data_store()
+            self.store.backup(stage)
+
+    def test_creates_raw_blocks(self):
+        "should write the blocks as directories"
+        self.run_stages(range(11))
+
+        self.assertEqual(self.store.storage_backend, "raw")
+        self.assertTrue(os.path.isdir("Data/Blocks/block_000000.raw"))
+        self.assertTrue(os.path.isdir("Data/Blocks/block_000001.raw"))
+
+    def test_backend_is_detected_when_reading(self):
+        "a store opened read-only should read the raw blocks"
+        self.run_stages(range(21))
+        self.store.close()
+
+        store = vault.DataStore.load_data_store(load_backup=True)
+        store._storage_backend = "netcdf"
+        store.initialize(mode="r")
+
+        self.assertEqual(store.storage_backend, "raw")
+        np.testing.assert_almost_equal(store.load_positions(15), 15.0)
+        positions = store.load_range("positions", 5, 15, replicas=[1], atoms=[0])
+        np.testing.assert_almost_equal(positions[0, 0, 0], np.arange(5, 15))
+
+    def test_restarts_from_last_committed_stage(self):
+        "committed stages should be checked when reopened"
+        self.run_stages(range(14))
+        self.store.close()
+
+        store = vault.DataStore.load_data_store()
+        store.initialize(mode="a")
+
+        self.assertEqual(store.committed_stage, 13)
+        store.close()
+
+    def test_backend_only_with_mode_w(self):
+        "should raise if the backend is given when not creating the store"
+        with self.assertRaises(ValueError):
+            self.store.initialize(mode="a", backend="raw")
+
+
+class AsyncDataStoreWriterTestCase(unittest.TestCase, TempDirHelper):
+    """
+    Test that writes made through AsyncDataStoreWriter end up on disk.
+    """
+
+    def setUp(self):
+        self.setUpTempDir()
+
+        self.N_ATOMS = 500
+        self.N_REPLICAS = 16
+        # dummy pdb writer; can't use a mock because they can't be pickled
+        pdb_writer = object()
+        store = vault.DataStore(
+            self.N_ATOMS, self.N_REPLICAS, pdb_writer, block_size=10
+        )
+        store.initialize(mode="w")
+        self.writer = vault.AsyncDataStoreWriter(store)
+
+    def tearDown(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.tearDownTempDir()
+
+    def test_writes_are_loaded_after_flush(self):
+        "should be able to load data written in the background"
+        test_pos = np.ones((self.N_REPLICAS, self.N_ATOMS, 3))
+        for i in range(5):
+            self.writer.save_positions(i * test_pos, i)
+
+        self.writer.flush()
+
+        np.testing.assert_equal(self.writer.load_positions(4), 4 * test_pos)
+
+    def test_arguments_are_copied(self):
+        "changing the arguments after a write should not change what is stored"
+        test_pos = np.zeros((self.N_REPLICAS, self.N_ATOMS, 3))
+        self.writer.save_positions(test_pos, 0)
+        test_pos[:] = 1.0
+
+        np.testing.assert_equal(self.writer.load_positions(0), 0.0)
+
+    def test_backup_at_block_boundary_flushes(self):
+        "backup should wait for pending writes when a backup is due"
+        test_pos = np.zeros((self.N_REPLICAS, self.N_ATOMS, 3))
+        for i in range(11):
+            self.writer.save_positions(test_pos, i)
+        self.writer.save_data_store()
+
+        self.writer.backup(10)
+
+        self.assertTrue(os.path.exists("Data/Blocks/block_000001.nc"))
+        self.assertTrue(os.path.exists("Data/Backup/data_store.dat"))
+
+    def test_errors_are_raised(self):
+        "an error in the writer thread should be raised in the caller"
+        test_pos = np.zeros((self.N_REPLICAS, self.N_ATOMS, 3))
+        self.writer.save_positions(test_pos, 1)
+        self.writer.save_positions(test_pos, 0)
+
+        with self.assertRaises(RuntimeError):
+            self.writer.flush()
+        with self.assertRaises(RuntimeError):
+            self.writer.close()
+        self.writer = None
+
+    def test_close_flushes(self):
+        "close should write everything before closing the store"
+        test_pos = np.ones((self.N_REPLICAS, self.N_ATOMS, 3))
+        self.writer.save_positions(test_pos, 0)
+        self.writer.save_data_store()
+
+        self.writer.close()
+        store2 = vault.DataStore.load_data_store()
+        store2.initialize(mode="a")
+
+        np.testing.assert_equal(store2.load_positions(0), test_pos)
+
 
 class TestReadOnlyMode(unittest.TestCase, TempDirHelper):
     def setUp(self):
@@ -456,6 +1556,122 @@ class TestReadOnlyMode(unittest.TestCase, TempDirHelper):
             self.assertAlmostEqual(positions[0, 0, 0, i], i)
 
 
+class TestLiveMode(unittest.TestCase, TempDirHelper):
+    """
+    Test reading completed stages while the store is being written.
+    """
+
+    def setUp(self):
+        self.setUpTempDir()
+
+        self.N_ATOMS = 50
+        self.N_REPLICAS = 4
+        # dummy pdb writer; can't use a mock because they can't be pickled
+        pdb_writer = object()
+        self.writer = vault.DataStore(
+            self.N_ATOMS, self.N_REPLICAS, pdb_writer, block_size=10, commit_interval=1
+        )
+        self.writer.initialize(mode="w")
+        self.test_pos = np.ones((self.N_REPLICAS, self.N_ATOMS, 3))
+        self.run_stages(range(5))
+
+        self.store = vault.DataStore.load_data_store()
+        self.store.initialize(mode="l")
+
+    def tearDown(self):
+        self.store.close()
+        self.writer.close()
+        self.tearDownTempDir()
+
+    def run_stages(self, stages):
+        for stage in stages:
+            self.writer.save_positions(stage * self.test_pos, stage)
+            self.writer.save_alphas(stage * np.ones(self.N_REPLICAS), stage)
+            self.writer.save_data_store()
+
+    def test_can_read_current_block(self):
+        "should read completed stages from the block being written"
+        self.assertEqual(self.store.max_safe_frame, 5)
+        np.testing.assert_equal(self.store.load_positions(4), 4 * self.test_pos)
+
+    def test_cannot_read_uncompleted_stage(self):
+        "should not read stages that have not been completed"
+        self.writer.save_positions(self.test_pos, 5)
+        self.store.refresh()
+
+        with self.assertRaises(RuntimeError):
+            self.store.load_positions(5)
+
+    def test_refresh_finds_new_stages(self):
+        "should see new stages after refreshing"
+        self.store.load_positions(4)
+        self.run_stages(range(5, 15))
+
+        self.store.refresh()
+
+        self.assertEqual(self.store.max_safe_frame, 15)
+        self.assertEqual(self.store.max_safe_block, 0)
+        np.testing.assert_equal(self.store.load_positions(14), 14 * self.test_pos)
+
+    def test_checks_stages_read_from_block_being_written(self):
+        "should raise if a stage does not match its checksum"
+        self.writer._cdf_data_set.variables["stage_checksums"][3] = 0
+        self.writer._cdf_data_set.sync()
+        self.store.refresh()
+
+        np.testing.assert_equal(self.store.load_positions(2), 2 * self.test_pos)
+        with self.assertRaises(RuntimeError):
+            self.store.load_positions(3)
+        with self.assertRaises(RuntimeError):
+            self.store.load_range("alphas", 0, 5)
+
+    def test_writes_committed_stage_file(self):
+        "should record the completed stages next to the data store"
+        self.run_stages(range(5, 12))
+
+        with open(vault.DataStore.committed_stage_path) as f:
+            self.assertEqual(json.load(f), {"block": 1, "committed_stage": 11})
+
+    def test_refresh_does_not_open_block_being_written(self):
+        "should find new stages without opening the block being written"
+        self.run_stages(range(5, 8))
+
+        with mock.patch.object(self.store._backend, "open") as open_block:
+            self.store.refresh()
+
+        open_block.assert_not_called()
+        self.assertEqual(self.store.max_safe_frame, 8)
+
+    def test_refresh_without_committed_stage_file(self):
+        "should read the completed stages from the block for older stores"
+        self.run_stages(range(5, 8))
+        os.remove(vault.DataStore.committed_stage_path)
+
+        self.store.refresh()
+
+        self.assertEqual(self.store.max_safe_frame, 8)
+
+    def test_follow_yields_new_stages(self):
+        "should yield stages as they are completed"
+        blocks = self.store.iterate_range(
+            "alphas", start=2, end=12, follow=True, poll_interval=0.0
+        )
+
+        np.testing.assert_equal(next(blocks)[0], [2, 3, 4])
+        self.run_stages(range(5, 12))
+        np.testing.assert_equal(next(blocks)[0], [5, 6, 7, 8, 9])
+        np.testing.assert_equal(next(blocks)[0], [10, 11])
+        self.assertEqual(list(blocks), [])
+
+    def test_follow_requires_live_mode(self):
+        "should raise if following without mode 'l'"
+        store = vault.DataStore.load_data_store()
+        store.initialize(mode="r")
+
+        with self.assertRaises(RuntimeError):
+            store.iterate_range("alphas", follow=True)
+
+
 class TestPDBWriter(unittest.TestCase):
     def setUp(self):
         self.atom_numbers = [1000, 1001]
@@ -516,6 +1732,23 @@ class TestPDBWriter(unittest.TestCase):
         expected_result = "ATOM   1001  A2   R2  1000       2.000   2.000   2.000"
         self.assertEqual(result, expected_result)
 
+    def test_multiple_frames_should_match_single_frames(self):
+        frames = np.array([self.coords, 2 * self.coords])
+
+        result = self.writer.get_pdb_strings(frames, [1, 2])
+
+        expected_result = self.writer.get_pdb_string(
+            self.coords, 1
+        ) + self.writer.get_pdb_string(2 * self.coords, 2)
+        self.assertEqual(result, expected_result)
+
+    def test_should_format_after_pickling(self):
+        writer = pickle.loads(pickle.dumps(self.writer))
+
+        result = writer.get_pdb_string(self.coords, 1)
+
+        self.assertEqual(result, self.writer.get_pdb_string(self.coords, 1))
+
 
 def main():
     unittest.main()
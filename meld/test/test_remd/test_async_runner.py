@@ -0,0 +1,138 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+import unittest
+from unittest import mock  #type: ignore
+from meld.remd import async_runner, ladder, adaptor
+from meld.system import runner, state
+from meld import comm, vault
+import numpy as np  #type: ignore
+
+
+def gen_state(index):
+    pos = index * np.ones((2, 3))
+    vel = np.ones((2, 3))
+    return state.SystemState(pos, vel, 0.0, 0.0, np.zeros(3))
+
+
+class TestAsyncMaster(unittest.TestCase):
+    def setUp(self):
+        self.N_REPS = 3
+        self.mock_ladder = mock.Mock(spec_set=ladder.NearestNeighborLadder)
+        self.mock_ladder.attempt_exchange.return_value = False
+        self.mock_adaptor = mock.Mock(adaptor.EqualAcceptanceAdaptor)
+        self.mock_adaptor.adapt.side_effect = lambda alphas, step: alphas
+        self.runner = async_runner.AsyncReplicaExchangeRunner(
+            self.N_REPS, 1, self.mock_ladder, self.mock_adaptor
+        )
+
+        # a single worker, which returns each segment unchanged
+        self.segments = []
+        self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.n_workers = 1
+        self.mock_comm.send_segment_to_worker.side_effect = (
+            lambda worker, segment: self.segments.append(segment)
+        )
+        self.mock_comm.receive_segment_state_from_worker.side_effect = lambda: (
+            1,
+            self.segments[-1].index,
+            self.segments[-1].state,
+        )
+
+        self.mock_system_runner = mock.Mock(spec=runner.ReplicaRunner)
+        self.mock_system_runner.get_energy.side_effect = lambda s: s.positions[0, 0]
+        self.mock_system_runner.temperature_scaler = mock.MagicMock()
+        self.mock_system_runner.temperature_scaler.return_value = 1.0
+
+        self.mock_store = mock.Mock(spec_set=vault.DataStore)
+        self.mock_store.n_replicas = self.N_REPS
+        self.mock_store.load_states.return_value = [
+            gen_state(i) for i in range(self.N_REPS)
+        ]
+
+    def test_runs_each_replica_once_per_step(self):
+        "should run the replica that has run the fewest segments next"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.assertEqual([s.index for s in self.segments], [0, 1, 2])
+        self.assertTrue(all(s.minimize for s in self.segments))
+        self.assertEqual([s.step for s in self.segments], [1, 1, 1])
+
+    def test_attempts_exchanges_between_waiting_neighbors(self):
+        "should attempt an exchange with each neighbor that is waiting"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        pairs = [c[0][0] for c in self.mock_ladder.attempt_exchange.call_args_list]
+        self.assertEqual(pairs, [0, 0, 1, 1])
+
+    def test_saves_schedule(self):
+        "should save the segments run at each index and the exchanges"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.mock_store.save_replica_stages.assert_called_once_with([1, 1, 1], 1)
+        exchanges = self.mock_store.save_exchange_counts.call_args[0][0]
+        np.testing.assert_equal(exchanges.attempts, [2, 2])
+        np.testing.assert_equal(exchanges.successes, [0, 0])
+
+    def test_stops_workers(self):
+        "should stop the workers when finished"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.mock_comm.stop_workers.assert_called_once_with()
+        self.assertEqual(self.runner.step, 2)
+
+    def test_accepted_exchanges_follow_permutation_vector(self):
+        "the stored states should be permuted as in the permutation vector"
+        self.mock_ladder.attempt_exchange.side_effect = [True, False, True, False]
+
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        saved_states = self.mock_store.save_states.call_args[0][0]
+        positions = [s.positions[0, 0] for s in saved_states]
+        permutation = self.mock_store.save_permutation_vector.call_args[0][0]
+        self.assertEqual(permutation, [1, 2, 0])
+        self.assertEqual(positions, permutation)
+        exchanges = self.mock_store.save_exchange_counts.call_args[0][0]
+        np.testing.assert_equal(exchanges.successes, [1, 1])
+
+    def test_computes_exchange_energies_with_both_hamiltonians(self):
+        "should compute the energy of both structures with both alphas"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        energies = self.mock_ladder.attempt_exchange.call_args_list[0][0][1]
+        np.testing.assert_equal(energies, [[0.0, 1.0], [0.0, 1.0]])
+        self.mock_system_runner.prepare_for_timestep.assert_any_call(0.5, 1)
+
+
+class TestAsyncSlave(unittest.TestCase):
+    def setUp(self):
+        self.state = gen_state(1)
+        self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.receive_segment_from_master.side_effect = [
+            comm.Segment(2, 0.5, self.state, True, 1),
+            comm.Segment(2, 0.5, self.state, False, 2),
+            None,
+        ]
+
+        self.mock_system_runner = mock.Mock(spec=runner.ReplicaRunner)
+        self.mock_system_runner.minimize_then_run.side_effect = lambda s: s
+        self.mock_system_runner.run.side_effect = lambda s: s
+        self.runner = async_runner.AsyncSlaveRunner(max_steps=2)
+
+    def test_runs_segments_until_stopped(self):
+        "should run each segment and send the state back"
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.assertEqual(self.mock_comm.send_segment_state_to_master.call_count, 2)
+        self.mock_comm.send_segment_state_to_master.assert_called_with(2, self.state)
+        self.assertEqual(self.state.alpha, 0.5)
+
+    def test_minimizes_when_asked(self):
+        "should only minimize the segments that ask for it"
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.assertEqual(self.mock_system_runner.minimize_then_run.call_count, 1)
+        self.assertEqual(self.mock_system_runner.run.call_count, 1)
+        self.mock_system_runner.prepare_for_timestep.assert_called_with(0.5, 2)
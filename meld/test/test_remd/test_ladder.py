@@ -219,3 +219,133 @@ class TestFiveHundredTrialsWithThreeReplicas(unittest.TestCase):
         result = l.compute_exchanges(energy, mock_adaptor)
 
         self.assertEqual(result[0], 2, "replica 2 should be at the bottom")
+
+
+class TestNeighborExchanges(unittest.TestCase):
+    "test compute_neighbor_exchanges with a banded energy matrix"
+
+    def setUp(self):
+        self.ladder = ladder.NearestNeighborLadder(n_trials=1)
+        self.mock_adaptor = mock.Mock(spec_set=adaptor.EqualAcceptanceAdaptor)
+        # favorable swaps between all neighbors, NaN outside of the band
+        nan = np.nan
+        self.energy = np.array(
+            [
+                [0, -1, nan, nan],
+                [0, 0, -1, nan],
+                [nan, 0, 0, -1],
+                [nan, nan, 0, 0],
+            ]
+        )
+
+    def test_even_pairs(self):
+        "should swap (0, 1) and (2, 3) when starting from zero"
+        with mock.patch("meld.remd.ladder.random.choice") as mock_random_choice:
+            mock_random_choice.return_value = 0
+
+            result = self.ladder.compute_neighbor_exchanges(
+                self.energy, self.mock_adaptor
+            )
+
+            self.assertEqual(result, [1, 0, 3, 2])
+            self.mock_adaptor.update.assert_has_calls(
+                [mock.call(0, True), mock.call(2, True)]
+            )
+
+    def test_odd_pairs(self):
+        "should only swap (1, 2) when starting from one"
+        with mock.patch("meld.remd.ladder.random.choice") as mock_random_choice:
+            mock_random_choice.return_value = 1
+
+            result = self.ladder.compute_neighbor_exchanges(
+                self.energy, self.mock_adaptor
+            )
+
+            self.assertEqual(result, [0, 2, 1, 3])
+            self.mock_adaptor.update.assert_called_once_with(1, True)
+
+    def test_records_last_exchanges(self):
+        "should count the attempted and accepted swaps of the last call"
+        with mock.patch("meld.remd.ladder.random.choice") as mock_random_choice:
+            mock_random_choice.return_value = 1
+
+            self.ladder.compute_neighbor_exchanges(self.energy, self.mock_adaptor)
+
+            attempts, successes = self.ladder.last_exchanges()
+            np.testing.assert_equal(attempts, [0, 1, 0])
+            np.testing.assert_equal(successes, [0, 1, 0])
+
+
+class TestPeerExchanges(unittest.TestCase):
+    "test the exchanges decided by pairs of replicas"
+
+    def setUp(self):
+        self.ladder = ladder.NearestNeighborLadder(n_trials=1)
+        self.mock_adaptor = mock.Mock(spec_set=adaptor.EqualAcceptanceAdaptor)
+        nan = np.nan
+        self.energy = np.array(
+            [
+                [0, 1, nan, nan],
+                [2, 3, 4, nan],
+                [nan, 5, 6, 7],
+                [nan, nan, 8, 9],
+            ]
+        )
+
+    def test_partners_alternate(self):
+        "should pair (1, 2) on odd steps and (0, 1), (2, 3) on even steps"
+        odd = [ladder.peer_exchange_partner(i, 1, 4) for i in range(4)]
+        even = [ladder.peer_exchange_partner(i, 2, 4) for i in range(4)]
+
+        self.assertEqual(odd, [None, 2, 1, None])
+        self.assertEqual(even, [1, 0, 3, 2])
+
+    def test_favorable_swap_is_accepted(self):
+        "should always accept a swap that lowers the energy"
+        energies = np.array([[0.0, -1.0], [0.0, 0.0]])
+
+        self.assertTrue(ladder.accept_peer_exchange(energies, 0, 1, 1234))
+
+    def test_pairs_agree(self):
+        "both replicas of a pair should draw the same random number"
+        energies = np.array([[0.0, 1.0], [1.0, 0.0]])
+        results = [
+            ladder.accept_peer_exchange(energies, 3, step, 1234)
+            for step in range(100)
+        ]
+        repeated = [
+            ladder.accept_peer_exchange(energies, 3, step, 1234)
+            for step in range(100)
+        ]
+
+        self.assertEqual(results, repeated)
+        # exp(-2) of the swaps should be accepted
+        self.assertGreater(sum(results), 0)
+        self.assertLess(sum(results), 50)
+
+    def test_records_exchanges(self):
+        "should update the permutation, energies, adaptor, and counts"
+        result = self.ladder.record_peer_exchanges(
+            self.energy, np.array([1, -1, 0]), self.mock_adaptor
+        )
+
+        self.assertEqual(result, [1, 0, 2, 3])
+        np.testing.assert_equal(self.energy[:2, :2], [[1, 0], [3, 2]])
+        self.mock_adaptor.update.assert_has_calls(
+            [mock.call(0, True), mock.call(2, False)]
+        )
+        attempts, successes = self.ladder.last_exchanges()
+        np.testing.assert_equal(attempts, [1, 0, 1])
+        np.testing.assert_equal(successes, [1, 0, 0])
+
+
+class TestRescaleVelocities(unittest.TestCase):
+    def test_scales_by_square_root_of_temperature_ratio(self):
+        "should scale the velocities to the new temperature"
+        velocities = np.ones((2, 3))
+
+        result = ladder.rescale_velocities(
+            velocities, 0.0, 1.0, lambda alpha: 300.0 + 900.0 * alpha
+        )
+
+        np.testing.assert_allclose(result, 2.0 * velocities)
@@ -7,8 +7,9 @@ import unittest
 from unittest import mock  #type: ignore
 from unittest.mock import sentinel  #type: ignore
 from meld.remd import master_runner, ladder, adaptor
-from meld.system import runner
+from meld.system import runner, state
 from meld import comm, vault
+import numpy as np  #type: ignore
 from numpy.testing import assert_almost_equal  #type: ignore
 
 
@@ -24,6 +25,8 @@ class TestSingleStep(unittest.TestCase):
             self.N_REPS, self.MAX_STEPS, self.mock_ladder, self.mock_adaptor
         )
         self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.replicas_per_rank = 1
+        self.mock_comm.pipeline = False
         self.mock_comm.n_replicas = 6
         self.mock_comm.broadcast_states_to_slaves.return_value = sentinel.MY_STATE_INIT
 
@@ -229,6 +232,15 @@ class TestSingleStep(unittest.TestCase):
 
         self.mock_store.backup.assert_called_once_with(1)
 
+    def test_should_update_statistics(self):
+        "should update the running statistics with the exchanges"
+        self.mock_ladder.last_exchanges.return_value = sentinel.EXCHANGES
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.mock_store.update_statistics.assert_called_once_with(
+            1, self.mock_energy_matrix, self.PERM_VECTOR, mock.ANY, sentinel.EXCHANGES
+        )
+
 
 class TestFiveSteps(unittest.TestCase):
     def setUp(self):
@@ -243,6 +255,8 @@ class TestFiveSteps(unittest.TestCase):
             self.N_REPS, self.MAX_STEPS, self.mock_ladder, self.mock_adaptor
         )
         self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.replicas_per_rank = 1
+        self.mock_comm.pipeline = False
         self.mock_comm.n_replicas = 6
         self.mock_comm.broadcast_states_to_slaves.return_value = sentinel.MY_STATE_INIT
 
@@ -333,3 +347,495 @@ class TestFiveSteps(unittest.TestCase):
         self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
 
         self.assertEqual(self.mock_system_runner.run.call_count, 4)
+
+
+class TestNeighborEnergies(unittest.TestCase):
+    def setUp(self):
+        self.N_REPS = 3
+        self.mock_ladder = mock.Mock(spec_set=ladder.NearestNeighborLadder)
+        self.mock_ladder.compute_neighbor_exchanges.return_value = [0, 1, 2]
+        self.mock_adaptor = mock.Mock(adaptor.EqualAcceptanceAdaptor)
+        self.runner = master_runner.MasterReplicaExchangeRunner(
+            self.N_REPS,
+            1,
+            self.mock_ladder,
+            self.mock_adaptor,
+            neighbor_energies_only=True,
+        )
+
+        self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.replicas_per_rank = 1
+        self.mock_comm.pipeline = False
+        self.mock_comm.n_replicas = self.N_REPS
+        self.mock_comm.broadcast_states_to_slaves.return_value = sentinel.MY_STATE_INIT
+        self.fake_states = [mock.Mock() for _ in range(self.N_REPS)]
+        for s in self.fake_states:
+            s.velocities = 1.0
+        self.mock_comm.gather_states_from_slaves.return_value = self.fake_states
+        self.mock_comm.exchange_states_with_neighbors.return_value = (
+            None,
+            sentinel.RIGHT,
+        )
+        self.mock_energy_matrix = mock.MagicMock()
+        self.mock_comm.gather_neighbor_energies_from_slaves.return_value = (
+            self.mock_energy_matrix
+        )
+
+        self.mock_system_runner = mock.Mock(spec=runner.ReplicaRunner)
+        self.mock_system_runner.minimize_then_run.return_value = sentinel.MY_STATE
+        self.mock_system_runner.get_energy.side_effect = [sentinel.E1, sentinel.E2]
+        self.mock_system_runner.temperature_scaler = mock.MagicMock()
+        self.mock_system_runner.temperature_scaler.return_value = 1.0
+
+        self.mock_store = mock.Mock(spec_set=vault.DataStore)
+        self.mock_store.n_replicas = self.N_REPS
+        self.mock_store.load_states.return_value = sentinel.ALL_STATES
+
+    def test_gathers_states_for_storage(self):
+        "should gather the states from the slaves instead of exchanging them"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.mock_comm.gather_states_from_slaves.assert_called_once_with(
+            sentinel.MY_STATE
+        )
+        self.assertEqual(self.mock_comm.exchange_states_for_energy_calc.call_count, 0)
+
+    def test_computes_only_neighbor_energies(self):
+        "should only compute the energies of our own state and our neighbors"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.mock_system_runner.get_energy.assert_has_calls(
+            [mock.call(sentinel.MY_STATE), mock.call(sentinel.RIGHT)]
+        )
+        self.assertEqual(self.mock_system_runner.get_energy.call_count, 2)
+
+    def test_calls_neighbor_ladder(self):
+        "should use compute_neighbor_exchanges on the banded matrix"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.mock_ladder.compute_neighbor_exchanges.assert_called_once_with(
+            self.mock_energy_matrix, self.mock_adaptor
+        )
+        self.mock_store.save_energy_matrix.assert_called_once_with(
+            self.mock_energy_matrix, 1
+        )
+
+
+class TestSwapAlphas(unittest.TestCase):
+    def setUp(self):
+        self.N_REPS = 3
+        self.MAX_STEPS = 2
+        self.mock_ladder = mock.Mock(spec_set=ladder.NearestNeighborLadder)
+        self.mock_ladder.compute_exchanges.return_value = [2, 1, 0]
+        self.mock_adaptor = mock.Mock(adaptor.EqualAcceptanceAdaptor)
+        self.mock_adaptor.adapt.side_effect = lambda alphas, step: alphas
+        self.runner = master_runner.MasterReplicaExchangeRunner(
+            self.N_REPS,
+            self.MAX_STEPS,
+            self.mock_ladder,
+            self.mock_adaptor,
+            swap_alphas=True,
+        )
+
+        def gen_state(index):
+            pos = index * np.ones((2, 3))
+            vel = np.ones((2, 3))
+            return state.SystemState(pos, vel, 0.0, 0.0, np.zeros(3))
+
+        self.my_state = gen_state(0)
+        self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.replicas_per_rank = 1
+        self.mock_comm.pipeline = False
+        self.mock_comm.n_replicas = self.N_REPS
+        self.mock_comm.broadcast_states_to_slaves.return_value = self.my_state
+        self.mock_comm.exchange_states_for_energy_calc.side_effect = lambda s: [
+            gen_state(i) for i in range(self.N_REPS)
+        ]
+        self.mock_comm.gather_energies_from_slaves.return_value = np.zeros(
+            (self.N_REPS, self.N_REPS)
+        )
+
+        self.mock_system_runner = mock.Mock(spec=runner.ReplicaRunner)
+        self.mock_system_runner.minimize_then_run.side_effect = lambda s: s
+        self.mock_system_runner.run.side_effect = lambda s: s
+        self.mock_system_runner.get_energy.return_value = 0.0
+        self.mock_system_runner.temperature_scaler = mock.MagicMock()
+        self.mock_system_runner.temperature_scaler.return_value = 1.0
+
+        self.mock_store = mock.Mock(spec_set=vault.DataStore)
+        self.mock_store.n_replicas = self.N_REPS
+        self.mock_store.load_states.return_value = [
+            gen_state(i) for i in range(self.N_REPS)
+        ]
+
+    def test_raises_with_neighbor_energies_only(self):
+        "should not allow swap_alphas together with neighbor_energies_only"
+        with self.assertRaises(ValueError):
+            master_runner.MasterReplicaExchangeRunner(
+                self.N_REPS,
+                self.MAX_STEPS,
+                self.mock_ladder,
+                self.mock_adaptor,
+                neighbor_energies_only=True,
+                swap_alphas=True,
+            )
+
+    def test_states_are_only_broadcast_once(self):
+        "should only scatter the states on the first step"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.assertEqual(self.mock_comm.broadcast_states_to_slaves.call_count, 1)
+
+    def test_broadcasts_permuted_alphas(self):
+        "should send each rank the alpha of its new ladder index"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        calls = self.mock_comm.broadcast_alphas_to_slaves.call_args_list
+        assert_almost_equal(calls[0][0][0], [0.0, 0.5, 1.0])
+        assert_almost_equal(calls[1][0][0], [1.0, 0.5, 0.0])
+
+    def test_master_runs_at_its_new_alpha(self):
+        "the master should prepare for the alpha of its ladder index"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.mock_system_runner.prepare_for_timestep.assert_has_calls(
+            [mock.call(0.0, 1), mock.call(1.0, 2)]
+        )
+        self.assertEqual(self.my_state.alpha, 1.0)
+
+    def test_saves_replica_ranks(self):
+        "should save the rank holding each ladder index"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.mock_store.save_replica_ranks.assert_has_calls(
+            [mock.call([2, 1, 0], 1), mock.call([0, 1, 2], 2)]
+        )
+
+    def test_saves_states_in_ladder_order(self):
+        "the stored states should be in ladder order"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        saved_states = self.mock_store.save_states.call_args_list[0][0][0]
+        positions = [s.positions[0, 0] for s in saved_states]
+        self.assertEqual(positions, [2, 1, 0])
+
+
+class TestBatches(unittest.TestCase):
+    def setUp(self):
+        self.N_REPS = 4
+        self.MAX_STEPS = 2
+        self.mock_ladder = mock.Mock(spec_set=ladder.NearestNeighborLadder)
+        self.mock_ladder.compute_exchanges.return_value = [0, 1, 2, 3]
+        self.mock_adaptor = mock.Mock(adaptor.EqualAcceptanceAdaptor)
+        self.mock_adaptor.adapt.side_effect = lambda alphas, step: alphas
+        self.runner = master_runner.MasterReplicaExchangeRunner(
+            self.N_REPS, self.MAX_STEPS, self.mock_ladder, self.mock_adaptor
+        )
+
+        def gen_state(index):
+            pos = index * np.ones((2, 3))
+            vel = np.ones((2, 3))
+            return state.SystemState(pos, vel, 0.0, 0.0, np.zeros(3))
+
+        self.states = [gen_state(i) for i in range(self.N_REPS)]
+        self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.replicas_per_rank = 2
+        self.mock_comm.pipeline = False
+        self.mock_comm.n_replicas = self.N_REPS
+        self.mock_comm.broadcast_alpha_batches_to_slaves.return_value = [0.0, 1 / 3]
+        self.mock_comm.broadcast_state_batches_to_slaves.return_value = self.states[:2]
+        self.mock_comm.exchange_state_batches_for_energy_calc.return_value = (
+            self.states
+        )
+        self.mock_energy_matrix = mock.MagicMock()
+        self.mock_comm.gather_energy_batches_from_slaves.return_value = (
+            self.mock_energy_matrix
+        )
+
+        self.mock_system_runner = mock.Mock(spec=runner.ReplicaRunner)
+        self.mock_system_runner.minimize_then_run.side_effect = lambda s: s
+        self.mock_system_runner.run.side_effect = lambda s: s
+        self.mock_system_runner.get_energy.return_value = 0.0
+        self.mock_system_runner.temperature_scaler = mock.MagicMock()
+        self.mock_system_runner.temperature_scaler.return_value = 1.0
+
+        self.mock_store = mock.Mock(spec_set=vault.DataStore)
+        self.mock_store.n_replicas = self.N_REPS
+        self.mock_store.load_states.return_value = self.states
+
+    def test_broadcasts_batches(self):
+        "should send each rank the alphas and states of its replicas"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.assertEqual(
+            self.mock_comm.broadcast_alpha_batches_to_slaves.call_count, self.MAX_STEPS
+        )
+        self.mock_comm.broadcast_state_batches_to_slaves.assert_called_with(
+            self.states
+        )
+        self.assertEqual(self.mock_comm.broadcast_states_to_slaves.call_count, 0)
+
+    def test_runs_each_replica_on_master(self):
+        "should minimize and then run each of the master's replicas"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.assertEqual(self.mock_system_runner.minimize_then_run.call_count, 2)
+        self.assertEqual(self.mock_system_runner.run.call_count, 2)
+
+    def test_computes_energies_for_each_replica_on_master(self):
+        "should send one row of energies for each of the master's replicas"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.mock_comm.gather_energy_batches_from_slaves.assert_called_with(
+            [[0.0] * self.N_REPS] * 2
+        )
+
+    def test_saves_gathered_energies(self):
+        "should exchange and save with the gathered energy matrix"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.mock_ladder.compute_exchanges.assert_called_with(
+            self.mock_energy_matrix, self.mock_adaptor
+        )
+        self.mock_store.save_energy_matrix.assert_called_with(
+            self.mock_energy_matrix, self.MAX_STEPS
+        )
+
+    def test_raises_with_swap_alphas(self):
+        "should not allow swap_alphas with more than one replica per rank"
+        r = master_runner.MasterReplicaExchangeRunner(
+            self.N_REPS,
+            self.MAX_STEPS,
+            self.mock_ladder,
+            self.mock_adaptor,
+            swap_alphas=True,
+        )
+
+        with self.assertRaises(RuntimeError):
+            r.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.N_REPS = 3
+        self.mock_ladder = mock.Mock(spec_set=ladder.NearestNeighborLadder)
+        self.mock_ladder.compute_exchanges.return_value = [0, 1, 2]
+        self.mock_adaptor = mock.Mock(adaptor.EqualAcceptanceAdaptor)
+        self.runner = master_runner.MasterReplicaExchangeRunner(
+            self.N_REPS, 1, self.mock_ladder, self.mock_adaptor
+        )
+
+        def gen_state(index):
+            pos = index * np.ones((2, 3))
+            vel = np.ones((2, 3))
+            return state.SystemState(pos, vel, 0.0, 0.0, np.zeros(3))
+
+        self.states = [gen_state(i) for i in range(self.N_REPS)]
+        self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.replicas_per_rank = 1
+        self.mock_comm.pipeline = True
+        self.mock_comm.n_replicas = self.N_REPS
+        self.mock_comm.broadcast_states_to_slaves.return_value = self.states[0]
+        self.mock_comm.iter_states_for_energy_calc.return_value = iter(
+            [(0, self.states[0]), (2, self.states[2]), (1, self.states[1])]
+        )
+        self.mock_energy_matrix = mock.MagicMock()
+        self.mock_comm.gather_energies_from_slaves.return_value = (
+            self.mock_energy_matrix
+        )
+
+        self.mock_system_runner = mock.Mock(spec=runner.ReplicaRunner)
+        self.mock_system_runner.minimize_then_run.side_effect = lambda s: s
+        self.mock_system_runner.get_energy.side_effect = lambda s: s.positions[0, 0]
+        self.mock_system_runner.temperature_scaler = mock.MagicMock()
+        self.mock_system_runner.temperature_scaler.return_value = 1.0
+
+        self.mock_store = mock.Mock(spec_set=vault.DataStore)
+        self.mock_store.n_replicas = self.N_REPS
+        self.mock_store.load_states.return_value = self.states
+
+    def test_gathers_energies_in_rank_order(self):
+        "should send the energies in rank order, whatever order they arrive in"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.mock_comm.gather_energies_from_slaves.assert_called_once_with(
+            [0.0, 1.0, 2.0]
+        )
+
+    def test_saves_states_in_rank_order(self):
+        "should store the states in rank order"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        saved_states = self.mock_store.save_states.call_args[0][0]
+        positions = [s.positions[0, 0] for s in saved_states]
+        self.assertEqual(positions, [0, 1, 2])
+
+    def test_does_not_exchange_all_states_at_once(self):
+        "should not use the blocking exchange"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.assertEqual(self.mock_comm.exchange_states_for_energy_calc.call_count, 0)
+
+
+class TestPeerExchange(unittest.TestCase):
+    def setUp(self):
+        self.N_REPS = 3
+        self.MAX_STEPS = 2
+        self.mock_ladder = mock.Mock(spec_set=ladder.NearestNeighborLadder)
+        self.mock_ladder.record_peer_exchanges.return_value = [0, 1, 2]
+        self.mock_adaptor = mock.Mock(adaptor.EqualAcceptanceAdaptor)
+        self.mock_adaptor.adapt.side_effect = lambda alphas, step: alphas
+        self.runner = master_runner.MasterReplicaExchangeRunner(
+            self.N_REPS,
+            self.MAX_STEPS,
+            self.mock_ladder,
+            self.mock_adaptor,
+            peer_exchange=True,
+        )
+
+        def gen_state(index):
+            pos = index * np.ones((2, 3))
+            vel = np.ones((2, 3))
+            return state.SystemState(pos, vel, 0.0, 0.0, np.zeros(3))
+
+        self.my_state = gen_state(0)
+        self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.replicas_per_rank = 1
+        self.mock_comm.pipeline = False
+        self.mock_comm.rank = 0
+        self.mock_comm.n_replicas = self.N_REPS
+        self.mock_comm.broadcast_states_to_slaves.return_value = self.my_state
+        # the master has no partner on odd steps, and swaps with rank 1 on
+        # even steps, which sees the master's structure at a lower energy
+        self.mock_comm.exchange_state_with_partner.side_effect = (
+            lambda s, partner: None if partner is None else gen_state(1)
+        )
+        self.mock_comm.exchange_energies_with_partner.side_effect = (
+            lambda e, partner: None if partner is None else [1.0, -1.0]
+        )
+        self.mock_comm.gather_states_from_slaves.side_effect = lambda s: [
+            s,
+            gen_state(1),
+            gen_state(2),
+        ]
+        nan = np.nan
+        self.mock_comm.gather_exchange_records_from_slaves.return_value = np.array(
+            [[0.0, nan, -1.0, -1.0], [1.0, 5.0, 2.0, 0.0], [2.0, 6.0, 1.0, 0.0]]
+        )
+
+        self.mock_system_runner = mock.Mock(spec=runner.ReplicaRunner)
+        self.mock_system_runner.minimize_then_run.side_effect = lambda s: s
+        self.mock_system_runner.run.side_effect = lambda s: s
+        self.mock_system_runner.get_energy.side_effect = lambda s: s.positions[0, 0]
+        self.mock_system_runner.temperature_scaler = mock.MagicMock()
+        self.mock_system_runner.temperature_scaler.return_value = 1.0
+
+        self.mock_store = mock.Mock(spec_set=vault.DataStore)
+        self.mock_store.n_replicas = self.N_REPS
+        self.mock_store.load_states.return_value = [
+            gen_state(i) for i in range(self.N_REPS)
+        ]
+
+    def test_raises_with_swap_alphas(self):
+        "should not allow peer_exchange together with swap_alphas"
+        with self.assertRaises(ValueError):
+            master_runner.MasterReplicaExchangeRunner(
+                self.N_REPS,
+                self.MAX_STEPS,
+                self.mock_ladder,
+                self.mock_adaptor,
+                swap_alphas=True,
+                peer_exchange=True,
+            )
+
+    def test_states_are_only_broadcast_once(self):
+        "should only scatter the states on the first step"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.assertEqual(self.mock_comm.broadcast_states_to_slaves.call_count, 1)
+
+    def test_does_not_compute_exchanges(self):
+        "should neither gather the energies nor decide the exchanges"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.assertEqual(self.mock_comm.gather_energies_from_slaves.call_count, 0)
+        self.assertEqual(self.mock_ladder.compute_exchanges.call_count, 0)
+
+    def test_takes_structure_of_partner(self):
+        "should continue with the structure of its partner after a swap"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        self.mock_comm.gather_exchange_records_from_slaves.assert_called_with(
+            [0.0, 1.0, 1.0, 1.0]
+        )
+        saved_states = self.mock_store.save_states.call_args[0][0]
+        self.assertEqual(saved_states[0].positions[0, 0], 1.0)
+
+    def test_records_exchanges_from_records(self):
+        "should build the banded energies and outcomes from the records"
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        energies, accepted, _ = self.mock_ladder.record_peer_exchanges.call_args[0]
+        nan = np.nan
+        np.testing.assert_equal(
+            energies, [[0.0, nan, nan], [nan, 1.0, 5.0], [nan, 6.0, 2.0]]
+        )
+        np.testing.assert_equal(accepted, [-1, 0])
+        self.mock_store.save_energy_matrix.assert_called_with(energies, 2)
+
+    def test_raises_with_state_interval_without_peer_exchange(self):
+        "should only allow state_interval with peer_exchange"
+        with self.assertRaises(ValueError):
+            master_runner.MasterReplicaExchangeRunner(
+                self.N_REPS,
+                self.MAX_STEPS,
+                self.mock_ladder,
+                self.mock_adaptor,
+                state_interval=2,
+            )
+
+    def test_only_gathers_states_every_state_interval(self):
+        "should only gather and checkpoint the states every state_interval steps"
+        self.runner = master_runner.MasterReplicaExchangeRunner(
+            self.N_REPS,
+            5,
+            self.mock_ladder,
+            self.mock_adaptor,
+            peer_exchange=True,
+            state_interval=2,
+        )
+        self.mock_store.storage_policy = vault.StoragePolicy(
+            position_interval=2, velocity_interval=None
+        )
+        self.mock_store.block_size = 4
+
+        self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
+
+        # steps 2, 4, and the last step
+        self.assertEqual(self.mock_comm.gather_states_from_slaves.call_count, 3)
+        self.assertEqual(self.mock_store.save_states.call_count, 3)
+        self.assertEqual(self.mock_store.save_remd_runner.call_count, 3)
+        self.assertEqual(self.mock_store.save_data_store.call_count, 3)
+        partial = self.mock_store.save_partial_states.call_args_list
+        self.assertEqual([c[0][1] for c in partial], [1, 3])
+        states = partial[0][0][0]
+        self.assertIs(states[0], self.my_state)
+        self.assertEqual(states[1:], [None, None])
+        records = self.mock_comm.gather_exchange_records_from_slaves
+        self.assertEqual(records.call_count, 5)
+
+    def test_checks_storage_policy_with_state_interval(self):
+        "should raise if the policy needs states that are not gathered"
+        self.runner = master_runner.MasterReplicaExchangeRunner(
+            self.N_REPS,
+            5,
+            self.mock_ladder,
+            self.mock_adaptor,
+            peer_exchange=True,
+            state_interval=2,
+        )
+        self.mock_store.storage_policy = vault.StoragePolicy()
+        self.mock_store.block_size = 4
+
+        with self.assertRaises(RuntimeError):
+            self.runner.run(self.mock_comm, self.mock_system_runner, self.mock_store)
@@ -3,10 +3,12 @@
 # All rights reserved
 #
 
+import math
 import unittest
+import numpy as np  #type: ignore
 from unittest import mock  #type: ignore
 from meld.remd import slave_runner, master_runner
-from meld.system import runner
+from meld.system import runner, state
 from meld import comm
 
 
@@ -20,6 +22,8 @@ class TestSlaveInitFromMaster(unittest.TestCase):
         self.mock_master = mock.Mock(spec_set=master_runner.MasterReplicaExchangeRunner)
         self.mock_master.step = 42
         self.mock_master.max_steps = 43
+        self.mock_master.exchange_seed = 44
+        self.mock_master.state_interval = 45
 
     def test_sets_step(self):
         "creating slave from_master should set the step"
@@ -33,12 +37,26 @@ class TestSlaveInitFromMaster(unittest.TestCase):
 
         self.assertEqual(slave.max_steps, 43)
 
+    def test_sets_exchange_seed(self):
+        "creating slave from_master should share the seed for peer exchange"
+        slave = slave_runner.SlaveReplicaExchangeRunner.from_master(self.mock_master)
+
+        self.assertEqual(slave.exchange_seed, 44)
+
+    def test_sets_state_interval(self):
+        "creating slave from_master should set the state interval"
+        slave = slave_runner.SlaveReplicaExchangeRunner.from_master(self.mock_master)
+
+        self.assertEqual(slave.state_interval, 45)
+
 
 class TestSlaveSingle(unittest.TestCase):
     "Make sure the SlaveReplicaExchangeRunner works for a single round"
 
     def setUp(self):
         self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.replicas_per_rank = 1
+        self.mock_comm.pipeline = False
         self.mock_comm.receive_alpha_from_master.return_value = sentinel.ALPHA
         self.mock_comm.receive_state_from_master.return_value = mock.sentinel.STATE
         self.mock_comm.receive_states_for_energy_calc_from_master.return_value = [
@@ -142,6 +160,8 @@ class TestSlaveMultiple(unittest.TestCase):
 
     def setUp(self):
         self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.replicas_per_rank = 1
+        self.mock_comm.pipeline = False
         self.mock_comm.receive_states_for_energy_calc_from_master.return_value = [
             sentinel.STATE_1,
             sentinel.STATE_2,
@@ -198,3 +218,276 @@ class TestSlaveMultiple(unittest.TestCase):
         self.runner.run(self.mock_comm, self.mock_system_runner)
 
         self.assertEqual(self.mock_system_runner.run.call_count, 3)
+
+
+class TestSlaveNeighborEnergies(unittest.TestCase):
+    "Make sure the SlaveReplicaExchangeRunner only computes neighbor energies"
+
+    def setUp(self):
+        self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.replicas_per_rank = 1
+        self.mock_comm.pipeline = False
+        self.mock_comm.receive_alpha_from_master.return_value = sentinel.ALPHA
+        self.mock_comm.receive_state_from_master.return_value = sentinel.STATE
+        self.mock_comm.exchange_states_with_neighbors.return_value = (
+            sentinel.LEFT,
+            None,
+        )
+        self.mock_system_runner = mock.Mock(spec_set=runner.ReplicaRunner)
+        self.mock_system_runner.minimize_then_run.return_value = sentinel.STATE
+        self.mock_system_runner.get_energy.side_effect = [sentinel.E1, sentinel.E2]
+        self.runner = slave_runner.SlaveReplicaExchangeRunner(
+            step=1, max_steps=1, neighbor_energies_only=True
+        )
+
+    def test_sends_state_to_master(self):
+        "should send the state to the master for storage"
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.mock_comm.send_state_to_master.assert_called_once_with(sentinel.STATE)
+
+    def test_does_not_exchange_all_states(self):
+        "should not gather every state"
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.assertEqual(self.mock_comm.exchange_states_for_energy_calc.call_count, 0)
+
+    def test_sends_neighbor_energies(self):
+        "should send the left, own, and right energies, with NaN if missing"
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        energies = self.mock_comm.send_neighbor_energies_to_master.call_args[0][0]
+        self.assertEqual(energies[:2], [sentinel.E1, sentinel.E2])
+        self.assertTrue(math.isnan(energies[2]))
+
+
+class TestSlaveSwapAlphas(unittest.TestCase):
+    "Make sure the SlaveReplicaExchangeRunner keeps its state when swapping alphas"
+
+    def setUp(self):
+        self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.replicas_per_rank = 1
+        self.mock_comm.pipeline = False
+        self.mock_comm.receive_alpha_from_master.side_effect = [0.0, 1.0]
+        self.state = mock.Mock()
+        self.state.velocities = 1.0
+        self.mock_comm.receive_state_from_master.return_value = self.state
+        self.mock_comm.exchange_states_for_energy_calc.return_value = [self.state]
+
+        self.mock_system_runner = mock.Mock(spec=runner.ReplicaRunner)
+        self.mock_system_runner.minimize_then_run.side_effect = lambda s: s
+        self.mock_system_runner.run.side_effect = lambda s: s
+        self.mock_system_runner.temperature_scaler = mock.Mock()
+        self.mock_system_runner.temperature_scaler.side_effect = (
+            lambda alpha: 300.0 + 300.0 * alpha
+        )
+        self.runner = slave_runner.SlaveReplicaExchangeRunner(
+            step=1, max_steps=2, swap_alphas=True
+        )
+
+    def test_receives_state_once(self):
+        "should only receive a state from the master on the first step"
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.assertEqual(self.mock_comm.receive_state_from_master.call_count, 1)
+
+    def test_rescales_velocities(self):
+        "should rescale the velocities to the temperature of the new alpha"
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.assertAlmostEqual(self.state.velocities, math.sqrt(2.0))
+        self.assertEqual(self.state.alpha, 1.0)
+
+
+class TestSlaveBatches(unittest.TestCase):
+    "Make sure the SlaveReplicaExchangeRunner runs a batch of replicas"
+
+    def setUp(self):
+        self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.replicas_per_rank = 2
+        self.mock_comm.pipeline = False
+        self.mock_comm.receive_alpha_batch_from_master.return_value = [0.5, 1.0]
+        self.states = [mock.Mock(), mock.Mock()]
+        self.mock_comm.receive_state_batch_from_master.return_value = self.states
+        self.mock_comm.exchange_state_batches_for_energy_calc.return_value = [
+            sentinel.STATE_1,
+            sentinel.STATE_2,
+            sentinel.STATE_3,
+            sentinel.STATE_4,
+        ]
+
+        self.mock_system_runner = mock.Mock(spec_set=runner.ReplicaRunner)
+        self.mock_system_runner.minimize_then_run.side_effect = lambda s: s
+        self.mock_system_runner.run.side_effect = lambda s: s
+        self.mock_system_runner.get_energy.side_effect = range(16)
+        self.runner = slave_runner.SlaveReplicaExchangeRunner(step=1, max_steps=2)
+
+    def test_runs_each_replica(self):
+        "should minimize each replica on the first step, then run them"
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.assertEqual(self.mock_system_runner.minimize_then_run.call_count, 2)
+        self.assertEqual(self.mock_system_runner.run.call_count, 2)
+
+    def test_sets_alpha_of_each_replica(self):
+        "should prepare the runner and state for each replica's alpha"
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.assertEqual(self.states[0].alpha, 0.5)
+        self.assertEqual(self.states[1].alpha, 1.0)
+        self.mock_system_runner.prepare_for_timestep.assert_has_calls(
+            [mock.call(0.5, 1), mock.call(1.0, 1)]
+        )
+
+    def test_sends_energy_batches(self):
+        "should send one row of energies for each replica"
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.mock_comm.send_energy_batches_to_master.assert_has_calls(
+            [
+                mock.call([[0, 1, 2, 3], [4, 5, 6, 7]]),
+                mock.call([[8, 9, 10, 11], [12, 13, 14, 15]]),
+            ]
+        )
+
+    def test_does_not_use_single_replica_methods(self):
+        "should not receive single states"
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.assertEqual(self.mock_comm.receive_state_from_master.call_count, 0)
+        self.assertEqual(self.mock_comm.send_energies_to_master.call_count, 0)
+
+
+class TestSlavePipeline(unittest.TestCase):
+    "Make sure the SlaveReplicaExchangeRunner computes energies as states arrive"
+
+    def setUp(self):
+        self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.replicas_per_rank = 1
+        self.mock_comm.pipeline = True
+        self.mock_comm.n_replicas = 3
+        self.mock_comm.receive_alpha_from_master.return_value = sentinel.ALPHA
+        self.mock_comm.receive_state_from_master.return_value = mock.Mock()
+        # our own state comes first, then the others as they arrive
+        self.mock_comm.iter_states_for_energy_calc.side_effect = lambda state: iter(
+            [(1, sentinel.STATE_1), (2, sentinel.STATE_2), (0, sentinel.STATE_0)]
+        )
+
+        self.mock_system_runner = mock.Mock(spec_set=runner.ReplicaRunner)
+        self.mock_system_runner.minimize_then_run.side_effect = lambda s: s
+        energies = {
+            sentinel.STATE_0: sentinel.E0,
+            sentinel.STATE_1: sentinel.E1,
+            sentinel.STATE_2: sentinel.E2,
+        }
+        self.mock_system_runner.get_energy.side_effect = lambda s: energies[s]
+        self.runner = slave_runner.SlaveReplicaExchangeRunner(step=1, max_steps=1)
+
+    def test_sends_energies_in_rank_order(self):
+        "should send the energies in rank order, whatever order they arrive in"
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.mock_comm.send_energies_to_master.assert_called_once_with(
+            [sentinel.E0, sentinel.E1, sentinel.E2]
+        )
+
+    def test_does_not_exchange_all_states_at_once(self):
+        "should not use the blocking exchange"
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.assertEqual(self.mock_comm.exchange_states_for_energy_calc.call_count, 0)
+
+    def test_waits_for_sends(self):
+        "should wait for the last energies to be sent before finishing"
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.mock_comm.wait_for_sends.assert_called_once_with()
+
+
+class TestSlavePeerExchange(unittest.TestCase):
+    "Make sure the SlaveReplicaExchangeRunner exchanges with its partner"
+
+    def setUp(self):
+        def gen_state(index, alpha):
+            pos = index * np.ones((2, 3))
+            vel = np.ones((2, 3))
+            return state.SystemState(pos, vel, alpha, float(index), np.zeros(3))
+
+        # rank 2 is paired with rank 1 on odd steps
+        self.my_state = gen_state(2, 0.0)
+        self.partner_state = gen_state(1, 1.0)
+        self.mock_comm = mock.Mock(spec_set=comm.MPICommunicator)
+        self.mock_comm.replicas_per_rank = 1
+        self.mock_comm.pipeline = False
+        self.mock_comm.rank = 2
+        self.mock_comm.n_replicas = 3
+        self.mock_comm.receive_alpha_from_master.return_value = 0.0
+        self.mock_comm.receive_state_from_master.return_value = self.my_state
+        self.mock_comm.exchange_state_with_partner.return_value = self.partner_state
+
+        self.mock_system_runner = mock.Mock(spec=runner.ReplicaRunner)
+        self.mock_system_runner.minimize_then_run.side_effect = lambda s: s
+        self.mock_system_runner.get_energy.side_effect = lambda s: s.positions[0, 0]
+        self.mock_system_runner.temperature_scaler = mock.Mock()
+        self.mock_system_runner.temperature_scaler.side_effect = (
+            lambda alpha: 300.0 + 300.0 * alpha
+        )
+        self.runner = slave_runner.SlaveReplicaExchangeRunner(
+            step=1, max_steps=1, peer_exchange=True
+        )
+
+    def test_accepted_swap(self):
+        "should take the structure of the partner and rescale the velocities"
+        self.mock_comm.exchange_energies_with_partner.return_value = [1.0, 0.0]
+
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.mock_comm.exchange_state_with_partner.assert_called_once_with(
+            self.my_state, 1
+        )
+        self.mock_comm.exchange_energies_with_partner.assert_called_once_with(
+            [2.0, 1.0], 1
+        )
+        self.mock_comm.send_exchange_record_to_master.assert_called_once_with(
+            [2.0, 1.0, 1.0, 1.0]
+        )
+        sent = self.mock_comm.send_state_to_master.call_args[0][0]
+        self.assertEqual(sent.positions[0, 0], 1.0)
+        self.assertAlmostEqual(sent.velocities[0, 0], math.sqrt(0.5))
+        self.assertEqual(sent.alpha, 0.0)
+        self.assertEqual(sent.energy, 1.0)
+
+    def test_rejected_swap(self):
+        "should keep its own structure if the swap is rejected"
+        self.mock_comm.exchange_energies_with_partner.return_value = [1.0, 100.0]
+
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.mock_comm.send_exchange_record_to_master.assert_called_once_with(
+            [2.0, 1.0, 1.0, 0.0]
+        )
+        sent = self.mock_comm.send_state_to_master.call_args[0][0]
+        self.assertEqual(sent.positions[0, 0], 2.0)
+
+    def test_does_not_exchange_all_states(self):
+        "should not send energies to the master"
+        self.mock_comm.exchange_energies_with_partner.return_value = [1.0, 0.0]
+
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        self.assertEqual(self.mock_comm.exchange_states_for_energy_calc.call_count, 0)
+        self.assertEqual(self.mock_comm.send_energies_to_master.call_count, 0)
+
+    def test_only_sends_state_every_state_interval(self):
+        "should only send its state on the steps where states are gathered"
+        self.mock_comm.exchange_energies_with_partner.return_value = [1.0, 0.0]
+        self.mock_system_runner.run.side_effect = lambda s: s
+        self.runner = slave_runner.SlaveReplicaExchangeRunner(
+            step=1, max_steps=5, peer_exchange=True, state_interval=2
+        )
+
+        self.runner.run(self.mock_comm, self.mock_system_runner)
+
+        # steps 2, 4, and the last step
+        self.assertEqual(self.mock_comm.send_state_to_master.call_count, 3)
+        self.assertEqual(self.mock_comm.send_exchange_record_to_master.call_count, 5)
@@ -0,0 +1,101 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+import unittest
+import numpy as np  #type: ignore
+from numpy.testing import assert_almost_equal, assert_equal  #type: ignore
+from meld.remd import statistics
+from meld.remd.ladder import ExchangeCounts
+
+
+def no_exchanges(n_replicas):
+    return ExchangeCounts(np.zeros(n_replicas - 1), np.zeros(n_replicas - 1))
+
+
+class TestRunningStatistics(unittest.TestCase):
+    def setUp(self):
+        self.N_REPS = 3
+        self.stats = statistics.RunningStatistics(self.N_REPS)
+        self.identity = list(range(self.N_REPS))
+        self.alphas = [0.0, 0.5, 1.0]
+
+    def test_energy_mean_and_variance(self):
+        "should match the mean and variance of the diagonal energies"
+        diagonals = np.random.normal(size=(10, self.N_REPS))
+        for stage, diagonal in enumerate(diagonals, start=1):
+            self.stats.update(
+                stage,
+                np.diag(diagonal),
+                self.identity,
+                self.alphas,
+                no_exchanges(self.N_REPS),
+            )
+
+        self.assertEqual(self.stats.n_stages, 10)
+        assert_almost_equal(self.stats.energy_mean, diagonals.mean(axis=0))
+        assert_almost_equal(self.stats.energy_variance, diagonals.var(axis=0, ddof=1))
+
+    def test_accumulates_exchanges(self):
+        "should add up the swaps from every stage"
+        for stage in [1, 2]:
+            self.stats.update(
+                stage,
+                np.zeros((3, 3)),
+                self.identity,
+                self.alphas,
+                ExchangeCounts(np.array([1, 1]), np.array([1, 0])),
+            )
+
+        assert_equal(self.stats.attempts, [2, 2])
+        assert_equal(self.stats.successes, [2, 0])
+        assert_almost_equal(self.stats.acceptance_probabilities, [1.0, 0.0])
+
+    def test_counts_round_trips(self):
+        "walker 0 should complete a round trip after going up and back down"
+        # walker 0 moves 0 -> 1 -> 2 -> 1 -> 0
+        perms = [[1, 0, 2], [0, 2, 1], [0, 2, 1], [1, 0, 2]]
+        for stage, perm in enumerate(perms, start=1):
+            self.stats.update(
+                stage,
+                np.zeros((3, 3)),
+                perm,
+                self.alphas,
+                no_exchanges(self.N_REPS),
+            )
+
+        assert_equal(self.stats.walker_index[0], 0)
+        self.assertEqual(self.stats.round_trips[0], 1)
+        self.assertEqual(self.stats.walker_direction[0], 1)
+        self.assertEqual(self.stats.f_up[0], 1.0)
+        self.assertEqual(self.stats.f_up[2], 0.0)
+
+    def test_records_alpha_changes(self):
+        "should only record the alphas when they change"
+        for stage, alphas in enumerate([[0, 1, 2], [0, 1, 2], [0, 1.5, 2]], start=1):
+            self.stats.update(
+                stage,
+                np.zeros((3, 3)),
+                self.identity,
+                alphas,
+                no_exchanges(self.N_REPS),
+            )
+
+        self.assertEqual(
+            self.stats.alpha_history, [(1, [0.0, 1.0, 2.0]), (3, [0.0, 1.5, 2.0])]
+        )
+
+    def test_ignores_repeated_stages(self):
+        "should ignore stages that were already added"
+        for stage in [1, 1]:
+            self.stats.update(
+                stage,
+                np.ones((3, 3)),
+                self.identity,
+                self.alphas,
+                no_exchanges(self.N_REPS),
+            )
+
+        self.assertEqual(self.stats.n_stages, 1)
+        self.assertEqual(self.stats.last_stage, 1)
@@ -0,0 +1,232 @@
+#
+# Copyright 2015 by Justin MacCallum, Alberto Perez, Ken Dill
+# All rights reserved
+#
+
+"""
+Writers for the trajectory that is saved as the simulation runs.
+
+The trajectory follows the structure at the lowest replica index and is
+written by :meth:`DataStore.append_traj`. The full data for every replica
+is always available from the netcdf files, so these writers are meant for
+monitoring the run.
+
+"""
+
+import os
+import struct
+import numpy as np  # type: ignore
+from meld.pdb_writer import PDBWriter
+from typing import BinaryIO, Optional, Sequence, Tuple
+
+
+class TrajectoryWriter:
+    """
+    Base class for trajectory writers.
+
+    :param path: path of the trajectory file
+    :param atoms: optional list of atom indices to write
+    :param stride: only write stages that are a multiple of stride
+
+    Writers are pickled along with the :class:`DataStore`, so any open
+    files must be excluded from pickling and re-opened when needed.
+
+    """
+
+    def __init__(
+        self, path: str, atoms: Optional[Sequence[int]] = None, stride: int = 1
+    ) -> None:
+        if stride < 1:
+            raise ValueError("stride must be at least 1")
+        self.path = path
+        self.atoms = None if atoms is None else list(atoms)
+        self.stride = stride
+
+    def write(self, positions: np.ndarray, stage: int) -> None:
+        """
+        Write a frame to the trajectory.
+
+        :param positions: n_atoms x 3 array
+        :param stage: int stage being written
+
+        """
+        if stage % self.stride:
+            return
+        if self.atoms is not None:
+            positions = positions[self.atoms, :]
+        self._write_frame(positions, stage)
+
+    def close(self) -> None:
+        """Close the trajectory file."""
+        pass
+
+    def _write_frame(self, positions: np.ndarray, stage: int) -> None:
+        raise NotImplementedError()
+
+
+class PDBTrajectoryWriter(TrajectoryWriter):
+    """
+    Write the trajectory as a multi-model PDB file.
+
+    :param pdb_writer: PDBWriter used to format each frame
+    :param path: path of the trajectory file
+
+    The file is opened and closed for each frame. This is slow for large
+    systems, see :class:`DCDTrajectoryWriter`.
+
+    """
+
+    def __init__(
+        self,
+        pdb_writer: PDBWriter,
+        path: str = os.path.join("Data", "trajectory.pdb"),
+        stride: int = 1,
+    ) -> None:
+        super(PDBTrajectoryWriter, self).__init__(path, stride=stride)
+        self.pdb_writer = pdb_writer
+
+    def _write_frame(self, positions: np.ndarray, stage: int) -> None:
+        pdb_string = self.pdb_writer.get_pdb_string(positions, stage)
+        with open(self.path, "a") as traj_file:
+            traj_file.write(pdb_string)
+
+
+class DCDTrajectoryWriter(TrajectoryWriter):
+    """
+    Write the trajectory as a binary DCD file.
+
+    :param path: path of the trajectory file
+    :param atoms: optional list of atom indices to write
+    :param stride: only write stages that are a multiple of stride
+
+    The file is kept open between frames, and the frame count in the header
+    is updated after each frame, so the file can be read while the
+    simulation is running. Positions are written in Angstrom, as single
+    precision. If the file already exists, e.g. after a restart, new frames
+    are appended to it.
+
+    """
+
+    # offsets of the frame count and the last step in the header
+    _n_frames_offset = 8
+    _last_step_offset = 20
+
+    def __init__(
+        self,
+        path: str = os.path.join("Data", "trajectory.dcd"),
+        atoms: Optional[Sequence[int]] = None,
+        stride: int = 1,
+    ) -> None:
+        super(DCDTrajectoryWriter, self).__init__(path, atoms, stride)
+        self._file: Optional[BinaryIO] = None
+        # set from the header when the file is opened
+        self._n_atoms = 0
+        self._n_frames = 0
+
+    def __getstate__(self):
+        # don't pickle the open file
+        excluded = ["_file"]
+        return dict((k, v) for (k, v) in self.__dict__.items() if k not in excluded)
+
+    def __setstate__(self, state):
+        self.__dict__ = state
+        self._file = None
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write_frame(self, positions: np.ndarray, stage: int) -> None:
+        dcd_file = self._file
+        if dcd_file is None:
+            dcd_file = self._open(positions.shape[0], stage)
+        if positions.shape[0] != self._n_atoms:
+            raise ValueError(
+                f"Expected {self._n_atoms} atoms in the trajectory, "
+                f"but got {positions.shape[0]}"
+            )
+
+        coords = np.asarray(positions, dtype="<f4")
+        n_bytes = struct.pack("<i", 4 * self._n_atoms)
+        dcd_file.seek(0, os.SEEK_END)
+        for dim in range(3):
+            dcd_file.write(n_bytes)
+            dcd_file.write(coords[:, dim].tobytes())
+            dcd_file.write(n_bytes)
+        self._n_frames += 1
+
+        # update the header so the file is always readable
+        dcd_file.seek(self._n_frames_offset)
+        dcd_file.write(struct.pack("<i", self._n_frames))
+        dcd_file.seek(self._last_step_offset)
+        dcd_file.write(struct.pack("<i", stage))
+        dcd_file.flush()
+
+    def _open(self, n_atoms: int, stage: int) -> BinaryIO:
+        if os.path.exists(self.path):
+            dcd_file = open(self.path, "r+b")
+            self._n_frames, self._n_atoms = _read_dcd_header(dcd_file)
+            # drop any partial frame left by a crash
+            frame_size = 3 * (4 * self._n_atoms + 8)
+            dcd_file.truncate(dcd_file.tell() + self._n_frames * frame_size)
+        else:
+            dcd_file = open(self.path, "w+b")
+            self._n_frames = 0
+            self._n_atoms = n_atoms
+            self._write_header(dcd_file, stage)
+        self._file = dcd_file
+        return dcd_file
+
+    def _write_header(self, dcd_file: BinaryIO, first_stage: int) -> None:
+        control = [0] * 20
+        control[1] = first_stage
+        control[2] = self.stride
+        control[3] = first_stage
+        # CHARMM version, needed by most readers
+        control[19] = 24
+        header = b"CORD" + struct.pack("<20i", *control)
+        dcd_file.write(_record(header))
+
+        title = b"REMARKS MELD trajectory".ljust(80)
+        dcd_file.write(_record(struct.pack("<i", 1) + title))
+        dcd_file.write(_record(struct.pack("<i", self._n_atoms)))
+
+
+def read_dcd(path: str) -> np.ndarray:
+    """
+    Read a DCD file written by :class:`DCDTrajectoryWriter`.
+
+    :param path: path of the trajectory file
+    :return: n_frames x n_atoms x 3 array of positions in Angstrom
+
+    """
+    with open(path, "rb") as dcd_file:
+        n_frames, n_atoms = _read_dcd_header(dcd_file)
+        dtype = np.dtype(
+            [("start", "<i4"), ("coords", "<f4", n_atoms), ("end", "<i4")]
+        )
+        frames = np.fromfile(dcd_file, dtype=dtype, count=3 * n_frames)
+    coords = frames["coords"].reshape(n_frames, 3, n_atoms)
+    return coords.transpose(0, 2, 1)
+
+
+def _record(payload: bytes) -> bytes:
+    # fortran unformatted records have their length before and after
+    size = struct.pack("<i", len(payload))
+    return size + payload + size
+
+
+def _read_dcd_header(dcd_file: BinaryIO) -> Tuple[int, int]:
+    # returns the number of frames and atoms, leaving the file
+    # positioned at the start of the first frame
+    dcd_file.seek(0)
+    size, magic = struct.unpack("<i4s", dcd_file.read(8))
+    if size != 84 or magic != b"CORD":
+        raise RuntimeError(f"{dcd_file.name} is not a DCD file")
+    n_frames = struct.unpack("<i", dcd_file.read(4))[0]
+    dcd_file.seek(4 + 84 + 4)
+    size = struct.unpack("<i", dcd_file.read(4))[0]
+    dcd_file.seek(size + 4, os.SEEK_CUR)
+    n_atoms = struct.unpack("<iii", dcd_file.read(12))[1]
+    return n_frames, n_atoms
@@ -3,14 +3,179 @@
 # All rights reserved
 #
 
+import collections
+import concurrent.futures
 import contextlib
+import copy
+import json
 import os
+import queue
+import threading
 import time
 import pickle
+import zlib
+import multiprocessing as mp
 import netCDF4 as cdf  #type: ignore
 import numpy as np #type: ignore
-import shutil
 from meld.system import state
+from meld.remd import ladder, statistics
+from meld import checkpoint, storage, trajectory
+
+
+class StorageProfile:
+    """
+    Settings controlling how data is stored in the netcdf files.
+
+    :param name: name recorded in the file metadata
+    :param float_type: numpy type used for positions, velocities, and box
+        vectors, e.g. ``"f8"`` or ``"f4"``
+    :param complevel: zlib compression level from 0 to 9, 0 disables
+        compression
+    :param fletcher32: store checksums for each chunk
+    :param position_precision: if set, positions are stored as 32-bit
+        fixed-point integers with this precision (in Angstrom)
+    :param chunk_stages: if set, the number of stages in each chunk. Per-atom
+        variables are then chunked one replica at a time.
+
+    The other variables (alphas, energies, etc) are always stored as double
+    precision. Fixed-point positions are decoded by netcdf when reading, so
+    readers do not need to know which profile was used.
+
+    """
+
+    def __init__(
+        self,
+        name,
+        float_type="f8",
+        complevel=9,
+        fletcher32=True,
+        position_precision=None,
+        chunk_stages=None,
+    ):
+        if not 0 <= complevel <= 9:
+            raise ValueError("complevel must be between 0 and 9")
+        if position_precision is not None and position_precision <= 0:
+            raise ValueError("position_precision must be positive")
+        self.name = name
+        self.float_type = np.dtype(float_type).str
+        self.complevel = complevel
+        self.fletcher32 = fletcher32
+        self.position_precision = position_precision
+        self.chunk_stages = chunk_stages
+
+    def to_attributes(self):
+        """Return a dict of attributes to store in the netcdf file."""
+        attributes = {
+            "storage_profile": self.name,
+            "storage_float_type": self.float_type,
+            "storage_complevel": self.complevel,
+            "storage_fletcher32": int(self.fletcher32),
+        }
+        if self.position_precision is not None:
+            attributes["storage_position_precision"] = self.position_precision
+        if self.chunk_stages is not None:
+            attributes["storage_chunk_stages"] = self.chunk_stages
+        return attributes
+
+
+STORAGE_PROFILES = {
+    # double precision with maximum compression
+    "default": StorageProfile("default"),
+    # single precision without compression or checksums
+    "fast": StorageProfile("fast", float_type="f4", complevel=0, fletcher32=False),
+    # single precision with light compression
+    "balanced": StorageProfile("balanced", float_type="f4", complevel=1),
+    # fixed-point positions with maximum compression
+    "archive": StorageProfile(
+        "archive", float_type="f4", position_precision=1e-3, chunk_stages=10
+    ),
+}
+
+
+class StoragePolicy:
+    """
+    Controls which parts of each state are stored in the netcdf files.
+
+    :param position_interval: store the positions of every replica every
+        this many stages
+    :param full_replicas: replica indices whose positions are stored at
+        every stage
+    :param velocity_interval: store velocities every this many stages, or
+        None to only keep them for restarts
+    :param atoms: optional list of atom indices to store positions and
+        velocities for, e.g. the solute
+    :param energy_matrix_band: if set, only store the energy matrix entries
+        within this many places of the diagonal
+
+    The default policy stores everything. Stages and replicas that are not
+    stored are masked when loaded with the ``load_*`` methods for a single
+    stage, and are NaN in the arrays from :meth:`DataStore.load_range` and
+    the ``iterate_*`` methods. If ``atoms`` is given, positions and
+    velocities only have the selected atoms. Box vectors are always stored,
+    except for the replicas missing from :meth:`DataStore.save_partial_states`.
+
+    Regardless of the policy, the complete positions, velocities, and box
+    vectors of the two most recent stages are kept in each block file, so a
+    run can always be restarted from the last completed stage or from the
+    end of a block (see :meth:`DataStore.load_states`). Stages saved with
+    :meth:`DataStore.save_partial_states` are not kept.
+
+    When only neighbor energies are computed, ``energy_matrix_band=1``
+    stores all of the entries that were computed. The energy matrix is
+    still loaded as a dense array, with NaN outside of the band. Analysis
+    that needs the full matrix, like MBAR, requires the default.
+
+    """
+
+    def __init__(
+        self,
+        position_interval=1,
+        full_replicas=(0,),
+        velocity_interval=1,
+        atoms=None,
+        energy_matrix_band=None,
+    ):
+        if position_interval < 1:
+            raise ValueError("position_interval must be at least 1")
+        if velocity_interval is not None and velocity_interval < 1:
+            raise ValueError("velocity_interval must be at least 1 or None")
+        if atoms is not None and not len(atoms):
+            raise ValueError("atoms must not be empty")
+        if energy_matrix_band is not None and energy_matrix_band < 0:
+            raise ValueError("energy_matrix_band must not be negative")
+        self.position_interval = position_interval
+        self.full_replicas = sorted(full_replicas)
+        self.velocity_interval = velocity_interval
+        self.atoms = None if atoms is None else [int(atom) for atom in atoms]
+        self.energy_matrix_band = energy_matrix_band
+
+    @property
+    def stores_all_states(self):
+        return (
+            self.position_interval == 1
+            and self.velocity_interval == 1
+            and self.atoms is None
+        )
+
+    def position_replicas(self, stage):
+        """Return the replicas to store positions for, or None for all."""
+        if stage % self.position_interval == 0:
+            return None
+        return self.full_replicas
+
+    def stores_velocities(self, stage):
+        """Return True if velocities are stored at stage."""
+        return (
+            self.velocity_interval is not None and stage % self.velocity_interval == 0
+        )
+
+    def stores_full_state(self, stage):
+        """Return True if the complete state is stored at stage."""
+        return (
+            self.atoms is None
+            and self.position_replicas(stage) is None
+            and self.stores_velocities(stage)
+        )
 
 
 class DataStore:
@@ -20,6 +185,23 @@ class DataStore:
     :param n_atoms: number of atoms
     :param n_replicas: number of replicas
     :param block_size: size of netcdf blocks and frequency to do backups
+    :param buffer_stages: number of stages to hold in memory before writing
+        them to the netcdf file
+    :param storage_profile: name of one of the :data:`STORAGE_PROFILES` or
+        a :class:`StorageProfile`, which controls the precision, compression,
+        and chunking of the netcdf files
+    :param max_open_blocks: number of finished block files to keep open for
+        random-access reads
+    :param random_access_cache_bytes: memory in bytes to use for caching
+        random-access reads, 0 disables the cache
+    :param trajectory_writer: :class:`meld.trajectory.TrajectoryWriter` used
+        by :meth:`append_traj`, defaults to writing a PDB file with
+        ``pdb_writer``
+    :param storage_policy: :class:`StoragePolicy` controlling which stages,
+        replicas, and atoms are stored, defaults to storing everything
+    :param commit_interval: number of completed stages between syncing the
+        block file and recording them as complete, None to only record them
+        when a block is finished or the store is closed
 
     Data will be stored in the 'Data' subdirectory. Backups will be stored
     in 'Data/Backup'.
@@ -30,7 +212,42 @@ class DataStore:
     - communicator.dat -- the MPICommunicator object
     - remd_runner.dat -- the MasterReplicaExchangeRunner object
 
-    Other data (positions, velocities, etc) is stored in the results.nc file.
+    Other data (positions, velocities, etc) is stored in block files in
+    'Data/Blocks'. These are netcdf files by default, but another of the
+    :data:`meld.storage.STORAGE_BACKENDS` can be chosen when the store is
+    initialized.
+
+    Each block file records the last stage that was completely written, along
+    with a checksum of each stage. :meth:`save_data_store` marks the current
+    stage as complete. The complete stages are recorded when a block is
+    finished, when the store is closed, and every ``commit_interval`` stages,
+    which syncs the block file to disk. When the store is opened with mode
+    'a', the complete stages in the current block are checked, so a run can
+    be restarted from the last recorded stage instead of the last backup.
+    Without ``commit_interval``, a run that crashes in the middle of a block
+    must be restarted from the last backup with prepare_restart.
+
+    The pickled files are written atomically and are not rewritten if they
+    have not changed. The system and run options never change, so they are
+    stored once in 'Data/Objects' under their content hash, and the files
+    above are links to them. The PDB writer held by the data store is stored
+    there the same way and referenced from data_store.dat, so the file that
+    is rewritten every stage stays small. Backups are hard links rather than
+    copies.
+
+    The store also holds :class:`meld.remd.statistics.RunningStatistics`,
+    which the runners update every stage with :meth:`update_statistics`.
+    They are pickled with the store, so they are backed up with it at block
+    boundaries and can be read with :attr:`statistics` without reading any
+    blocks.
+
+    Each stage is normally written to the netcdf file as soon as it is saved.
+    Because the variables are chunked and compressed, this means re-writing
+    the same chunks every stage. With ``buffer_stages > 1``, saved stages
+    are held in memory and each variable is written with a single call once
+    ``buffer_stages`` stages have accumulated. The buffer is also written
+    when moving to a new block, when a backup is made, and on :meth:`close`.
+    Loading a buffered stage returns the data from memory.
 
     """
 
@@ -40,6 +257,10 @@ class DataStore:
     data_dir = "Data"
     backup_dir = os.path.join(data_dir, "Backup")
     blocks_dir = os.path.join(data_dir, "Blocks")
+    objects_dir = os.path.join(data_dir, "Objects")
+    cache_dir = os.path.join(data_dir, "Cache")
+    cache_manifest_path = os.path.join(cache_dir, "manifest.json")
+    committed_stage_path = os.path.join(data_dir, "committed_stage.json")
 
     data_store_filename = "data_store.dat"
     data_store_path = os.path.join(data_dir, data_store_filename)
@@ -68,10 +289,29 @@ class DataStore:
     traj_path = os.path.join(data_dir, traj_filename)
     traj_backup_path = os.path.join(backup_dir, traj_filename)
 
-    def __init__(self, n_atoms, n_replicas, pdb_writer, block_size=100):
+    consolidated_filename = "consolidated.nc"
+    consolidated_path = os.path.join(data_dir, consolidated_filename)
+
+    def __init__(
+        self,
+        n_atoms,
+        n_replicas,
+        pdb_writer,
+        block_size=100,
+        buffer_stages=1,
+        storage_profile="default",
+        max_open_blocks=4,
+        random_access_cache_bytes=0,
+        trajectory_writer=None,
+        storage_policy=None,
+        commit_interval=None,
+    ):
         self._n_atoms = n_atoms
         self._n_replicas = n_replicas
         self._block_size = block_size
+        self._buffer_stages = buffer_stages
+        # variable name -> {stage: data} for stages not yet written
+        self._stage_buffer = {}
         self._cdf_data_set = None
         self._readonly_mode = False
         self._pdb_writer = pdb_writer
@@ -79,21 +319,85 @@ class DataStore:
         self._current_block = None
         self._max_safe_block = -1
         self._readonly_mode = False
+        self._live_mode = False
+        self._max_live_frame = 0
+        # stages that can be read from the consolidated file
+        self._consolidated_stages = 0
+        self._read_workers = 1
+        self._read_prefetch = None
+        self._completed_stage = None
+        self._commit_interval = commit_interval
+        self._max_open_blocks = max_open_blocks
+        self._random_access_cache_bytes = random_access_cache_bytes
+        self._init_read_caches()
+        self._checkpoint = checkpoint.CheckpointWriter(self.objects_dir)
+        if trajectory_writer is None:
+            trajectory_writer = trajectory.PDBTrajectoryWriter(
+                pdb_writer, self.traj_path
+            )
+        self._trajectory_writer = trajectory_writer
+        if storage_policy is None:
+            storage_policy = StoragePolicy()
+        self._storage_policy = storage_policy
+        self._storage_backend = "netcdf"
+        self._statistics = statistics.RunningStatistics(n_replicas)
+        if buffer_stages < 1:
+            raise ValueError("buffer_stages must be at least 1")
+        if commit_interval is not None and commit_interval < 1:
+            raise ValueError("commit_interval must be at least 1")
+        if isinstance(storage_profile, str):
+            try:
+                storage_profile = STORAGE_PROFILES[storage_profile]
+            except KeyError:
+                raise ValueError(f"Unknown storage profile {storage_profile}")
+        self._storage_profile = storage_profile
 
     def __getstate__(self):
         # don't save some fields to disk
-        excluded = ["_cdf_data_set"]
+        excluded = [
+            "_cdf_data_set",
+            "_stage_buffer",
+            "_read_handles",
+            "_random_access_cache",
+            "_memmaps",
+            "_checked_live_stages",
+            "_checkpoint",
+        ]
         return dict((k, v) for (k, v) in self.__dict__.items() if k not in excluded)
 
     def __setstate__(self, state):
         # set _cdf_data_set to None
         self.__dict__ = state
         self._cdf_data_set = None
+        self._stage_buffer = {}
+        # stores pickled before these options were added
+        self.__dict__.setdefault("_buffer_stages", 1)
+        self.__dict__.setdefault("_storage_profile", STORAGE_PROFILES["default"])
+        self.__dict__.setdefault("_max_open_blocks", 4)
+        self.__dict__.setdefault("_random_access_cache_bytes", 0)
+        self.__dict__.setdefault("_completed_stage", None)
+        self.__dict__.setdefault("_commit_interval", None)
+        self.__dict__.setdefault("_live_mode", False)
+        self.__dict__.setdefault("_max_live_frame", 0)
+        self.__dict__.setdefault("_consolidated_stages", 0)
+        self.__dict__.setdefault("_read_workers", 1)
+        self.__dict__.setdefault("_read_prefetch", None)
+        self.__dict__.setdefault("_storage_policy", StoragePolicy())
+        self.__dict__.setdefault("_storage_backend", "netcdf")
+        self.__dict__.setdefault(
+            "_statistics", statistics.RunningStatistics(self._n_replicas)
+        )
+        if "_trajectory_writer" not in state:
+            self._trajectory_writer = trajectory.PDBTrajectoryWriter(
+                self._pdb_writer, self.traj_path
+            )
+        self._init_read_caches()
+        self._checkpoint = checkpoint.CheckpointWriter(self.objects_dir)
 
     def __del__(self):
         # close the _cdf_data_set when we go out of scope
         if self._cdf_data_set:
-            self._cdf_data_set.close()
+            self.close()
 
     #
     # properties
@@ -107,67 +411,192 @@ class DataStore:
     def n_atoms(self):
         return self._n_atoms
 
+    @property
+    def block_size(self):
+        return self._block_size
+
+    @property
+    def storage_profile(self):
+        return self._storage_profile
+
+    @property
+    def storage_policy(self):
+        return self._storage_policy
+
+    @property
+    def storage_backend(self):
+        """Name of the backend used for the block files."""
+        return self._storage_backend
+
+    @property
+    def read_workers(self):
+        """
+        Number of processes used to read finished blocks.
+
+        With more than one worker, :meth:`iterate_range`, :meth:`load_range`,
+        and the helpers that use them read and decompress finished blocks in
+        a pool of worker processes. The blocks are still returned in order.
+
+        """
+        return self._read_workers
+
+    @read_workers.setter
+    def read_workers(self, new_value):
+        if new_value < 1:
+            raise ValueError("read_workers must be at least 1")
+        self._read_workers = new_value
+
+    @property
+    def read_prefetch(self):
+        """
+        Number of blocks to read ahead when using read workers.
+
+        Defaults to twice the number of read workers.
+
+        """
+        if self._read_prefetch is None:
+            return 2 * self._read_workers
+        return self._read_prefetch
+
+    @read_prefetch.setter
+    def read_prefetch(self, new_value):
+        if new_value is not None and new_value < 1:
+            raise ValueError("read_prefetch must be at least 1")
+        self._read_prefetch = new_value
+
+    @property
+    def trajectory_writer(self):
+        return self._trajectory_writer
+
+    @property
+    def statistics(self):
+        """
+        The :class:`meld.remd.statistics.RunningStatistics` of the run.
+
+        These cover the stages up to when the store was saved. A store loaded
+        from the backup, e.g. for analysis, covers the finished blocks.
+
+        """
+        return self._statistics
+
     #
     # public methods
     #
-    def initialize(self, mode):
+    def initialize(self, mode, backend=None):
         """
         Prepare to use the DataStore object.
 
         :param mode: mode to open in.
+        :param backend: name of one of the
+            :data:`meld.storage.STORAGE_BACKENDS` to write the block files
+            with, only for mode 'w'. Defaults to ``"netcdf"``.
 
         Available modes are:
 
         - 'w' -- create a new directory structure and initialize the hd5 file
         - 'a' -- append to the existing files
         - 'r' -- open the file in read-only mode
+        - 'l' -- open in read-only mode, following a running simulation
+
+        In read-only mode, only the finished blocks can be read. In live mode,
+        the completed stages of the block that is being written can also be
+        read, see :meth:`refresh`. In both modes, stages are read from the
+        consolidated file if it exists (see :meth:`consolidate`), and from
+        the memory-mapped cache if it is up to date (see
+        :meth:`materialize_cache`).
+
+        In live mode, the block being written is read while the simulation
+        has it open. Netcdf blocks are not written in HDF5's single-writer,
+        multiple-reader mode, so such reads may see partially written data.
+        Each stage read from that block is therefore checked against its
+        checksum, and a RuntimeError is raised if it does not match, in which
+        case the read can be tried again. HDF5 file locking also prevents
+        these reads, so set ``HDF5_USE_FILE_LOCKING=FALSE`` in the
+        environment of the reading process before netCDF4 is imported. The
+        raw backend does not have these limitations.
+
+        In the other modes, the backend is detected from the block files.
 
         """
+        if backend is not None:
+            if mode != "w":
+                raise ValueError("The backend can only be chosen with mode 'w'")
+            if backend not in storage.STORAGE_BACKENDS:
+                raise ValueError(f"Unknown storage backend {backend}")
+        else:
+            self._detect_storage_backend()
+
         if mode == "w":
             if os.path.exists(self.data_dir):
                 raise RuntimeError("Data directory already exists")
+            if backend is not None:
+                self._storage_backend = backend
             os.mkdir(self.data_dir)
             os.mkdir(self.blocks_dir)
             os.mkdir(self.backup_dir)
+            os.mkdir(self.objects_dir)
             self._current_block = 0
             self._current_stage = 0
             self._create_cdf_file()
         elif mode == "a":
-            block_path = self.net_cdf_path_template.format(self._current_block)
+            block_path = self._block_file(self._current_block)
             if os.path.exists(block_path):
-                self._cdf_data_set = cdf.Dataset(block_path, "a")
+                self._cdf_data_set = self._backend.open(block_path, "a")
+                self._check_committed_stages()
+                self._write_committed_stage_file()
             else:
                 self._create_cdf_file()
         elif mode == "r":
             self._current_block = 0
             self._readonly_mode = True
+            self._find_consolidated_stages()
+            self._load_memmap_cache()
             self._load_cdf_file_readonly()
+        elif mode == "l":
+            self._current_block = 0
+            self._readonly_mode = True
+            self._live_mode = True
+            self._find_consolidated_stages()
+            self._load_memmap_cache()
+            self.refresh()
         else:
             raise RuntimeError(f"Unknown value for mode={mode}")
 
     def close(self):
         """Close the DataStore"""
         if self._cdf_data_set:
+            self._flush_stage_buffer()
+            if not self._readonly_mode:
+                self._write_committed_stage(force=True)
             self._cdf_data_set.close()
             self._cdf_data_set = None
+        self._close_read_handles()
+        self._trajectory_writer.close()
 
     def save_data_store(self):
-        """Save this object to disk."""
-        with open(self.data_store_path, "wb") as store_file:
-            pickle.dump(self, store_file)
+        """
+        Save this object to disk.
+
+        This also marks the current stage as completely written. It is
+        recorded in the block file every ``commit_interval`` stages, once
+        the stage buffer has been written.
+
+        """
+        self._commit_stage()
+        self._checkpoint.write_object(
+            self, self.data_store_path, shared=[self._pdb_writer]
+        )
 
     @classmethod
     def load_data_store(cls, load_backup=False):
         """Load the DataStore object from disk."""
         path = cls.data_store_backup_path if load_backup else cls.data_store_path
-        with open(path, "rb") as store_file:
-            return pickle.load(store_file)
+        return checkpoint.load_object(path, cls.objects_dir)
 
     def save_communicator(self, comm):
         """Save the communicator to disk"""
         self._can_save()
-        with open(self.communicator_path, "wb") as comm_file:
-            pickle.dump(comm, comm_file)
+        self._checkpoint.write_object(comm, self.communicator_path)
 
     def load_communicator(self):
         """Load the communicator from disk"""
@@ -188,7 +617,11 @@ class DataStore:
         """
         self._can_save()
         self._handle_save_stage(stage)
-        self._cdf_data_set.variables["positions"][..., stage] = positions
+        self._save_restart("positions", positions, stage)
+        replicas = self._storage_policy.position_replicas(stage)
+        self._save_variable(
+            "positions", self._select_stored(positions, replicas), stage
+        )
 
     def load_positions(self, stage):
         """
@@ -198,7 +631,7 @@ class DataStore:
 
         """
         self._handle_load_stage(stage)
-        return self._cdf_data_set.variables["positions"][..., stage]
+        return self._load_variable("positions", stage)
 
     def load_positions_random_access(self, stage):
         """
@@ -209,19 +642,21 @@ class DataStore:
         This differs from :meth:`load_positions` in that you can positions
         from any stage, while :meth:`load_positions` can only move forward
         in time. However, this comes at a performance penalty.
+
+        Up to ``max_open_blocks`` finished block files are kept open between
+        calls. If ``random_access_cache_bytes`` is set, the positions that
+        are loaded are also kept in memory, up to that many bytes.
         """
         # get the block for this stage
         block = self._block_for_stage(stage)
 
         # if it's the current block, then just return the positions
-        if block == self._current_block:
-            return self._cdf_data_set.variables["positions"][..., stage]
+        if block == self._current_block and self._cdf_data_set:
+            return self._load_variable("positions", stage)
 
-        # otherwise open the file, grab the positions, and then close it
+        # otherwise read it from the block file
         else:
-            path = self.net_cdf_path_template.format(block)
-            with contextlib.closing(cdf.Dataset(path, "r")) as dataset:
-                return dataset.variables["positions"][..., stage]
+            return self._load_random_access("positions", block, stage)
 
     def load_all_positions(self):
         """
@@ -230,26 +665,178 @@ class DataStore:
         Warning, this could use a lot of memory.
 
         """
-        return np.concatenate(
-            [
-                np.array(self.load_positions(i))[..., np.newaxis]
-                for i in range(self.max_safe_frame)
-            ],
-            axis=-1,
-        )
+        return self.load_range("positions")
 
     def iterate_positions(self, start=None, end=None):
         """
         Iterate over the positions from disk.
 
+        """
+        return self._iterate_stages("positions", start, end)
+
+    def load_range(self, variable, start=None, end=None, replicas=None, atoms=None):
+        """
+        Load a range of stages of a variable from disk.
+
+        :param variable: name of the variable to load, e.g. ``"positions"``
+        :param start: first stage to load, defaults to 0
+        :param end: stage to stop before, defaults to :attr:`max_safe_frame`
+        :param replicas: optional list of replica indices to load
+        :param atoms: optional list of atom indices to load, only for
+            positions and velocities
+        :return: array with stages along the last axis
+
+        Each block file is read with a single call, and only the requested
+        replicas and atoms are read from disk. Values that were not stored
+        (see :class:`StoragePolicy`) are NaN.
+
+        """
+        return np.concatenate(
+            list(self.iterate_range(variable, start, end, replicas, atoms)), axis=-1
+        )
+
+    def iterate_range(
+        self,
+        variable,
+        start=None,
+        end=None,
+        replicas=None,
+        atoms=None,
+        follow=False,
+        poll_interval=5.0,
+    ):
+        """
+        Iterate over a range of stages of a variable, one block at a time.
+
+        Takes the same parameters as :meth:`load_range` and yields arrays
+        with the stages in each block along the last axis.
+
+        :param follow: keep waiting for new stages, requires mode 'l'
+        :param poll_interval: seconds to wait between checks for new stages
+
+        With ``follow=True``, the stages that are available are yielded
+        first. The store is then refreshed every ``poll_interval`` seconds
+        and newly completed stages are yielded as they are written. This
+        continues until ``end`` is reached, or forever if ``end`` is None.
+
         """
+        if start is None:
+            start = 0
+        if end is None and not follow:
+            end = self.max_safe_frame
+        if end is not None and start >= end:
+            raise ValueError(f"Empty range of stages from {start} to {end}")
+        if follow and not self._live_mode:
+            raise RuntimeError("Following new stages requires mode 'l'")
+        if not follow and self._readonly_mode and end > self.max_safe_frame:
+            raise RuntimeError("Tried to read an unsafe block")
+        if atoms is not None and variable not in ["positions", "velocities"]:
+            raise ValueError(f"Cannot select atoms from {variable}")
+
+        index = (slice(None) if replicas is None else list(replicas),)
+        if atoms is not None:
+            index += (list(atoms),)
+
+        if not follow:
+            return self._iterate_blocks(variable, start, end, index, masked=False)
+        return self._follow_blocks(variable, start, end, index, poll_interval)
+
+    def _iterate_stages(self, variable, start, end):
         if start is None:
             start = 0
         if end is None:
             end = self.max_safe_frame
-
-        for i in range(start, end):
-            yield self.load_positions(i)
+        if start >= end:
+            return
+        for block in self.iterate_range(variable, start, end):
+            for i in range(block.shape[-1]):
+                yield block[..., i]
+
+    def _iterate_blocks_parallel(self, variable, start, end, index):
+        # finished blocks are read in worker processes, up to read_prefetch
+        # blocks ahead of the one being yielded. Others are read here.
+        first_block = self._block_for_stage(start)
+        last_block = self._block_for_stage(end - 1)
+        pending = collections.deque()
+        # forking is not safe with writer threads or open HDF5 files
+        executor = concurrent.futures.ProcessPoolExecutor(
+            self._read_workers, mp_context=mp.get_context("spawn")
+        )
+        with executor:
+            try:
+                for block in range(first_block, last_block + 1):
+                    block_start = max(start, block * self._block_size)
+                    block_end = min(end, (block + 1) * self._block_size)
+                    if block <= self._max_safe_block:
+                        future = executor.submit(
+                            _read_block,
+                            self._block_path(block),
+                            variable,
+                            index + (Ellipsis, slice(block_start, block_end)),
+                        )
+                        pending.append(future)
+                    else:
+                        pending.append((block, block_start, block_end))
+                    while len(pending) > self.read_prefetch:
+                        yield self._collect_block(pending.popleft(), variable, index)
+                while pending:
+                    yield self._collect_block(pending.popleft(), variable, index)
+            finally:
+                # don't wait for blocks that will never be used
+                for item in pending:
+                    if isinstance(item, concurrent.futures.Future):
+                        item.cancel()
+
+    def _collect_block(self, item, variable, index):
+        if isinstance(item, concurrent.futures.Future):
+            return item.result()
+        block, block_start, block_end = item
+        with self._open_block(block) as dataset:
+            if variable not in dataset.variables:
+                raise ValueError(f"Unknown variable {variable}")
+            data = dataset.variables[variable][
+                index + (Ellipsis, slice(block_start, block_end))
+            ]
+            self._check_live_stages(dataset, block, block_start, block_end)
+        return _fill_masked(data)
+
+    def _follow_blocks(self, variable, start, end, index, poll_interval):
+        while end is None or start < end:
+            available = self.max_safe_frame
+            if end is not None:
+                available = min(available, end)
+            if available > start:
+                yield from self._iterate_blocks(
+                    variable, start, available, index, masked=False
+                )
+                start = available
+            else:
+                time.sleep(poll_interval)
+                self.refresh()
+
+    def _iterate_blocks(self, variable, start, end, index, masked):
+        cached = None if masked else self._memmaps.get(variable)
+        if cached is not None and end > cached.shape[-1]:
+            cached = None
+        if cached is None and not masked and self._read_workers > 1:
+            yield from self._iterate_blocks_parallel(variable, start, end, index)
+            return
+        first_block = self._block_for_stage(start)
+        last_block = self._block_for_stage(end - 1)
+        for block in range(first_block, last_block + 1):
+            block_start = max(start, block * self._block_size)
+            block_end = min(end, (block + 1) * self._block_size)
+            if cached is not None:
+                yield cached[index + (Ellipsis, slice(block_start, block_end))]
+                continue
+            with self._open_block(block) as dataset:
+                if variable not in dataset.variables:
+                    raise ValueError(f"Unknown variable {variable}")
+                data = dataset.variables[variable][
+                    index + (Ellipsis, slice(block_start, block_end))
+                ]
+                self._check_live_stages(dataset, block, block_start, block_end)
+            yield data if masked else _fill_masked(data)
 
     def save_velocities(self, velocities, stage):
         """
@@ -261,7 +848,11 @@ class DataStore:
         """
         self._can_save()
         self._handle_save_stage(stage)
-        self._cdf_data_set.variables["velocities"][..., stage] = velocities
+        self._save_restart("velocities", velocities, stage)
+        if self._storage_policy.stores_velocities(stage):
+            self._save_variable(
+                "velocities", self._select_stored(velocities), stage
+            )
 
     def load_velocities(self, stage):
         """
@@ -271,7 +862,7 @@ class DataStore:
 
         """
         self._handle_load_stage(stage)
-        return self._cdf_data_set.variables["velocities"][..., stage]
+        return self._load_variable("velocities", stage)
 
     def load_all_velocities(self):
         """
@@ -280,13 +871,7 @@ class DataStore:
         Warning, this could use a lot of memory.
 
         """
-        return np.concatenate(
-            [
-                np.array(self.load_velocities(i))[..., np.newaxis]
-                for i in range(self.max_safe_frame)
-            ],
-            axis=-1,
-        )
+        return self.load_range("velocities")
 
     def save_box_vectors(self, box_vectors, stage):
         """
@@ -298,7 +883,8 @@ class DataStore:
         """
         self._can_save()
         self._handle_save_stage(stage)
-        self._cdf_data_set.variables["box_vectors"][..., stage] = box_vectors
+        self._save_restart("box_vectors", box_vectors, stage)
+        self._save_variable("box_vectors", box_vectors, stage)
 
     def load_box_vectors(self, stage):
         """
@@ -308,7 +894,7 @@ class DataStore:
 
         """
         self._handle_load_stage(stage)
-        return self._cdf_data_set.variables["box_vectors"][..., stage]
+        return self._load_variable("box_vectors", stage)
 
     def save_states(self, states, stage):
         """
@@ -331,6 +917,55 @@ class DataStore:
         self.save_alphas(alphas, stage)
         self.save_energies(energies, stage)
 
+    def save_partial_states(self, states, stage):
+        """
+        Save the states of some of the replicas.
+
+        :param states: list with a SystemState for each replica, or None
+            for the replicas whose state is not available
+        :param stage: int stage to store
+
+        The positions and velocities that the :class:`StoragePolicy` stores
+        at this stage must be available. The box vectors and energies of the
+        missing replicas are masked when loaded. The alphas are not saved,
+        see :meth:`save_alphas`. The stage is not kept for restarts, so it
+        cannot be loaded with :meth:`load_states`.
+
+        """
+        self._can_save()
+        self._handle_save_stage(stage)
+        available = [i for i, s in enumerate(states) if s is not None]
+        position_replicas = self._storage_policy.position_replicas(stage)
+        needed = set(range(self._n_replicas))
+        if position_replicas is not None:
+            needed = set(position_replicas)
+        if self._storage_policy.stores_velocities(stage):
+            needed = set(range(self._n_replicas))
+        missing = needed.difference(available)
+        if missing:
+            raise RuntimeError(
+                f"The storage policy stores replicas {sorted(missing)} at stage "
+                f"{stage}, but their states are not available"
+            )
+
+        positions = np.zeros((self._n_replicas, self._n_atoms, 3))
+        velocities = np.zeros((self._n_replicas, self._n_atoms, 3))
+        box_vectors = np.ma.masked_all((self._n_replicas, 3))
+        energies = np.ma.masked_all(self._n_replicas)
+        for i in available:
+            positions[i] = states[i].positions
+            velocities[i] = states[i].velocities
+            if states[i].box_vector is not None:
+                box_vectors[i] = states[i].box_vector
+            energies[i] = states[i].energy
+        self._save_variable(
+            "positions", self._select_stored(positions, position_replicas), stage
+        )
+        if self._storage_policy.stores_velocities(stage):
+            self._save_variable("velocities", self._select_stored(velocities), stage)
+        self._save_variable("box_vectors", box_vectors, stage)
+        self._save_variable("energies", energies, stage)
+
     def load_states(self, stage):
         """
         Load states from disk
@@ -339,11 +974,24 @@ class DataStore:
 
         :return: list of SystemState objects
 
+        If the :class:`StoragePolicy` does not store the complete state at
+        every stage, only the stages that were stored completely and the
+        stages kept for restarts can be loaded.
+
         """
         self._handle_load_stage(stage)
-        positions = self.load_positions(stage)
-        velocities = self.load_velocities(stage)
-        box_vectors = self.load_box_vectors(stage)
+        restart = self._load_restart(stage)
+        if restart is not None:
+            positions, velocities, box_vectors = restart
+        elif self._storage_policy.stores_full_state(stage):
+            positions = self.load_positions(stage)
+            velocities = self.load_velocities(stage)
+            box_vectors = self.load_box_vectors(stage)
+        else:
+            raise RuntimeError(
+                f"The complete state for stage {stage} was not stored by the "
+                "storage policy"
+            )
         alphas = self.load_alphas(stage)
         energies = self.load_energies(stage)
         states = []
@@ -355,9 +1003,14 @@ class DataStore:
         return states
 
     def append_traj(self, state, stage):
-        pdb_string = self._pdb_writer.get_pdb_string(state.positions, stage)
-        with open(self.traj_path, "a") as traj_file:
-            traj_file.write(pdb_string)
+        """
+        Write a frame to the trajectory.
+
+        :param state: SystemState to write
+        :param stage: int stage to write
+
+        """
+        self._trajectory_writer.write(state.positions, stage)
 
     def save_alphas(self, alphas, stage):
         """
@@ -369,7 +1022,7 @@ class DataStore:
         """
         self._can_save()
         self._handle_save_stage(stage)
-        self._cdf_data_set.variables["alphas"][..., stage] = alphas
+        self._save_variable("alphas", alphas, stage)
 
     def load_alphas(self, stage):
         """
@@ -380,7 +1033,7 @@ class DataStore:
 
         """
         self._handle_load_stage(stage)
-        return self._cdf_data_set.variables["alphas"][..., stage]
+        return self._load_variable("alphas", stage)
 
     def load_all_alphas(self):
         """
@@ -389,13 +1042,7 @@ class DataStore:
         Warning, this could use a lot of memory.
 
         """
-        return np.concatenate(
-            [
-                np.array(self.load_alphas(i))[..., np.newaxis]
-                for i in range(self.max_safe_frame)
-            ],
-            axis=-1,
-        )
+        return self.load_range("alphas")
 
     def save_energies(self, energies, stage):
         """
@@ -407,7 +1054,7 @@ class DataStore:
         """
         self._can_save()
         self._handle_save_stage(stage)
-        self._cdf_data_set.variables["energies"][..., stage] = energies
+        self._save_variable("energies", energies, stage)
 
     def load_energies(self, stage):
         """
@@ -418,7 +1065,7 @@ class DataStore:
 
         """
         self._handle_load_stage(stage)
-        return self._cdf_data_set.variables["energies"][..., stage]
+        return self._load_variable("energies", stage)
 
     def load_all_energies(self):
         """
@@ -427,31 +1074,50 @@ class DataStore:
         Warning, this could use a lot of memory
 
         """
-        return np.concatenate(
-            [
-                np.array(self.load_energies(i))[..., np.newaxis]
-                for i in range(self.max_safe_frame)
-            ],
-            axis=-1,
-        )
+        return self.load_range("energies")
 
     def save_energy_matrix(self, energy_matrix, stage):
+        """
+        Save energy matrix to disk.
+
+        :param energy_matrix: n_replicas x n_replicas array
+        :param stage: int stage to store
+
+        Entries that were not computed, e.g. outside of the band when only
+        neighbor energies are computed, should be NaN. Masked entries are
+        stored as NaN.
+
+        """
         self._can_save()
         self._handle_save_stage(stage)
-        self._cdf_data_set.variables["energy_matrix"][..., stage] = energy_matrix
+        energy_matrix = np.ma.filled(energy_matrix, np.nan)
+        band = self._storage_policy.energy_matrix_band
+        if band is None:
+            self._save_variable("energy_matrix", energy_matrix, stage)
+        else:
+            self._save_variable(
+                "energy_matrix_band", _band_from_matrix(energy_matrix, band), stage
+            )
 
     def load_energy_matrix(self, stage):
+        """
+        Load energy matrix from disk.
+
+        :param stage: int stage to load
+        :return: n_replicas x n_replicas array, with NaN for entries
+                 that were not computed
+
+        """
         self._handle_load_stage(stage)
-        return self._cdf_data_set.variables["energy_matrix"][..., stage]
+        if self._storage_policy.energy_matrix_band is not None:
+            band = self._load_variable("energy_matrix_band", stage)
+            return _matrix_from_band(np.ma.filled(band, np.nan))
+        return self._load_variable("energy_matrix", stage)
 
     def load_all_energy_matrices(self):
-        return np.concatenate(
-            [
-                np.array(self.load_energy_matrix(i))[..., np.newaxis]
-                for i in range(self.max_safe_frame)
-            ],
-            axis=-1,
-        )
+        if self._storage_policy.energy_matrix_band is not None:
+            return _matrix_from_band(self.load_range("energy_matrix_band"))
+        return self.load_range("energy_matrix")
 
     def save_permutation_vector(self, perm_vec, stage):
         """
@@ -463,7 +1129,7 @@ class DataStore:
         """
         self._can_save()
         self._handle_save_stage(stage)
-        self._cdf_data_set.variables["permutation_vectors"][..., stage] = perm_vec
+        self._save_variable("permutation_vectors", perm_vec, stage)
 
     def load_permutation_vector(self, stage):
         """
@@ -475,7 +1141,7 @@ class DataStore:
 
         """
         self._handle_load_stage(stage)
-        return self._cdf_data_set.variables["permutation_vectors"][..., stage]
+        return self._load_variable("permutation_vectors", stage)
 
     def load_all_permutation_vectors(self):
         """
@@ -484,26 +1150,155 @@ class DataStore:
         Warning, this might take a lot of memory
 
         """
-        return np.concatenate(
-            [
-                np.array(self.load_permutation_vector(i))[..., np.newaxis]
-                for i in range(self.max_safe_frame)
-            ],
-            axis=-1,
-        )
+        return self.load_range("permutation_vectors")
 
     def iterate_permutation_vectors(self, start=None, end=None):
         """
         Iterate over the permutation vectors from disk.
 
+        """
+        return self._iterate_stages("permutation_vectors", start, end)
+
+    def load_walker_index(self, start=None, end=None):
+        """
+        Load the walker at each replica index.
+
+        :param start: first stage to load, defaults to 0
+        :param end: one past the last stage to load, defaults to
+            ``max_safe_frame``
+        :return: n_replicas x n_stages array
+
+        A walker is a single structure followed as it is exchanged between
+        replicas. Walkers are numbered by their replica index at stage 0, and
+        column ``i`` of the result gives the walker at each replica index at
+        stage ``start + i``. The index is read from the consolidated file if
+        possible, otherwise it is computed from the permutation vectors.
+
         """
         if start is None:
             start = 0
         if end is None:
             end = self.max_safe_frame
+        if end <= self._consolidated_stages:
+            with contextlib.closing(
+                cdf.Dataset(self.consolidated_path, "r")
+            ) as dataset:
+                return np.array(dataset.variables["walker_index"][:, start:end])
+        return self._compute_walker_index(end)[:, start:]
+
+    def update_statistics(
+        self, stage, energy_matrix, permutation_vector, alphas, exchanges
+    ):
+        """
+        Add a stage to the running statistics.
+
+        :param stage: int stage the data is from
+        :param energy_matrix: n_replicas x n_replicas array after exchanges
+        :param permutation_vector: n_replicas array of int
+        :param alphas: n_replicas array
+        :param exchanges: :class:`meld.remd.ladder.ExchangeCounts` for the
+            stage
+
+        The statistics are saved with :meth:`save_data_store`.
+
+        """
+        self._can_save()
+        self._statistics.update(
+            stage, energy_matrix, permutation_vector, alphas, exchanges
+        )
+
+    def save_replica_ranks(self, ranks, stage):
+        """
+        Save the rank holding each replica to disk.
+
+        :param ranks: n_replicas array of int
+        :param stage: int stage to store
+
+        ``ranks[i]`` is the MPI rank holding the structure stored at ladder
+        index ``i``. This is only saved when alphas, rather than coordinates,
+        are exchanged between ranks. Otherwise, ``ranks[i] == i``.
 
-        for i in range(start, end):
-            yield self.load_permutation_vector(i)
+        """
+        self._can_save()
+        self._handle_save_stage(stage)
+        self._save_variable("replica_ranks", ranks, stage)
+
+    def load_replica_ranks(self, stage):
+        """
+        Load the rank holding each replica from disk.
+
+        :param stage: int stage to load
+
+        :return: n_replicas array of int
+
+        """
+        self._handle_load_stage(stage)
+        return self._load_variable("replica_ranks", stage)
+
+    def save_replica_stages(self, stages, stage):
+        """
+        Save the number of segments run at each ladder index to disk.
+
+        :param stages: n_replicas array of int
+        :param stage: int stage to store
+
+        This is only saved by
+        :class:`meld.remd.async_runner.AsyncReplicaExchangeRunner`, where the
+        replicas do not run in lock step. ``stages[i]`` is then the total
+        number of segments of simulation that have been run at ladder index
+        ``i``.
+
+        """
+        self._can_save()
+        self._handle_save_stage(stage)
+        self._save_variable("replica_stages", stages, stage)
+
+    def load_replica_stages(self, stage):
+        """
+        Load the number of segments run at each ladder index from disk.
+
+        :param stage: int stage to load
+
+        :return: n_replicas array of int
+
+        """
+        self._handle_load_stage(stage)
+        return self._load_variable("replica_stages", stage)
+
+    def save_exchange_counts(self, exchanges, stage):
+        """
+        Save the exchanges since the previous stage to disk.
+
+        :param exchanges: :class:`meld.remd.ladder.ExchangeCounts` with the
+            number of attempted and accepted swaps between each pair of
+            adjacent replicas
+        :param stage: int stage to store
+
+        This is only saved by
+        :class:`meld.remd.async_runner.AsyncReplicaExchangeRunner`, where
+        any number of exchanges may be attempted between two stages.
+
+        """
+        self._can_save()
+        self._handle_save_stage(stage)
+        self._save_variable("exchange_attempts", exchanges.attempts, stage)
+        self._save_variable("exchange_successes", exchanges.successes, stage)
+
+    def load_exchange_counts(self, stage):
+        """
+        Load the exchanges since the previous stage from disk.
+
+        :param stage: int stage to load
+
+        :return: :class:`meld.remd.ladder.ExchangeCounts` of
+            n_replica_pairs arrays of int
+
+        """
+        self._handle_load_stage(stage)
+        return ladder.ExchangeCounts(
+            self._load_variable("exchange_attempts", stage),
+            self._load_variable("exchange_successes", stage),
+        )
 
     def save_acceptance_probabilities(self, accept_probs, stage):
         """
@@ -515,8 +1310,7 @@ class DataStore:
         """
         self._can_save()
         self._handle_save_stage(stage)
-        ds = self._cdf_data_set
-        ds.variables["acceptance_probabilities"][..., stage] = accept_probs
+        self._save_variable("acceptance_probabilities", accept_probs, stage)
 
     def load_acceptance_probabilities(self, stage):
         """
@@ -527,8 +1321,7 @@ class DataStore:
 
         """
         self._handle_load_stage(stage)
-        ds = self._cdf_data_set
-        return ds.variables["acceptance_probabilities"][..., stage]
+        return self._load_variable("acceptance_probabilities", stage)
 
     def load_all_acceptance_probabilities(self):
         """
@@ -537,19 +1330,12 @@ class DataStore:
         Warning, this might take a lot of memory
 
         """
-        return np.concatenate(
-            [
-                np.array(self.load_acceptance_probabilities(i))[..., np.newaxis]
-                for i in range(self.max_safe_frame)
-            ],
-            axis=-1,
-        )
+        return self.load_range("acceptance_probabilities")
 
     def save_remd_runner(self, runner):
         """Save replica runner to disk"""
         self._can_save()
-        with open(self.remd_runner_path, "wb") as runner_file:
-            pickle.dump(runner, runner_file)
+        self._checkpoint.write_object(runner, self.remd_runner_path)
 
     def load_remd_runner(self):
         """Load replica runner from disk"""
@@ -563,8 +1349,7 @@ class DataStore:
 
     def save_system(self, system):
         self._can_save()
-        with open(self.system_path, "wb") as system_file:
-            pickle.dump(system, system_file)
+        self._checkpoint.write_immutable(system, self.system_path)
 
     def load_system(self):
         path = self.system_backup_path if self._readonly_mode else self.system_path
@@ -574,8 +1359,7 @@ class DataStore:
     def save_run_options(self, run_options):
         self._can_save()
         run_options.sanity_check()
-        with open(self.run_options_path, "wb") as options_file:
-            pickle.dump(run_options, options_file)
+        self._checkpoint.write_immutable(run_options, self.run_options_path)
 
     def load_run_options(self):
         path = (
@@ -599,20 +1383,186 @@ class DataStore:
         """
         self._can_save()
         if not stage % self._block_size:
+            self._flush_stage_buffer()
             self._backup(self.communicator_path, self.communicator_backup_path)
             self._backup(self.data_store_path, self.data_store_backup_path)
             self._backup(self.remd_runner_path, self.remd_runner_backup_path)
             self._backup(self.system_path, self.system_backup_path)
             self._backup(self.run_options_path, self.run_options_backup_path)
 
+    def consolidate(self, float32=False, complevel=4, chunk_bytes=2 ** 20):
+        """
+        Write all finished blocks to a single file for analysis.
+
+        :param float32: store positions, velocities, and box vectors as
+            single precision
+        :param complevel: zlib compression level from 0 to 9
+        :param chunk_bytes: approximate size of each chunk in bytes
+        :return: the number of stages that were written
+
+        The block files are chunked for writing one stage at a time, so
+        reading the time series for a replica touches every block. The
+        consolidated file is written to ``Data/consolidated.nc`` and is
+        chunked along time instead, with each replica in separate chunks.
+        It also contains a ``walker_index`` variable, see
+        :meth:`load_walker_index`. Stores opened with mode 'r' or 'l' read
+        the stages it contains from it instead of the block files.
+
+        The store must be opened with mode 'r'. The data is streamed from
+        the block files a chunk at a time, so the whole run does not need to
+        fit in memory.
+
+        """
+        if not self._readonly_mode:
+            raise RuntimeError("The store must be opened with mode 'r' to consolidate")
+        n_stages = self.max_safe_frame
+        if not n_stages:
+            raise RuntimeError("There are no finished blocks to consolidate")
+
+        tmp_path = self.consolidated_path + ".tmp"
+        with self._open_block(0) as template, contextlib.closing(
+            cdf.Dataset(tmp_path, "w", format="NETCDF4")
+        ) as ds:
+            ds.setncatts(
+                {
+                    k: template.getncattr(k)
+                    for k in template.ncattrs()
+                    if k.startswith("storage_")
+                }
+            )
+            ds.consolidated_stages = n_stages
+            for name, dimension in template.dimensions.items():
+                if name != "timesteps":
+                    ds.createDimension(name, len(dimension))
+            ds.createDimension("timesteps", n_stages)
+
+            for name, source in template.variables.items():
+                if name == "stored_atoms":
+                    ds.createVariable(name, source.dtype, source.dimensions)[
+                        :
+                    ] = source[:]
+                if name in ["stage_checksums", "walker_index"]:
+                    continue
+                if not _is_stage_variable(source):
+                    continue
+                dtype = source.dtype
+                if float32 and name in ["positions", "velocities", "box_vectors"]:
+                    if dtype.kind == "f":
+                        dtype = np.dtype("f4")
+                variable = self._create_consolidated_variable(
+                    ds, name, dtype, source.dimensions, complevel, chunk_bytes
+                )
+                if "scale_factor" in source.ncattrs():
+                    variable.scale_factor = source.scale_factor
+                window = variable.chunking()[-1]
+                for start in range(0, n_stages, window):
+                    end = min(start + window, n_stages)
+                    variable[..., start:end] = np.ma.concatenate(
+                        list(
+                            self._iterate_blocks(
+                                name, start, end, (slice(None),), masked=True
+                            )
+                        ),
+                        axis=-1,
+                    )
+
+            walker_index = self._create_consolidated_variable(
+                ds,
+                "walker_index",
+                np.dtype("i4"),
+                ("n_replicas", "timesteps"),
+                complevel,
+                chunk_bytes,
+            )
+            walker_index[:] = self._compute_walker_index(n_stages)
+
+        os.replace(tmp_path, self.consolidated_path)
+        return n_stages
+
+    def materialize_cache(self, variables=None, dtype=None):
+        """
+        Write uncompressed copies of variables for repeated analysis.
+
+        :param variables: names of the variables to cache, defaults to all
+        :param dtype: optional type to store floating point variables as,
+            e.g. ``"f4"``
+        :return: the number of stages that were cached
+
+        Each variable is written for all finished stages to
+        ``Data/Cache/<variable>.npy``. When a store is opened with mode 'r'
+        or 'l', these files are memory mapped and read instead of the
+        compressed block files. The ``load_*`` methods for a single stage
+        return masked copies of the data, as they do without the cache.
+
+        The size and modification time of the files the data was read from
+        are recorded, and the cache for a variable is ignored if any of them
+        has changed. Stages that were finished after the cache was written
+        are read from the block files as usual.
+
+        """
+        if not self._readonly_mode:
+            raise RuntimeError(
+                "The store must be opened with mode 'r' to materialize the cache"
+            )
+        n_stages = self.max_safe_frame
+        if not n_stages:
+            raise RuntimeError("There are no finished blocks to cache")
+        if variables is None:
+            with self._open_block(0) as dataset:
+                variables = [
+                    name
+                    for name, variable in dataset.variables.items()
+                    if name not in ["stage_checksums", "walker_index"]
+                    and _is_stage_variable(variable)
+                ]
+
+        # read from the netcdf files, not the old cache
+        self._memmaps = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        manifest = self._read_cache_manifest()
+        sources = self._cache_sources(n_stages)
+        for name in variables:
+            path = os.path.join(self.cache_dir, f"{name}.npy")
+            tmp_path = path + ".tmp"
+            cache = None
+            blocks = self._iterate_blocks(
+                name, 0, n_stages, (slice(None),), masked=False
+            )
+            start = 0
+            for data in blocks:
+                if cache is None:
+                    cache_dtype = data.dtype
+                    if dtype is not None and data.dtype.kind == "f":
+                        cache_dtype = np.dtype(dtype)
+                    cache = np.lib.format.open_memmap(
+                        tmp_path,
+                        mode="w+",
+                        dtype=cache_dtype,
+                        shape=data.shape[:-1] + (n_stages,),
+                    )
+                cache[..., start : start + data.shape[-1]] = data
+                start += data.shape[-1]
+            cache.flush()
+            del cache
+            os.replace(tmp_path, path)
+            manifest[name] = {"n_stages": n_stages, "sources": sources}
+
+        checkpoint.atomic_write(
+            self.cache_manifest_path, json.dumps(manifest, indent=2).encode()
+        )
+        self._load_memmap_cache()
+        return n_stages
+
     #
     # private methods
     #
 
     def _create_cdf_file(self):
         # create the file
-        path = self.net_cdf_path_template.format(self._current_block)
-        ds = cdf.Dataset(path, "w", format="NETCDF4")
+        path = self._block_file(self._current_block)
+        ds = self._backend.open(path, "w")
+        ds.setncatts(self._storage_profile.to_attributes())
+        ds.committed_stage = -1
 
         # setup dimensions
         ds.createDimension("n_replicas", self._n_replicas)
@@ -622,89 +1572,132 @@ class DataStore:
         ds.createDimension("timesteps", None)
 
         # setup variables
-        ds.createVariable(
-            "positions",
-            float,
-            ["n_replicas", "n_atoms", "cartesian", "timesteps"],
-            zlib=True,
-            fletcher32=True,
-            shuffle=True,
-            complevel=9,
-        )
-        ds.createVariable(
-            "velocities",
-            float,
-            ["n_replicas", "n_atoms", "cartesian", "timesteps"],
-            zlib=True,
-            fletcher32=True,
-            shuffle=True,
-            complevel=9,
-        )
-        ds.createVariable(
+        profile = self._storage_profile
+        policy = self._storage_policy
+        atom_dims = ["n_replicas", "n_atoms", "cartesian", "timesteps"]
+        if policy.atoms is not None:
+            ds.createDimension("n_stored_atoms", len(policy.atoms))
+            atom_dims[1] = "n_stored_atoms"
+            ds.createVariable("stored_atoms", int, ["n_stored_atoms"])[
+                :
+            ] = policy.atoms
+        if profile.position_precision is None:
+            self._create_variable(ds, "positions", profile.float_type, atom_dims)
+        else:
+            positions = self._create_variable(ds, "positions", "i4", atom_dims)
+            positions.scale_factor = profile.position_precision
+        self._create_variable(ds, "velocities", profile.float_type, atom_dims)
+        self._create_variable(
+            ds,
             "box_vectors",
-            float,
+            profile.float_type,
             ["n_replicas", "cartesian", "timesteps"],
-            zlib=True,
-            fletcher32=True,
-            shuffle=True,
-            complevel=9,
         )
-        ds.createVariable(
-            "alphas",
-            float,
-            ["n_replicas", "timesteps"],
-            zlib=True,
-            fletcher32=True,
-            shuffle=True,
-            complevel=9,
+        self._create_variable(ds, "alphas", float, ["n_replicas", "timesteps"])
+        self._create_variable(ds, "energies", float, ["n_replicas", "timesteps"])
+        self._create_variable(
+            ds, "permutation_vectors", int, ["n_replicas", "timesteps"]
         )
-        ds.createVariable(
-            "energies",
-            float,
-            ["n_replicas", "timesteps"],
-            zlib=True,
-            fletcher32=True,
-            shuffle=True,
-            complevel=9,
+        self._create_variable(ds, "replica_ranks", int, ["n_replicas", "timesteps"])
+        self._create_variable(ds, "replica_stages", int, ["n_replicas", "timesteps"])
+        self._create_variable(
+            ds, "exchange_attempts", int, ["n_replica_pairs", "timesteps"]
         )
-        ds.createVariable(
-            "permutation_vectors",
-            int,
-            ["n_replicas", "timesteps"],
-            zlib=True,
-            fletcher32=True,
-            shuffle=True,
-            complevel=9,
+        self._create_variable(
+            ds, "exchange_successes", int, ["n_replica_pairs", "timesteps"]
         )
-        ds.createVariable(
-            "energy_matrix",
-            float,
-            ["n_replicas", "n_replicas", "timesteps"],
-            zlib=True,
-            fletcher32=True,
-            shuffle=True,
-            complevel=9,
+        if policy.energy_matrix_band is None:
+            self._create_variable(
+                ds, "energy_matrix", float, ["n_replicas", "n_replicas", "timesteps"]
+            )
+        else:
+            ds.createDimension("n_band", 2 * policy.energy_matrix_band + 1)
+            self._create_variable(
+                ds, "energy_matrix_band", float, ["n_replicas", "n_band", "timesteps"]
+            )
+        self._create_variable(
+            ds, "acceptance_probabilities", float, ["n_replica_pairs", "timesteps"]
         )
-        ds.createVariable(
-            "acceptance_probabilities",
-            float,
-            ["n_replica_pairs", "timesteps"],
-            zlib=True,
-            fletcher32=True,
+        self._create_variable(ds, "stage_checksums", int, ["timesteps"])
+
+        if not policy.stores_all_states:
+            # the complete state of the last two stages, for restarts
+            ds.createDimension("restart_slots", 2)
+            restart_dims = ["restart_slots", "n_replicas", "n_atoms", "cartesian"]
+            ds.createVariable("restart_positions", profile.float_type, restart_dims)
+            ds.createVariable("restart_velocities", profile.float_type, restart_dims)
+            ds.createVariable(
+                "restart_box_vectors",
+                profile.float_type,
+                ["restart_slots", "n_replicas", "cartesian"],
+            )
+            ds.createVariable("restart_stages", int, ["restart_slots"])[:] = -1
+
+        self._cdf_data_set = ds
+        ds.sync()
+        self._write_committed_stage_file()
+
+    @staticmethod
+    def _create_consolidated_variable(
+        ds, name, dtype, dimensions, complevel, chunk_bytes
+    ):
+        # one replica per chunk, with as many stages as fit in chunk_bytes
+        chunksizes = [len(ds.dimensions[d]) for d in dimensions[:-1]]
+        if dimensions[0] == "n_replicas":
+            chunksizes[0] = 1
+        stage_bytes = dtype.itemsize * int(np.prod(chunksizes))
+        n_stages = len(ds.dimensions[dimensions[-1]])
+        chunksizes.append(max(1, min(n_stages, int(chunk_bytes // stage_bytes))))
+        return ds.createVariable(
+            name,
+            dtype,
+            dimensions,
+            zlib=complevel > 0,
             shuffle=True,
-            complevel=9,
+            complevel=complevel,
+            chunksizes=chunksizes,
         )
 
-        self._cdf_data_set = ds
+    def _compute_walker_index(self, end):
+        # follow each walker through the permutations, stage 0 has no
+        # exchanges
+        permutations = self.load_range("permutation_vectors", 0, end)
+        walkers = np.arange(self._n_replicas)
+        walker_index = np.empty((self._n_replicas, end), dtype=int)
+        walker_index[:, 0] = walkers
+        for stage in range(1, end):
+            walkers = walkers[permutations[:, stage]]
+            walker_index[:, stage] = walkers
+        return walker_index
+
+    def _create_variable(self, ds, name, dtype, dimensions):
+        profile = self._storage_profile
+        chunksizes = None
+        if profile.chunk_stages is not None:
+            chunksizes = [len(ds.dimensions[d]) for d in dimensions[:-1]]
+            if "n_atoms" in dimensions or "n_stored_atoms" in dimensions:
+                # one replica per chunk
+                chunksizes[0] = 1
+            chunksizes.append(profile.chunk_stages)
+        return ds.createVariable(
+            name,
+            dtype,
+            dimensions,
+            zlib=profile.complevel > 0,
+            fletcher32=profile.fletcher32,
+            shuffle=True,
+            complevel=profile.complevel,
+            chunksizes=chunksizes,
+        )
 
     def _backup(self, src, dest):
         if os.path.exists(src):
             try:
-                shutil.copy(src, dest)
+                checkpoint.link_or_copy(src, dest)
             except IOError:
                 # if we encounter an error, wait five seconds and try again
                 time.sleep(5)
-                shutil.copy(src, dest)
+                checkpoint.link_or_copy(src, dest)
 
     def _can_save(self):
         if self._readonly_mode:
@@ -716,16 +1709,25 @@ class DataStore:
         self._current_stage = stage
         block_index = self._block_for_stage(stage)
 
+        if len(self._buffered_stages() | {stage}) > self._buffer_stages:
+            self._flush_stage_buffer()
+
         if block_index > self._current_block:
             self.close()
             self._max_safe_block = self._current_block
             self._current_block = block_index
             self._create_cdf_file()
 
+        committed = self.committed_stage
+        if committed is not None and stage <= committed:
+            # the stage is being run again, e.g. after a crash before the
+            # runner was saved, so it is no longer complete
+            self._uncommit_stages(stage)
+
     def _handle_load_stage(self, stage):
         block_index = self._block_for_stage(stage)
         if self._readonly_mode:
-            if block_index > self._max_safe_block:
+            if stage >= self.max_safe_frame:
                 raise RuntimeError("Tried to read an unsafe block")
         else:
             if block_index < self._current_block:
@@ -734,22 +1736,664 @@ class DataStore:
                     "which is not allowed."
                 )
 
-        if block_index != self._current_block:
+        # in live mode, the current block is closed when refreshing
+        reopen = self._live_mode and not self._cdf_data_set
+        if block_index != self._current_block or reopen:
             self.close()
             self._current_block = block_index
             self._load_cdf_file_readonly()
+        self._check_live_stages(self._cdf_data_set, block_index, stage, stage + 1)
+
+    def _save_variable(self, name, value, stage):
+        if self._buffer_stages == 1:
+            self._cdf_data_set.variables[name][..., stage] = value
+        else:
+            variable = self._cdf_data_set.variables[name]
+            if "scale_factor" in variable.ncattrs():
+                # round to the precision it will be stored with
+                scale = variable.scale_factor
+                value = np.around(np.ma.asarray(value) / scale) * scale
+            else:
+                value = np.ma.array(value, dtype=variable.dtype)
+            self._stage_buffer.setdefault(name, {})[stage] = value
+
+    def _select_stored(self, values, replicas=None):
+        # apply the storage policy's atom selection, and mask the replicas
+        # that are not stored
+        values = np.asarray(values)
+        atoms = self._storage_policy.atoms
+        if atoms is not None:
+            values = values[:, atoms]
+        if replicas is not None:
+            stored = np.ma.masked_all(values.shape, dtype=values.dtype)
+            stored[replicas] = values[replicas]
+            values = stored
+        return values
+
+    def _save_restart(self, name, value, stage):
+        if self._storage_policy.stores_all_states:
+            return
+        variables = self._cdf_data_set.variables
+        slot = stage % 2
+        variables[f"restart_{name}"][slot] = value
+        variables["restart_stages"][slot] = stage
+
+    def _load_restart(self, stage):
+        # the complete state, if it was kept for restarts
+        if self._cdf_data_set is None:
+            return None
+        variables = self._cdf_data_set.variables
+        if "restart_stages" not in variables:
+            return None
+        stages = list(np.ma.filled(variables["restart_stages"][:], -1))
+        if stage not in stages:
+            return None
+        slot = stages.index(stage)
+        return tuple(
+            np.array(variables[f"restart_{name}"][slot])
+            for name in ["positions", "velocities", "box_vectors"]
+        )
+
+    def _load_variable(self, name, stage):
+        cached = self._load_cached(name, stage)
+        if cached is not None:
+            return cached
+        buffered = self._stage_buffer.get(name, {})
+        if stage in buffered:
+            return np.ma.masked_array(buffered[stage], copy=True)
+        return self._cdf_data_set.variables[name][..., stage]
+
+    def _load_cached(self, name, stage):
+        # a masked copy, like the data read from the block files, with the
+        # stages that were not stored masked
+        cached = self._memmaps.get(name)
+        if cached is None or stage >= cached.shape[-1]:
+            return None
+        data = np.array(cached[..., stage])
+        if data.dtype.kind == "f":
+            return np.ma.masked_invalid(data, copy=False)
+        return np.ma.masked_array(data)
+
+    def _buffered_stages(self):
+        return set(
+            stage for buffered in self._stage_buffer.values() for stage in buffered
+        )
+
+    def _flush_stage_buffer(self):
+        if not self._stage_buffer:
+            return
+        # write each run of consecutive stages with a single call
+        def write(name, buffered):
+            stages = sorted(buffered)
+            start = 0
+            for end in range(1, len(stages) + 1):
+                if end == len(stages) or stages[end] != stages[end - 1] + 1:
+                    values = [buffered[stage] for stage in stages[start:end]]
+                    self._cdf_data_set.variables[name][
+                        ..., stages[start] : stages[end - 1] + 1
+                    ] = np.ma.stack(values, axis=-1)
+                    start = end
+
+        if self._backend.parallel_writes and len(self._stage_buffer) > 1:
+            # each variable is a separate file
+            with concurrent.futures.ThreadPoolExecutor(
+                len(self._stage_buffer)
+            ) as executor:
+                list(executor.map(write, *zip(*self._stage_buffer.items())))
+        else:
+            for name, buffered in self._stage_buffer.items():
+                write(name, buffered)
+        self._stage_buffer = {}
+        self._write_committed_stage()
+
+    def _commit_stage(self):
+        if self._readonly_mode or not self._cdf_data_set:
+            return
+        self._completed_stage = self._current_stage
+        if not self._stage_buffer:
+            self._write_committed_stage()
+
+    def _write_committed_stage(self, force=False):
+        # record checksums for the completed stages that are now on disk,
+        # then move the watermark past them
+        ds = self._cdf_data_set
+        committed = self.committed_stage
+        if committed is None or self._completed_stage is None:
+            return
+        last_stage = min(self._completed_stage, len(ds.dimensions["timesteps"]) - 1)
+        if last_stage <= committed:
+            return
+        first_stage = max(committed + 1, self._current_block * self._block_size)
+        if not force:
+            # syncing the file is expensive, so only do it when asked to
+            n_stages = last_stage - first_stage + 1
+            if self._commit_interval is None or n_stages < self._commit_interval:
+                return
+        for stage in range(first_stage, last_stage + 1):
+            ds.variables["stage_checksums"][stage] = self._stage_checksum(stage)
+        ds.committed_stage = last_stage
+        ds.sync()
+        self._write_committed_stage_file()
+
+    def _uncommit_stages(self, stage):
+        # move the watermark back to before stage, so that its checksum is
+        # recomputed when it is completed again
+        ds = self._cdf_data_set
+        first_stage = self._current_block * self._block_size
+        ds.committed_stage = stage - 1 if stage > first_stage else -1
+        ds.sync()
+        self._completed_stage = stage - 1
+        self._write_committed_stage_file()
+
+    def _write_committed_stage_file(self):
+        # live readers find the completed stages from this small file, so
+        # they don't have to open the block that is being written
+        committed = self.committed_stage
+        if committed is None:
+            return
+        watermark = {"block": self._current_block, "committed_stage": committed}
+        checkpoint.atomic_write(
+            self.committed_stage_path,
+            json.dumps(watermark).encode(),
+            sync_directory=False,
+        )
+
+    def _read_committed_stage_file(self):
+        if not os.path.exists(self.committed_stage_path):
+            return None
+        with open(self.committed_stage_path) as watermark_file:
+            watermark = json.load(watermark_file)
+        return watermark["block"], watermark["committed_stage"]
+
+    def _read_live_block_committed_stage(self):
+        # stores written before the committed stage file only record the
+        # watermark in the block being written
+        live_block = max(self._max_safe_block + 1, 0)
+        while os.path.exists(self._block_file(live_block + 1)):
+            live_block += 1
+
+        path = self._block_file(live_block)
+        try:
+            with contextlib.closing(self._backend.open(path, "r")) as dataset:
+                attributes = dataset.ncattrs()
+                committed = (
+                    int(dataset.committed_stage)
+                    if "committed_stage" in attributes
+                    else -1
+                )
+        except OSError:
+            # the block may be in the middle of being created
+            return None
+        return live_block, committed
+
+    def _stage_checksum(self, stage, dataset=None):
+        # checksum of the data as read back from the file
+        checksum = 0
+        if dataset is None:
+            dataset = self._cdf_data_set
+        variables = dataset.variables
+        for name in sorted(variables):
+            if name != "stage_checksums" and _is_stage_variable(variables[name]):
+                data = np.ma.getdata(variables[name][..., stage])
+                checksum = zlib.crc32(np.ascontiguousarray(data).tobytes(), checksum)
+        return checksum
+
+    def _check_committed_stages(self):
+        committed = self.committed_stage
+        if committed is None:
+            # written before committed stages were recorded
+            return
+        if committed < 0 and self._current_block > 0:
+            # we stopped before completing the first stage of a new block,
+            # so resume from the end of the previous block
+            self._cdf_data_set.close()
+            self._current_block -= 1
+            self._max_safe_block = self._current_block - 1
+            path = self._block_file(self._current_block)
+            self._cdf_data_set = self._backend.open(path, "a")
+            committed = self.committed_stage
+
+        first_stage = self._current_block * self._block_size
+        checksums = self._cdf_data_set.variables["stage_checksums"]
+        for stage in range(first_stage, committed + 1):
+            if self._stage_checksum(stage) != checksums[stage]:
+                raise RuntimeError(
+                    f"Data for stage {stage} in block {self._current_block} is "
+                    "corrupt. Use prepare_restart to restart from the last backup."
+                )
+
+        # restart data for a stage that was not completed may be partial
+        variables = self._cdf_data_set.variables
+        if "restart_stages" in variables:
+            for slot, stage in enumerate(variables["restart_stages"][:]):
+                if stage > committed:
+                    variables["restart_stages"][slot] = -1
+
+    def _init_read_caches(self):
+        # block -> open read-only dataset, in order of last use
+        self._read_handles = collections.OrderedDict()
+        self._random_access_cache = _ArrayCache(self._random_access_cache_bytes)
+        # variable name -> memory-mapped array of its first stages
+        self._memmaps = {}
+        # stages of the block being written that were read intact
+        self._checked_live_stages = set()
+
+    def _check_live_stages(self, dataset, block, start, end):
+        # in live mode, the block being written is read without SWMR, so
+        # check the stages that were read against their checksums
+        if not self._live_mode or block <= self._max_safe_block:
+            return
+        if "stage_checksums" not in dataset.variables:
+            return
+        checksums = dataset.variables["stage_checksums"]
+        for stage in range(start, end):
+            if stage in self._checked_live_stages:
+                continue
+            if self._stage_checksum(stage, dataset) != checksums[stage]:
+                raise RuntimeError(
+                    f"Stage {stage} of the block being written does not match "
+                    "its checksum, it may have been read while being written. "
+                    "Try reading it again."
+                )
+            self._checked_live_stages.add(stage)
+
+    def _close_read_handles(self):
+        while self._read_handles:
+            _, dataset = self._read_handles.popitem()
+            dataset.close()
+
+    def _get_read_handle(self, block):
+        if block in self._read_handles:
+            self._read_handles.move_to_end(block)
+        else:
+            path = self._block_path(block)
+            self._read_handles[block] = storage.open_dataset(path, "r")
+            if len(self._read_handles) > self._max_open_blocks:
+                _, dataset = self._read_handles.popitem(last=False)
+                dataset.close()
+        return self._read_handles[block]
+
+    def _load_random_access(self, name, block, stage):
+        cached = self._load_cached(name, stage)
+        if cached is not None:
+            return cached
+        # only finished blocks can be cached, as the others may still change
+        key = (name, stage)
+        cacheable = block <= self._max_safe_block
+        value = self._random_access_cache.get(key) if cacheable else None
+        if value is None:
+            with self._open_block(block) as dataset:
+                value = dataset.variables[name][..., stage]
+                self._check_live_stages(dataset, block, stage, stage + 1)
+            if cacheable:
+                self._random_access_cache.put(key, value)
+        # don't let the caller modify the cached copy
+        return value.copy()
+
+    @contextlib.contextmanager
+    def _open_block(self, block):
+        if block == self._current_block and self._cdf_data_set:
+            self._flush_stage_buffer()
+            yield self._cdf_data_set
+        elif block <= self._max_safe_block and self._max_open_blocks > 0:
+            yield self._get_read_handle(block)
+        else:
+            path = self._block_path(block)
+            with contextlib.closing(storage.open_dataset(path, "r")) as dataset:
+                yield dataset
 
     def _block_for_stage(self, stage):
         return stage // self._block_size
 
     def _load_cdf_file_readonly(self):
-        path = self.net_cdf_path_template.format(self._current_block)
-        self._cdf_data_set = cdf.Dataset(path, "r")
+        path = self._block_path(self._current_block)
+        self._cdf_data_set = storage.open_dataset(path, "r")
+
+    def _block_path(self, block):
+        # the consolidated file uses the same stage numbering as the blocks
+        if (block + 1) * self._block_size <= self._consolidated_stages:
+            return self.consolidated_path
+        return self._block_file(block)
+
+    def _block_file(self, block):
+        filename = f"block_{block:06d}{self._backend.extension}"
+        return os.path.join(self.blocks_dir, filename)
+
+    @property
+    def _backend(self):
+        return storage.STORAGE_BACKENDS[self._storage_backend]
+
+    def _detect_storage_backend(self):
+        # use the backend that wrote the first block, if it still exists
+        for name, backend in storage.STORAGE_BACKENDS.items():
+            filename = f"block_{0:06d}{backend.extension}"
+            if os.path.exists(os.path.join(self.blocks_dir, filename)):
+                self._storage_backend = name
+                return
+
+    def _cache_sources(self, n_stages):
+        # files that the first n_stages are read from, with their size and
+        # modification time
+        paths = sorted(
+            set(
+                self._block_path(block)
+                for block in range(self._block_for_stage(n_stages - 1) + 1)
+            )
+        )
+        sources = []
+        for path in paths:
+            size, mtime = storage.backend_for_path(path).stat(path)
+            sources.append([path, size, mtime])
+        return sources
+
+    def _read_cache_manifest(self):
+        if not os.path.exists(self.cache_manifest_path):
+            return {}
+        with open(self.cache_manifest_path) as manifest_file:
+            return json.load(manifest_file)
+
+    def _load_memmap_cache(self):
+        self._memmaps = {}
+        for name, entry in self._read_cache_manifest().items():
+            try:
+                fresh = self._cache_sources(entry["n_stages"]) == entry["sources"]
+            except OSError:
+                # e.g. the block files were removed after consolidating
+                fresh = False
+            if fresh:
+                path = os.path.join(self.cache_dir, f"{name}.npy")
+                self._memmaps[name] = np.load(path, mmap_mode="r")
+
+    def _find_consolidated_stages(self):
+        self._consolidated_stages = 0
+        if os.path.exists(self.consolidated_path):
+            with contextlib.closing(
+                cdf.Dataset(self.consolidated_path, "r")
+            ) as dataset:
+                self._consolidated_stages = int(dataset.consolidated_stages)
+
+    @property
+    def committed_stage(self):
+        """
+        The last stage in the current block that was completely written.
+
+        This is -1 if no stages in the current block have been completed,
+        and None if the block was written before this was recorded.
+
+        """
+        if self._cdf_data_set and "committed_stage" in self._cdf_data_set.ncattrs():
+            return int(self._cdf_data_set.committed_stage)
+        return None
+
+    def verify_stage(self, stage):
+        """
+        Check that a stage was completely written.
+
+        :param stage: int stage to check
+
+        Raises RuntimeError if the stage is in the current block, but was
+        not completely written, e.g. because the run crashed. In that case,
+        the run must be restarted from the last backup.
+
+        """
+        committed = self.committed_stage
+        if committed is None or self._block_for_stage(stage) < self._current_block:
+            return
+        if stage > committed:
+            raise RuntimeError(
+                f"Stage {stage} was not completely written. The last complete "
+                f"stage is {committed}. Use prepare_restart to restart from the "
+                "last backup."
+            )
+
+    def refresh(self):
+        """
+        Check for stages that have been completed since the last refresh.
+
+        Only available in mode 'l'. Blocks before the one being written are
+        finished and can be read, along with the stages of the current block
+        that have been completed (see :attr:`committed_stage`). Stages are
+        only completed after they have been synced to disk, so they will not
+        change after they are read. The simulation only records completed
+        stages every ``commit_interval`` stages, so without it, only finished
+        blocks can be read. The completed stages are found from a
+        small file written next to the data store, so refreshing does not
+        open the block being written. That block is re-opened for each read,
+        as an open file will not see data written since it was opened.
+
+        """
+        if not self._live_mode:
+            raise RuntimeError("Only stores opened with mode 'l' can be refreshed")
+
+        watermark = self._read_committed_stage_file()
+        if watermark is None:
+            watermark = self._read_live_block_committed_stage()
+            if watermark is None:
+                # try again next time
+                return
+        live_block, committed = watermark
+
+        # drop our view of the blocks that may have changed
+        if self._cdf_data_set and self._current_block > self._max_safe_block:
+            self._cdf_data_set.close()
+            self._cdf_data_set = None
+
+        max_live_frame = max(committed + 1, live_block * self._block_size)
+        if max_live_frame < self._max_live_frame:
+            # the simulation was restarted, and is writing the stages again
+            self._checked_live_stages.clear()
+        self._max_safe_block = live_block - 1
+        self._max_live_frame = max_live_frame
 
     @property
     def max_safe_frame(self):
+        if self._live_mode:
+            return self._max_live_frame
         return (self._max_safe_block + 1) * self._block_size
 
     @property
     def max_safe_block(self):
         return self._max_safe_block
+
+
+def _band_from_matrix(matrix, width):
+    # band[i, width + offset] = matrix[i, i + offset]
+    n = matrix.shape[0]
+    rows, columns = _band_indices(n, width)
+    valid = (columns >= 0) & (columns < n)
+    band = np.full((n, 2 * width + 1), np.nan)
+    band[valid] = matrix[rows[valid], columns[valid]]
+    return band
+
+
+def _matrix_from_band(band):
+    # the inverse of _band_from_matrix, with NaN outside of the band. Any
+    # extra axes, e.g. timesteps, are kept.
+    n = band.shape[0]
+    width = (band.shape[1] - 1) // 2
+    rows, columns = _band_indices(n, width)
+    valid = (columns >= 0) & (columns < n)
+    matrix = np.full((n, n) + band.shape[2:], np.nan)
+    matrix[rows[valid], columns[valid]] = band[valid]
+    return matrix
+
+
+def _band_indices(n, width):
+    rows = np.repeat(np.arange(n)[:, np.newaxis], 2 * width + 1, axis=1)
+    columns = rows + np.arange(-width, width + 1)
+    return rows, columns
+
+
+def _is_stage_variable(variable):
+    # variables with a value for each stage, rather than e.g. restart data
+    return variable.dimensions[-1] == "timesteps"
+
+
+def _fill_masked(data):
+    # the bulk readers return plain arrays, with NaN for values that were
+    # not stored rather than the netcdf fill value
+    if data.dtype.kind == "f":
+        return np.ma.filled(data, np.nan)
+    return np.array(np.ma.getdata(data))
+
+
+def _read_block(path, variable, index):
+    # runs in a worker process
+    with contextlib.closing(storage.open_dataset(path, "r")) as dataset:
+        if variable not in dataset.variables:
+            raise ValueError(f"Unknown variable {variable}")
+        return _fill_masked(dataset.variables[variable][index])
+
+
+class _ArrayCache:
+    """
+    Least-recently-used cache of arrays with a limit on the total size.
+
+    :param max_bytes: maximum total size of the cached arrays
+
+    """
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._n_bytes = 0
+        self._arrays = collections.OrderedDict()
+
+    def get(self, key):
+        value = self._arrays.get(key)
+        if value is not None:
+            self._arrays.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if value.nbytes > self._max_bytes or key in self._arrays:
+            return
+        self._arrays[key] = value
+        self._n_bytes += value.nbytes
+        while self._n_bytes > self._max_bytes:
+            _, oldest = self._arrays.popitem(last=False)
+            self._n_bytes -= oldest.nbytes
+
+
+class AsyncDataStoreWriter:
+    """
+    Write to a DataStore from a background thread.
+
+    :param store: the DataStore to write to, which must already be initialized
+    :param max_pending: maximum number of writes waiting in the queue
+
+    Calls to the ``save_*`` methods, :meth:`DataStore.append_traj`, and
+    :meth:`DataStore.backup` are placed on a bounded queue and return
+    immediately. The arguments are copied, so the caller is free to modify
+    them afterwards. A single writer thread performs the writes in the order
+    they were made. If the queue is full, the caller blocks until there is
+    room.
+
+    :meth:`backup` waits for all pending writes to finish when a backup is
+    due, i.e. at block boundaries, and :meth:`close` waits for all pending
+    writes before closing the store. Any other attribute access, e.g. loading
+    data, also waits for pending writes and is then passed directly to the
+    underlying store. What is on disk after a backup is therefore the same
+    as with synchronous writes.
+
+    If a write fails, the remaining writes are discarded and the exception
+    is raised from every later call.
+
+    """
+
+    _queued_methods = [
+        "save_data_store",
+        "save_communicator",
+        "save_positions",
+        "save_velocities",
+        "save_box_vectors",
+        "save_states",
+        "save_partial_states",
+        "append_traj",
+        "save_alphas",
+        "save_energies",
+        "save_energy_matrix",
+        "save_permutation_vector",
+        "save_replica_ranks",
+        "save_replica_stages",
+        "save_exchange_counts",
+        "save_acceptance_probabilities",
+        "update_statistics",
+        "save_remd_runner",
+        "save_system",
+        "save_run_options",
+    ]
+
+    def __init__(self, store, max_pending=100):
+        self._store = store
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._write_loop, name="meld-data-store-writer", daemon=True
+        )
+        self._thread.start()
+
+    def __getattr__(self, name):
+        if name in self._queued_methods:
+
+            def enqueue(*args):
+                self._put(name, copy.deepcopy(args))
+
+            return enqueue
+        # everything else needs to see all of the data written so far
+        self.flush()
+        return getattr(self._store, name)
+
+    @property
+    def store(self):
+        return self._store
+
+    def backup(self, stage):
+        """
+        Backup all files to Data/Backup.
+
+        :param stage: int stage
+
+        Pending writes are flushed before returning if a backup is due.
+
+        """
+        self._put("backup", (stage,))
+        if not stage % self._store.block_size:
+            self.flush()
+
+    def flush(self):
+        """Wait until all pending writes have finished."""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Flush pending writes, stop the writer thread, and close the store."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._store.close()
+        self._raise_error()
+
+    def _put(self, name, args):
+        self._raise_error()
+        if not self._thread.is_alive():
+            raise RuntimeError("AsyncDataStoreWriter has been closed.")
+        self._queue.put((name, args))
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    name, args = item
+                    getattr(self._store, name)(*args)
+            except Exception as e:
+                # keep consuming the queue so that flush does not hang
+                self._error = e
+            finally:
+                self._queue.task_done()
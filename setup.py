@@ -18,6 +18,7 @@ setup(
     scripts=[
         "scripts/analyze_energy",
         "scripts/analyze_remd",
+        "scripts/consolidate_data",
         "scripts/extract_trajectory",
         "scripts/launch_remd",
         "scripts/process_fragments",